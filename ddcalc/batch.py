@@ -0,0 +1,271 @@
+import copy
+import json
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ddcalc.core.checkpoint import Checkpoint, DEFAULT_INTERVAL
+from ddcalc.core.data_loader import Data
+from ddcalc.corpus import export_instance, instance_id
+from ddcalc.ddcalc import DDCalc
+from ddcalc.utils.logcontext import request_context
+from ddcalc.utils.metrics import Metrics
+from ddcalc.utils.scheduler import available_cpus, configure_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Options of solve_options() that shape the model (the arguments of DDCalc.prepare)
+MODEL_OPTIONS = ('pessimistic_taxes', 'pessimistic_healthcare', 'allow_conversions', 'no_conversions',
+                 'no_conversions_after_socsec', 'horizon')
+
+
+def solve_options(config_data):
+    """
+    Reads the solver options from the 'arguments' section of a request
+    payload. Returns (objective_config, keyword arguments for DDCalc.solve).
+    """
+    args_data = config_data.get('arguments', {})
+    objective_cfg = args_data.get('objective', {'type': 'max_spend'}) # Default if not provided
+    options = {
+        'pessimistic_taxes': args_data.get('pessimistic_taxes', False),
+        'pessimistic_healthcare': args_data.get('pessimistic_healthcare', False),
+        'allow_conversions': args_data.get('allow_conversions', True),
+        'no_conversions': args_data.get('no_conversions', False),
+        'no_conversions_after_socsec': args_data.get('no_conversions_after_socsec', False),
+        'horizon': args_data.get('horizon'),  # None: annual
+        'mode': args_data.get('mode'),        # None: exact
+        'alternatives': args_data.get('alternatives', 0),
+        'alternatives_tolerance': args_data.get('alternatives_tolerance', 0.01),
+        'alternatives_mode': args_data.get('alternatives_mode', 'best'),
+        'scaling': args_data.get('scaling', True),
+    }
+    return objective_cfg, options
+
+
+def solve_plan(config_data, data=None, request_id=None, checkpoints=None):
+    """
+    Loads and solves one plan from a request payload.
+
+    Args:
+        config_data (dict): The configuration, with solver options under 'arguments'.
+        data (Data, optional): Instance to load into, so the caller can read
+            its metrics afterwards.
+        request_id (str, optional): Tag for the log records of this solve.
+        checkpoints (dict, optional): {'dir': ..., 'interval': ...} to
+            checkpoint long solves in, keyed by the config hash (see
+            core.checkpoint).
+
+    Returns:
+        DDCalc: The solved calculator.
+    """
+    if data is None:
+        data = Data()
+    data.load_config(config_data)
+    objective_cfg, options = solve_options(config_data)
+    checkpoint = None
+    if checkpoints:
+        checkpoint = Checkpoint(checkpoints['dir'], instance_id(config_data),
+                                checkpoints.get('interval', DEFAULT_INTERVAL))
+    ddcalc = DDCalc(data, objective_config=objective_cfg, request_id=request_id, checkpoint=checkpoint)
+    ddcalc.solve(**options)
+    return ddcalc
+
+
+def estimate_plan(config_data, data=None, request_id=None, binaries=None):
+    """
+    Loads one plan and returns DDCalc.estimate() for it (LP relaxation,
+    optionally with binaries cached from an exact solve).
+    """
+    if data is None:
+        data = Data()
+    data.load_config(config_data)
+    objective_cfg, options = solve_options(config_data)
+    for key in ('mode', 'alternatives', 'alternatives_tolerance', 'alternatives_mode', 'scaling'):
+        options.pop(key, None) # an estimate is always a single LP relaxation
+    ddcalc = DDCalc(data, objective_config=objective_cfg, request_id=request_id)
+    return ddcalc.estimate(binaries=binaries, **options)
+
+
+def deep_merge(base, override):
+    """Returns a copy of base with override merged in (nested dicts merged, other values replaced)."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def expand_batch(payload):
+    """
+    Turns a batch payload into a list of configs. Accepted forms:
+        [config, ...]
+        {"configs": [config, ...]}
+        {"base": config, "overrides": [partial config, ...]}
+
+    Raises:
+        ValueError: If the payload has none of these forms.
+    """
+    if isinstance(payload, list):
+        configs = payload
+    elif isinstance(payload, dict) and 'configs' in payload:
+        configs = payload['configs']
+    elif isinstance(payload, dict) and 'base' in payload:
+        overrides = payload.get('overrides') or [{}]
+        configs = [deep_merge(payload['base'], o) for o in overrides]
+    else:
+        raise ValueError("Batch must be a list of configs, {'configs': [...]} or {'base': {...}, 'overrides': [...]}")
+    if not isinstance(configs, list) or not all(isinstance(c, dict) for c in configs):
+        raise ValueError("Every batch item must be a config object")
+    return configs
+
+
+def solve_item(config_data, request_id=None, keep_binaries=False, export=None, checkpoints=None):
+    """
+    Worker entry point: solves one config and never raises. Returns a dict
+    with the run's 'metrics' and 'result', 'error' or both: when the solver
+    finds no plan, 'result' is None (as from /calculate) and 'error' says why.
+    With keep_binaries the solution's binaries are included as 'binaries'.
+    With export ({'dir': ..., 'min_seconds': ...}) the model is written to
+    that corpus directory when the solve took at least min_seconds. With
+    checkpoints, long solves are checkpointed and resumed (see solve_plan).
+    """
+    data = Data()
+    try:
+        with request_context(request_id):
+            ddcalc = solve_plan(config_data, data, checkpoints=checkpoints)
+            if export:
+                export_model(ddcalc, config_data, export)
+            binaries = ddcalc.binary_values() if keep_binaries else None
+            results = ddcalc.get_results()
+            ddcalc.release()
+        if results is None:
+            return {'result': None, 'error': "Solver did not find an optimal/feasible solution", 'metrics': data.metrics.as_dict()}
+        item = {'result': results, 'metrics': data.metrics.as_dict()}
+        if keep_binaries:
+            item['binaries'] = binaries
+        return item
+    except Exception as e:
+        logger.exception("Calculation failed")
+        return {'error': f"Calculation failed: {str(e)}", 'metrics': data.metrics.as_dict()}
+
+
+def export_model(ddcalc, config_data, export):
+    """Writes a solved plan's model to the export corpus (see ddcalc.corpus); failures are only logged."""
+    if ddcalc.metrics.timers.get('solve', 0.0) < export.get('min_seconds', 0):
+        return
+    try:
+        export_instance(ddcalc, config_data, export['dir'])
+    except Exception:
+        logger.exception("Model export failed")
+
+
+def default_workers():
+    return available_cpus()
+
+
+def init_worker(policy, cpus):
+    """Pool initializer: limits each worker's solver threads to its share of the CPUs."""
+    configure_scheduler(policy, cpus)
+
+
+def make_executor(workers=None, policy='auto'):
+    """
+    Creates a process pool whose workers split the available CPUs between
+    them, so concurrent solves don't oversubscribe the machine.
+    """
+    workers = workers or default_workers()
+    share = max(1, available_cpus() // workers)
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(policy, share))
+
+
+def failed_item(error):
+    """A solve_item() result for a config whose worker failed, e.g. died with the pool."""
+    return {'error': f"Calculation failed: {error or type(error).__name__}", 'metrics': Metrics().as_dict()}
+
+
+def collect(futures):
+    """
+    Waits for {key: future of solve_item} and returns ({key: item}, keys
+    lost with a broken pool). A future that raises gets a failed_item()
+    instead of failing the others.
+    """
+    solved, lost = {}, []
+    for key, future in futures.items():
+        try:
+            solved[key] = future.result()
+        except BrokenProcessPool as e:
+            lost.append(key)
+            solved[key] = failed_item(e)
+        except Exception as e:
+            logger.exception("Batch item failed")
+            solved[key] = failed_item(e)
+    if lost:
+        logger.error("Worker pool broke: %d items lost", len(lost))
+    return solved, lost
+
+
+def run_batch(configs, executor=None, request_id=None, export=None, checkpoints=None, new_executor=None,
+              concurrency=None):
+    """
+    Solves a list of configs in parallel and returns one item per config, in
+    order (see solve_item). Identical configs are solved once. An item whose
+    worker fails gets an 'error' instead of failing the batch. When a worker
+    dies and breaks the pool, the items it lost are retried once each, on a
+    new pool whenever the last one broke, so only an item that kills its
+    worker fails again.
+
+    Args:
+        configs (list): Request payloads.
+        executor (Executor, optional): Pool to run on. A pool from
+            make_executor() is created (and shut down) if not given.
+        request_id (str, optional): Tag for the log records of the items.
+        export (dict, optional): Model export settings (see solve_item).
+        checkpoints (dict, optional): Checkpoint settings (see solve_plan).
+        new_executor (callable, optional): Called with the caller's broken
+            pool, returns the pool to use instead (see
+            server.replace_executor). Without it, items lost with the
+            caller's pool are not retried.
+        concurrency (int, optional): Items on the pool at once, for a pool
+            shared with other requests. Defaults to all of them.
+    """
+    keys = [json.dumps(c, sort_keys=True) for c in configs]
+    unique = {}
+    for key, config in zip(keys, configs):
+        unique.setdefault(key, config)
+    logger.info("Batch of %d configs, %d unique", len(configs), len(unique))
+
+    slots = threading.BoundedSemaphore(concurrency or len(unique) or 1)
+
+    def submit(keys):
+        futures = {}
+        for key in keys:
+            slots.acquire()
+            try:
+                futures[key] = executor.submit(solve_item, unique[key], request_id, False, export, checkpoints)
+            except BrokenProcessPool as e:
+                futures[key] = Future()
+                futures[key].set_exception(e)
+            futures[key].add_done_callback(lambda future: slots.release())
+        return futures
+
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor(min(len(unique), default_workers()) or 1)
+    try:
+        solved, lost = collect(submit(unique))
+        broken = bool(lost)
+        for key in lost if own_executor or new_executor else []:
+            if broken and own_executor:
+                executor.shutdown(wait=False)
+                executor = make_executor(1)
+            elif broken:
+                executor = new_executor(executor)
+            retried, broken = collect(submit([key]))
+            solved.update(retried)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return [solved[key] for key in keys]
@@ -0,0 +1,66 @@
+import gzip
+import json
+import threading
+import time
+
+# Top-level config sections that affect the plan.  Anything else (comments,
+# client metadata) is dropped from captured payloads.
+CONFIG_KEYS = ['inflation', 'returns', 'startage', 'endage', 'birthmonth',
+               'taxes', 'aca', 'aftertax', 'IRA', 'roth', 'income', 'expense',
+               'arguments']
+
+
+def sanitize(config):
+    """
+    Returns a copy of a /calculate payload that is safe to store: only the
+    sections that affect the plan are kept, and user-chosen income/expense
+    names are replaced with generic ones ('social_security' is kept since
+    it is treated specially by the model).
+    """
+    clean = {k: config[k] for k in CONFIG_KEYS if k in config}
+    for section in ('income', 'expense'):
+        if section in clean:
+            renamed = {}
+            for i, (name, entry) in enumerate(clean[section].items()):
+                key = name if name == 'social_security' else f"{section}_{i}"
+                renamed[key] = entry
+            clean[section] = renamed
+    return json.loads(json.dumps(clean))
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class CaptureWriter:
+    """
+    Appends one compact JSON line per request to a capture file (gzip
+    compressed if the path ends in .gz).  Safe to share between threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, endpoint, config, seconds, status, solves=None):
+        record = {
+            't': round(time.time(), 3),
+            'endpoint': endpoint,
+            'config': sanitize(config),
+            'seconds': round(seconds, 6),
+            'status': status,
+            'solves': solves or [],
+        }
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock, _open(self.path, 'a') as f:
+            f.write(line)
+
+
+def read_capture(path):
+    """Yields the records of a capture file in the order they were written."""
+    with _open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
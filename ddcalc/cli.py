@@ -1,20 +1,74 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
+import json
+import logging
 import sys # Import sys for sys.exit
 
-from ddcalc.core.data_loader import Data
-from ddcalc.ddcalc import DDCalc
+# Only light modules here, so --help and argument errors return at once;
+# PuLP and the model are imported in run() once the arguments are parsed.
+from ddcalc.core.modes import HORIZONS, SOLVE_MODES, POOL_MODES, ROBUST_MEASURES, ROBUST_METHODS
+from ddcalc.core.checkpoint import DEFAULT_INTERVAL
+from ddcalc.daemon import NO_DAEMON_FLAG, forward
+from ddcalc.utils.scheduler import configure_scheduler, parse_policy
+from ddcalc.utils.profiler import Sampler, DEFAULT_INTERVAL as PROFILE_INTERVAL
 
 
 def main():
+    """Runs the command in a ddcalc-daemon if one is running, else here (see run)."""
+    if NO_DAEMON_FLAG not in sys.argv[1:]:
+        code = forward(sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
+    run()
+
+
+def run(argv=None):
     # Instantiate the parser
     parser = argparse.ArgumentParser(description="Financial planning using Linear Programming (PuLP version)")
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Extra output from solver")
     parser.add_argument('--csv', action='store_true', help="Generate CSV outputs")
+    parser.add_argument('--log-level', default='WARNING',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Logging level for progress messages (written to stderr)")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Print stage timings, model size and solver statistics to stderr")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Sample the stacks from loading to extracting the results and write them to FILE as collapsed stacks (for flame graphs), with Python and solver subprocess time separated")
+    parser.add_argument('--profile-interval', type=float, default=PROFILE_INTERVAL,
+                        help=f"Seconds between profile samples (default {PROFILE_INTERVAL})")
     parser.add_argument('--timelimit',
                         help="After given seconds return the best answer found (solver dependent)")
+    parser.add_argument('--solver-threads', type=parse_policy, default='auto',
+                        help="CBC threads: auto (all available CPUs for large models, 1 for small), single, all, or a number")
+    parser.add_argument('--horizon', choices=HORIZONS,
+                        help="annual: model every year (default); multi: annual near term and around rule changes, multi-year steps elsewhere (faster, approximate)")
+    parser.add_argument('--mode', choices=SOLVE_MODES,
+                        help="exact: solve the full model (default); fast: relax-and-fix, near-optimal with a reported gap bound; race: run several solver setups at once and keep the first answer")
+    parser.add_argument('--alternatives', type=int, default=0, metavar='K',
+                        help="Also find up to K alternative plans whose spending floor is within --alternatives-tolerance of the best")
+    parser.add_argument('--alternatives-tolerance', type=float, default=0.01,
+                        help="Largest relative loss in the objective an alternative plan may have (default 0.01)")
+    parser.add_argument('--alternatives-mode', choices=POOL_MODES, default='best',
+                        help="best: the best plans that differ; diverse: the plans that differ the most (slower)")
+    parser.add_argument('--no-scaling', action='store_true',
+                        help="Solve the model in dollars instead of scaled units (for comparison; usually slower)")
+    parser.add_argument('--robust', choices=ROBUST_MEASURES,
+                        help="One plan for the [[scenarios]] of the config (returns/inflation variants): share the first years' withdrawals and conversions and maximize the expected or worst-case spending floor")
+    parser.add_argument('--robust-method', choices=ROBUST_METHODS,
+                        help="decomposed: solve the scenarios in parallel, coordinated by a consensus master (default for expected; not for worst); monolithic: one model of all scenarios (exact, for small cases; default for worst)")
+    parser.add_argument('--first-stage-years', type=int, default=1,
+                        help="Years whose decisions all scenarios share with --robust (default 1)")
+    parser.add_argument('--compare-states', metavar='STATES',
+                        help="Compare retiring in other states: solve the plan with the income tax of each of STATES (comma-separated abbreviations, or 'all') in parallel and rank them by spending floor and lifetime state tax")
+    parser.add_argument('--checkpoint-dir',
+                        help="Save the best plan so far of long solves to this directory every --checkpoint-interval seconds, and resume from it when run again")
+    parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds of solving between checkpoints (default {DEFAULT_INTERVAL})")
+    parser.add_argument('--export-dir',
+                        help="Write the built model (compressed MPS and LP), config, solver settings and statistics to this corpus directory")
     parser.add_argument('--pessimistic-taxes', action='store_true',
                         help="Simulate higher future taxes by increasing the tax bracket caps slower than inflation")
     parser.add_argument('--pessimistic-healthcare', action='store_true',
@@ -35,13 +89,34 @@ def main():
     conversion_group.add_argument('--no-conversions-after-socsec', action='store_true',
                                   help="Disallow Roth conversions after Social Security benefits begin.")
 
+    parser.add_argument(NO_DAEMON_FLAG, action='store_true',
+                        help="Solve in this process even if a ddcalc-daemon is running")
     parser.add_argument('conffile', help="Configuration file in TOML format")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(levelname)s %(name)s: %(message)s", force=True)
+
+    from ddcalc.core.data_loader import Data
+    from ddcalc.ddcalc import DDCalc
+    from ddcalc.corpus import export_instance, instance_id
+    from ddcalc.core.checkpoint import Checkpoint
+    from ddcalc.utils.metrics import memory_gauges
+    configure_scheduler(args.solver_threads)
+
+    profiling = contextlib.ExitStack()
+    if args.profile:
+        profile = profiling.enter_context(profiling.enter_context(Sampler(args.profile_interval)).profile())
 
     # -- Load Configuration File --
     data = Data()
     data.load_config(args.conffile) # Use load_config
 
+    if args.robust:
+        run_robust(args, data)
+        return
+    if args.compare_states:
+        run_compare_states(args)
+        return
+
     # --- Determine primary objective from args ---
     objective_config = {'type': 'max_spend'} # Default
     if args.max_assets:
@@ -51,7 +126,10 @@ def main():
 
     # --- Use the DDCalc class ---
     # The DDCalc class will need to be updated to handle these new conversion args
-    ddcalc = DDCalc(data, objective_config)
+    checkpoint = None
+    if args.checkpoint_dir:
+        checkpoint = Checkpoint(args.checkpoint_dir, instance_id(args.conffile), args.checkpoint_interval)
+    ddcalc = DDCalc(data, objective_config, checkpoint=checkpoint)
 
     ddcalc.solve(
         timelimit=args.timelimit,
@@ -64,16 +142,32 @@ def main():
         allow_conversions=args.allow_conversions, # This will be True if explicitly set, or False if another option in the group is set or none are.
                                                   # We might need to adjust logic if --allow-conversions is the default.
         no_conversions=args.no_conversions,
-        no_conversions_after_socsec=args.no_conversions_after_socsec
+        no_conversions_after_socsec=args.no_conversions_after_socsec,
+        horizon=args.horizon,
+        mode=args.mode,
+        alternatives=args.alternatives,
+        alternatives_tolerance=args.alternatives_tolerance,
+        alternatives_mode=args.alternatives_mode,
+        scaling=not args.no_scaling
         # relTol_steps can be passed if you want to override the default in ddcalc.solve
     )
 
+    if args.export_dir:
+        print(f"Model exported to {export_instance(ddcalc, args.conffile, args.export_dir)}", file=sys.stderr)
 
     # --- Process Results ---
-    if ddcalc.status in ["Optimal", "Not Solved"]: # Check status from ddcalc object
-        # get_results is called implicitly by the print methods if needed,
-        # but calling it explicitly first is fine too.
-        results = ddcalc.get_results()
+    solved = ddcalc.status in ["Optimal", "Not Solved"] # Check status from ddcalc object
+    # get_results is called implicitly by the print methods if needed,
+    # but calling it explicitly first is fine too.
+    results = ddcalc.get_results() if solved else None
+    profiling.close()
+    if args.profile:
+        profile.write(args.profile)
+        summary = profile.summary()
+        data.metrics.record_profile(summary)
+        print(f"Profile written to {args.profile}: {summary['python_seconds']:.2f}s Python, "
+              f"{summary['solver_seconds']:.2f}s solver ({summary['samples']} samples)", file=sys.stderr)
+    if solved:
         if results:
             if args.csv:
                 ddcalc.print_results_csv()
@@ -81,9 +175,57 @@ def main():
                 ddcalc.print_results_ascii()
         else:
             print("Failed to retrieve results even though solver status was acceptable.")
-    else:
+
+    if args.metrics:
+        print(json.dumps(dict(data.metrics.as_dict(), memory=memory_gauges()), indent=2), file=sys.stderr)
+
+    if not solved:
         print(f"Solver did not find an optimal/feasible solution (Status: {ddcalc.status}).")
         sys.exit(1)
 
+def _read_config(args):
+    """The config file with the model options and objective of the command line under 'arguments'."""
+    from ddcalc.corpus import read_config
+    config = read_config(args.conffile)
+    arguments = config.setdefault('arguments', {})
+    for key in ('pessimistic_taxes', 'pessimistic_healthcare', 'no_conversions', 'no_conversions_after_socsec'):
+        arguments[key] = getattr(args, key)
+    arguments['horizon'] = args.horizon
+    if args.max_assets:
+        arguments['objective'] = {'type': 'max_assets', 'value': args.max_assets}
+    elif args.min_taxes:
+        arguments['objective'] = {'type': 'min_taxes', 'value': args.min_taxes}
+    return config
+
+def run_robust(args, data):
+    """Solves and prints the plan robust across the config's scenarios (see ddcalc.robust)."""
+    from ddcalc.robust import solve_robust, print_robust
+    config = _read_config(args)
+    if not config.get('scenarios'):
+        print("--robust needs [[scenarios]] in the config (e.g. returns = 4 and inflation = 3 each).")
+        sys.exit(2)
+    try:
+        summary = solve_robust(config, config['scenarios'], args.robust, args.first_stage_years, args.robust_method,
+                               float(args.timelimit) if args.timelimit else None)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    print_robust(summary, data)
+    if summary['status'] != "Optimal":
+        sys.exit(1)
+
+def run_compare_states(args):
+    """Solves the plan in each state of --compare-states and prints them ranked (see ddcalc.relocation)."""
+    from ddcalc.relocation import compare_states, print_relocation
+    states = None if args.compare_states.lower() == 'all' else [s.strip() for s in args.compare_states.split(',') if s.strip()]
+    try:
+        summary = compare_states(_read_config(args), states, float(args.timelimit) if args.timelimit else None)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    print_relocation(summary)
+    if not any(s['rank'] for s in summary['states']):
+        sys.exit(1)
+
 if __name__== "__main__":
     main()
\ No newline at end of file
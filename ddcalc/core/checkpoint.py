@@ -0,0 +1,62 @@
+import os
+import json
+import time
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Seconds of solving between checkpoints
+DEFAULT_INTERVAL = 60
+
+CHECKPOINT_ENV = 'DDCALC_CHECKPOINT_DIR'
+
+
+class Checkpoint:
+    """
+    The best plan found so far by a long-running solve, kept in
+    directory/<plan id>.json (the plan id being the config hash, see
+    corpus.instance_id) so that a solve that is killed or restarted can
+    resume from it instead of starting over.
+
+    A checkpoint holds the solve options it belongs to ('key'), the relTol
+    pass, the objective and bound, the seconds spent, whether the solve had
+    finished ('complete'), the non-zero variable values and the extracted
+    results.
+    """
+    def __init__(self, directory, plan_id, interval=DEFAULT_INTERVAL):
+        self.directory = directory
+        self.plan_id = plan_id
+        self.interval = interval
+        self.path = os.path.join(directory, f"{plan_id}.json")
+
+    def load(self):
+        """Returns the saved state, or None if there is none (or it is unreadable)."""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring checkpoint %s: %s", self.path, e)
+            return None
+
+    def save(self, state):
+        """Replaces the saved state atomically, so a kill never leaves half a file."""
+        os.makedirs(self.directory, exist_ok=True)
+        state = dict(state, plan_id=self.plan_id, updated=time.time())
+        fd, tmp = tempfile.mkstemp(prefix=f".{self.plan_id}-", suffix=".json", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f, default=str)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        logger.info("Checkpoint %s: objective %s after %.0fs", self.plan_id, state.get('objective'),
+                    state.get('seconds', 0))
+
+
+def read_checkpoint(directory, plan_id):
+    """The saved state of a plan's checkpoint, or None."""
+    return Checkpoint(directory, plan_id).load()
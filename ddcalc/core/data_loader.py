@@ -1,10 +1,26 @@
 import re
 import os
+import copy
+from array import array
+import logging
+import threading
 try:
     import tomllib
 except ModuleNotFoundError:
     import tomli as tomllib
 
+from ddcalc.utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Federal (brackets, FPL) and state tax reference tables
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'reference')
+FEDERAL_TAX_FILE = os.path.join(REFERENCE_DIR, 'taxes_federal.toml')
+STATE_TAX_FILE = os.path.join(REFERENCE_DIR, 'taxes_state.toml')
+
+# Calendar year of the first plan year (used for the RMD start age rules)
+CURRENT_YEAR = 2025
+
 # Required Minimal Distributions from IRA starting with age 73
 # last updated for 2024
 RMD = [27.4, 26.5, 25.5, 24.6, 23.7, 22.9, 22.0, 21.1, 20.2, 19.4,  # age 72-81
@@ -13,6 +29,27 @@ RMD = [27.4, 26.5, 25.5, 24.6, 23.7, 22.9, 22.0, 21.1, 20.2, 19.4,  # age 72-81
         5.6,  5.2,  4.9,  4.6,  4.3,  4.1,  3.9,  3.7,  3.5,  3.4,  # age 102+
         3.3,  3.1,  3.0,  2.9,  2.8,  2.7,  2.5,  2.3,  2.0,  2.0]
 
+# Parsed reference TOML files, keyed by path: (mtime, data).  The parsed data
+# is shared between Data instances and must be treated as read-only.
+_reference_cache = {}
+_reference_lock = threading.Lock()
+
+def load_reference(path):
+    """
+    Returns the parsed contents of a reference TOML file, reparsing it only
+    when the file has changed.
+    """
+    mtime = os.stat(path).st_mtime
+    with _reference_lock:
+        cached = _reference_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, 'rb') as f: # Use 'rb' for tomllib
+        data = tomllib.load(f)
+    with _reference_lock:
+        _reference_cache[path] = (mtime, data)
+    return data
+
 def agelist(str_val):
     for x in str_val.split(','):
         m = re.match(r'^(\d+)(-(\d+)?)?$', x)
@@ -31,6 +68,24 @@ def agelist(str_val):
             raise Exception("Bad age " + str_val)
 
 class Data:
+    # One Data is held per request, so the attributes are slots and the
+    # per-year series arrays of floats rather than lists of Python numbers.
+    __slots__ = ('metrics', 'i_rate', 'r_rate', 'startage', 'halfage', 'birthmonth', 'endage',
+                 'stded', 'state_stded', 'nii', 'fpl_amount', 'status', 'state_status',
+                 'state_taxes_ss', 'state_taxes_retirement_income', 'aca',
+                 'taxrates', 'taxtable', 'state_taxrates', 'state_taxtable', 'cg_taxrates', 'cg_taxtable',
+                 'retireage', 'numyr', 'periods', 'aftertax', 'IRA', 'roth',
+                 'income', 'expenses', 'taxed_income', 'state_taxed_income', 'social_security',
+                 'social_security_taxed', 'state_social_security_taxed', 'income_ceiling')
+
+    def __init__(self, metrics=None):
+        """
+        Args:
+            metrics (Metrics, optional): Collector for stage timings. A new one
+                is created if not given; DDCalc continues to record into it.
+        """
+        self.metrics = metrics if metrics is not None else Metrics()
+
     def load_config(self, config_source):
         """
         Loads configuration data either from a file path or a dictionary.
@@ -39,13 +94,18 @@ class Data:
             config_source: Either a string representing the file path
                            or a dictionary containing the configuration.
         """
+        with self.metrics.stage('config_load'):
+            self._load_config(config_source)
+
+    def _load_config(self, config_source):
         if isinstance(config_source, str):
-            print(f"Loading configuration from file: {config_source}")
+            logger.info("Loading configuration from file: %s", config_source)
             with open(config_source, 'rb') as conffile: # Use 'rb' for tomllib
                 d = tomllib.load(conffile)
         elif isinstance(config_source, dict):
-            print("Loading configuration from dictionary.")
-            d = config_source
+            logger.info("Loading configuration from dictionary.")
+            # Sections below are normalized in place; never modify the caller's dict
+            d = copy.deepcopy(config_source)
         else:
             raise TypeError("config_source must be a file path (str) or a dictionary (dict)")
 
@@ -97,90 +157,77 @@ class Data:
         # --- Load Federal Tax Data (Moved outside 'if taxes in d' to always load FPL if ACA info present) ---
         # This ensures FPL is loaded even if the [taxes] section is minimal or absent,
         # as long as ACA info is provided.
-        federal_tax_file_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'reference', 'taxes_federal.toml')
+        federal_tax_file_path = FEDERAL_TAX_FILE
         all_federal_data = None # Initialize to ensure it's defined
+        self.status = 'MFJ'
         try:
             filing_status = d['taxes'].get('filing_status', 'MFJ') # Default to MFJ if not specified
-            print(f"Attempting to load federal tax data from: {federal_tax_file_path}")
+            logger.info("Attempting to load federal tax data from: %s", federal_tax_file_path)
             federal_section_key = f"Federal_{filing_status}"
 
             try:
-                with open(federal_tax_file_path, 'rb') as f:
-                    all_federal_data = tomllib.load(f)
+                with self.metrics.stage('reference_load'):
+                    all_federal_data = load_reference(federal_tax_file_path)
                 federal_data = all_federal_data.get(federal_section_key)
                 if federal_data:
-                    print(f"Found federal tax data for filing status: {filing_status}")
+                    logger.info("Found federal tax data for filing status: %s", filing_status)
                     self.status = filing_status
                     tmp_taxrates = federal_data.get('brackets', tmp_taxrates)
                     self.stded = federal_data.get('standard_deduction', self.stded)
                     self.nii = federal_data.get('net_investment_income_threshold', self.nii)
                     tmp_cg_taxrates = federal_data.get('capital_gains_taxrates', tmp_cg_taxrates)
                 else:
-                    print(f"Warning: Federal tax section '{federal_section_key}' not found in {federal_tax_file_path}. Using default MFJ values.")
+                    logger.warning("Federal tax section '%s' not found in %s. Using default MFJ values.", federal_section_key, federal_tax_file_path)
             except FileNotFoundError:
-                print(f"Warning: Federal tax file not found at {federal_tax_file_path}. Using default MFJ values.")
+                logger.warning("Federal tax file not found at %s. Using default MFJ values.", federal_tax_file_path)
             except Exception as e:
-                print(f"Error loading federal tax data: {e}. Using default MFJ values.")
+                logger.error("Error loading federal tax data: %s. Using default MFJ values.", e)
         except Exception as e: # Catch errors if 'taxes' or 'filing_status' is missing
-            print(f"Could not determine filing status for federal tax load: {e}. Using default MFJ values for rates/stded/nii.")
+            logger.warning("Could not determine filing status for federal tax load: %s. Using default MFJ values for rates/stded/nii.", e)
             # Ensure all_federal_data is loaded if only filing_status was the issue, for FPL.
             if not all_federal_data and os.path.exists(federal_tax_file_path):
-                 with open(federal_tax_file_path, 'rb') as f:
-                    all_federal_data = tomllib.load(f)
+                 with self.metrics.stage('reference_load'):
+                    all_federal_data = load_reference(federal_tax_file_path)
 
         # --- State Tax Loading Logic ---
+        # Without a state in the reference, state_rate (if any) applies to all income
+        self.state_status = None
+        self.state_taxes_ss = True
+        self.state_taxes_retirement_income = True
         if state_abbr: # state_abbr is defined if 'taxes' and 'state' are in config
             state_abbr = state_abbr.upper()
             filing_status_for_state = d.get('taxes', {}).get('filing_status', 'MFJ') # Get filing_status again for state context
-            state_tax_file_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'reference', 'taxes_state.toml')
-            print(f"Attempting to load state tax data from: {state_tax_file_path}")
+            state_tax_file_path = STATE_TAX_FILE
+            logger.info("Attempting to load state tax data from: %s", state_tax_file_path)
             try:
-                with open(state_tax_file_path, 'rb') as f: # Use 'rb' for tomllib
-                    all_state_data_toml = tomllib.load(f) # Renamed to avoid conflict
+                with self.metrics.stage('reference_load'):
+                    all_state_data_toml = load_reference(state_tax_file_path) # Renamed to avoid conflict
                 heading = f'{state_abbr}_{filing_status_for_state}'
                 state_data = all_state_data_toml.get(heading)
                 if state_data:
-                    print(f"Found tax data for state: {heading}")
+                    logger.info("Found tax data for state: %s", heading)
                     self.state_status = heading
                     tmp_state_taxrates = state_data.get('brackets', default_state_taxrates)
                     self.state_stded = state_data.get('standard_deduction', 0)
                     self.state_taxes_ss = state_data.get('tax_social_security', True)
                     self.state_taxes_retirement_income = state_data.get('tax_retirement_income', True)
                 else:
-                    print(f"Warning: State abbreviation '{heading}' not found in {state_tax_file_path}. Defaulting to no state tax.")
+                    logger.warning("State abbreviation '%s' not found in %s. Defaulting to no state tax.", heading, state_tax_file_path)
                     tmp_state_taxrates = default_state_taxrates
                     self.state_stded = 0
             except FileNotFoundError:
-                print(f"Warning: State tax file not found at {state_tax_file_path}. Defaulting to no state tax.")
+                logger.warning("State tax file not found at %s. Defaulting to no state tax.", state_tax_file_path)
                 tmp_state_taxrates = default_state_taxrates
                 self.state_stded = 0
 
         # --- FPL Lookup ---
         self.aca = d.get('aca', {'premium': 0, 'slcsp': 0, 'covered': 1})
-        aca_covered_people = self.aca.get('covered', 1)
-        # Use state_abbr from taxes section if available, otherwise default or handle error
-        fpl_state_key_suffix = ""
-        if state_abbr == "AK":
-            fpl_state_key_suffix = "_AK"
-        elif state_abbr == "HI":
-            fpl_state_key_suffix = "_HI"
-
-        fpl_section_key = f"FPL{fpl_state_key_suffix}"
-        
-        if all_federal_data and fpl_section_key in all_federal_data:
-            fpl_table = dict(all_federal_data[fpl_section_key].get('fpl', []))
-            self.fpl_amount = fpl_table.get(aca_covered_people, fpl_table.get(min(fpl_table.keys(), key=lambda k: abs(k-aca_covered_people)), 0)) # Get for covered, or closest, or 0
-            print(f"FPL for {aca_covered_people} people in {state_abbr or 'N/A'} ({fpl_section_key}): {self.fpl_amount}")
-        else:
-            print(f"Warning: FPL section '{fpl_section_key}' not found in federal tax data or federal data not loaded. FPL set to 0.")
-            self.fpl_amount = 0
+        self._set_fpl(all_federal_data, state_abbr)
 
         self.taxrates = [[x,y/100.0] for (x,y) in tmp_taxrates]
         cutoffs = [x[0] for x in self.taxrates][1:] + [1e8]
         self.taxtable = list(map(lambda x, y: [x[1], x[0], y], self.taxrates, cutoffs))
-        self.state_taxrates = [[x,y/100.0] for (x,y) in tmp_state_taxrates]
-        cutoffs = [x[0] for x in self.state_taxrates][1:] + [1e8]
-        self.state_taxtable = list(map(lambda x, y: [x[1], x[0], y], self.state_taxrates, cutoffs))
+        self._set_state_rates(tmp_state_taxrates)
         self.cg_taxrates = [[x,y/100.0] for (x,y) in tmp_cg_taxrates]
         cutoffs = [x[0] for x in self.cg_taxrates][1:] + [1e8]
         self.cg_taxtable = list(map(lambda x, y: [x[1], x[0], y], self.cg_taxrates, cutoffs))
@@ -188,6 +235,8 @@ class Data:
         # vper calculations not needed for PuLP variable setup
         self.retireage = self.startage
         self.numyr = self.endage - self.retireage
+        # Model periods as (first year offset, number of years); see core.horizon
+        self.periods = [(y, 1) for y in range(self.numyr)]
 
         self.aftertax = d.get('aftertax', {'bal': 0})
         if 'basis' not in self.aftertax:
@@ -202,11 +251,65 @@ class Data:
         if 'contributions' not in self.roth:
             self.roth['contributions'] = []
 
-        print(self.taxtable)
-        print(self.state_taxtable)
+        logger.debug("Federal tax table: %s", self.taxtable)
+        logger.debug("State tax table: %s", self.state_taxtable)
 
         self.parse_expenses(d)
 
+    def _set_fpl(self, all_federal_data, state_abbr):
+        aca_covered_people = self.aca.get('covered', 1)
+        # Use state_abbr from taxes section if available, otherwise default or handle error
+        fpl_state_key_suffix = ""
+        if state_abbr == "AK":
+            fpl_state_key_suffix = "_AK"
+        elif state_abbr == "HI":
+            fpl_state_key_suffix = "_HI"
+
+        fpl_section_key = f"FPL{fpl_state_key_suffix}"
+
+        if all_federal_data and fpl_section_key in all_federal_data:
+            fpl_table = dict(all_federal_data[fpl_section_key].get('fpl', []))
+            self.fpl_amount = fpl_table.get(aca_covered_people, fpl_table.get(min(fpl_table.keys(), key=lambda k: abs(k-aca_covered_people)), 0)) # Get for covered, or closest, or 0
+            logger.info("FPL for %s people in %s (%s): %s", aca_covered_people, state_abbr or 'N/A', fpl_section_key, self.fpl_amount)
+        else:
+            logger.warning("FPL section '%s' not found in federal tax data or federal data not loaded. FPL set to 0.", fpl_section_key)
+            self.fpl_amount = 0
+
+    def _set_state_rates(self, state_taxrates):
+        self.state_taxrates = [[x,y/100.0] for (x,y) in state_taxrates]
+        cutoffs = [x[0] for x in self.state_taxrates][1:] + [1e8]
+        self.state_taxtable = list(map(lambda x, y: [x[1], x[0], y], self.state_taxrates, cutoffs))
+
+    def set_state(self, state_abbr):
+        """
+        Moves the loaded plan to another state: takes that state's income
+        tax from the state reference file (for the plan's filing status)
+        without reloading the config. Only the state tax attributes, the
+        state-taxed Social Security and the FPL (which differs in AK and HI)
+        change.
+
+        Args:
+            state_abbr (str): State abbreviation, e.g. 'CA'.
+
+        Raises:
+            ValueError: If the reference file has no section for the state.
+        """
+        state_abbr = state_abbr.upper()
+        heading = f'{state_abbr}_{getattr(self, "status", "MFJ")}'
+        with self.metrics.stage('reference_load'):
+            state_data = load_reference(STATE_TAX_FILE).get(heading)
+            all_federal_data = load_reference(FEDERAL_TAX_FILE)
+        if state_data is None:
+            raise ValueError(f"No state tax data for {heading} in {STATE_TAX_FILE}")
+        self.state_status = heading
+        self._set_state_rates(state_data.get('brackets', [[0, 0]]))
+        self.state_stded = state_data.get('standard_deduction', 0)
+        self.state_taxes_ss = state_data.get('tax_social_security', True)
+        self.state_taxes_retirement_income = state_data.get('tax_retirement_income', True)
+        # parse_expenses taxes the same 85% of Social Security as federal
+        self.state_social_security_taxed = array('d', self.social_security_taxed if self.state_taxes_ss else [0] * self.numyr)
+        self._set_fpl(all_federal_data, state_abbr)
+
     def parse_expenses(self, S):
         """ Return array of income/expense per year """
         INC = [0] * self.numyr
@@ -262,11 +365,11 @@ class Data:
                         if is_state_taxable:
                             STATE_TAX[year_idx] += amount
                 firstyear = False
-        self.income = INC
-        self.expenses = EXP
-        self.taxed_income = TAX
-        self.state_taxed_income = STATE_TAX
-        self.social_security = INC_SS
-        self.social_security_taxed = TAX_SS
-        self.state_social_security_taxed = STATE_TAX_SS
-        self.income_ceiling = CEILING
+        self.income = array('d', INC)
+        self.expenses = array('d', EXP)
+        self.taxed_income = array('d', TAX)
+        self.state_taxed_income = array('d', STATE_TAX)
+        self.social_security = array('d', INC_SS)
+        self.social_security_taxed = array('d', TAX_SS)
+        self.state_social_security_taxed = array('d', STATE_TAX_SS)
+        self.income_ceiling = array('d', CEILING)
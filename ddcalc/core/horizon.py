@@ -0,0 +1,115 @@
+import logging
+
+from ddcalc.core.data_loader import CURRENT_YEAR
+from ddcalc.core.modes import HORIZONS
+
+logger = logging.getLogger(__name__)
+
+# Per-year inputs that must grow exactly with inflation (or stay zero) for
+# years to be grouped into one multi-year step.
+STEP_SERIES = ['income', 'expenses', 'taxed_income', 'state_taxed_income', 'social_security',
+               'social_security_taxed', 'state_social_security_taxed', 'income_ceiling']
+
+
+def annual_periods(S):
+    """One period per year: the model as originally formulated."""
+    return [(y, 1) for y in range(S.numyr)]
+
+
+def transition_years(S):
+    """
+    Year offsets where the rules change and annual detail matters: 59 1/2
+    (early withdrawal penalty), Roth 5-year account age, end of ACA at 65,
+    Social Security start and RMD start.
+    """
+    years = set()
+    for y in range(S.numyr):
+        age = S.retireage + y
+        if S.halfage + y == 59:
+            years.add(y)
+        if age == 65:
+            years.add(y)
+        if S.social_security[y] > 0 and (y == 0 or S.social_security[y-1] == 0):
+            years.add(y)
+        birthyear = CURRENT_YEAR - S.startage
+        if (birthyear < 1960 and age == 73) or age == 75:
+            years.add(y)
+    age_account_open = min([ca for ca, _ in S.roth['contributions']], default=S.retireage)
+    years.add(age_account_open + 5 - S.retireage)
+    return {y for y in years if 0 <= y < S.numyr}
+
+
+def _stable(S, y):
+    """True if every per-year input in year y is year y-1's grown by inflation."""
+    for name in STEP_SERIES:
+        series = getattr(S, name)
+        prev, cur = series[y-1] * S.i_rate, series[y]
+        if abs(cur - prev) > 1e-6 * max(1.0, abs(cur), abs(prev)):
+            if not (name == 'income_ceiling' and series[y-1] >= 50_000_000 and cur >= 50_000_000):
+                return False
+    return True
+
+
+def multi_resolution_periods(S, near_years=10, max_step=5, margin=1):
+    """
+    Annual periods for the first near_years and within margin years of each
+    transition (see transition_years), plus the last year; the remaining
+    stretches are grouped into steps of up to max_step years as long as the
+    per-year inputs only grow with inflation. The model keeps steps
+    conservative (RMDs and the Roth 5-year rule are checked in every year
+    of a step), so the spending floor is at most the annual one on the
+    examples.
+
+    Returns:
+        list: (first year offset, number of years) per period, covering
+              every year of the plan in order.
+    """
+    annual = set(range(min(near_years, S.numyr)))
+    for t in transition_years(S):
+        annual.update(range(t - margin, t + margin + 1))
+    annual.add(S.numyr - 1)
+
+    periods = []
+    y = 0
+    while y < S.numyr:
+        n = 1
+        if y not in annual:
+            while (n < max_step and y + n < S.numyr and y + n not in annual
+                   and _stable(S, y + n)):
+                n += 1
+        periods.append((y, n))
+        y += n
+    return periods
+
+
+def apply_horizon(S, horizon='annual', **options):
+    """
+    Sets S.periods for the requested horizon mode ('annual' or 'multi';
+    options are passed to multi_resolution_periods).
+    """
+    if horizon == 'annual':
+        S.periods = annual_periods(S)
+    elif horizon == 'multi':
+        S.periods = multi_resolution_periods(S, **options)
+    else:
+        raise ValueError(f"Unknown horizon '{horizon}' (use {', '.join(HORIZONS)})")
+    logger.info("Horizon '%s': %d periods for %d years", horizon, len(S.periods), S.numyr)
+    return S.periods
+
+
+def growth_factors(r_rate, i_rate, n):
+    """
+    Compounding factors for a period of n years whose yearly flows start at
+    an amount w and grow with inflation:
+        balance after n years = B * r^n - w * F
+    where withdrawals are taken at the start of each year, and amounts added
+    at the end of each year (cap gains distributions, excess) contribute G:
+        balance after n years += a * G
+    For n = 1 this is B*r - w*r + a, the annual recurrence.
+
+    Returns:
+        tuple: (r^n, F, G)
+    """
+    F = sum(i_rate ** k * r_rate ** (n - k) for k in range(n))
+    G = sum(i_rate ** k * r_rate ** (n - 1 - k) for k in range(n))
+    return r_rate ** n, F, G
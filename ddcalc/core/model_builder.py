@@ -1,19 +1,29 @@
 import pulp
-from ddcalc.utils.pulp import add_min_constraints, add_max_constraints, add_if_then_constraint
-from ddcalc.core.data_loader import RMD
+from ddcalc.utils.pulp import add_min_constraints, add_max_constraints, add_if_then_constraint, make_solver
+from ddcalc.core.data_loader import RMD, CURRENT_YEAR
+from ddcalc.core.horizon import growth_factors
 
 # Minimize: c^T * x -> Defined using PuLP objective
 # Subject to: A_ub * x <= b_ub -> Defined using PuLP constraints
 # Subject to: A_eq * x == b_eq -> Defined using PuLP constraints
 def prepare_pulp(args, S):
-    current_year = 2025
+    current_year = CURRENT_YEAR
 
     # Define the problem
     prob = pulp.LpProblem("FinancialPlan", pulp.LpMaximize)
     objectives = []
+    # Big-M indicator binaries of each period (used by DDCalc's fast mode)
+    prob.indicators = {}
 
     # --- Define Variables ---
-    years_retire = range(S.numyr)
+    # The model has one set of variables per period in S.periods: one year
+    # each normally, several years for the grouped steps of a multi-resolution
+    # horizon. Flow variables hold the amount for the period's first year;
+    # later years of a period repeat it grown by inflation.
+    periods = S.periods
+    years_retire = range(len(periods))
+    offset = [first for first, _ in periods]   # year offset of each period
+    length = [n for _, n in periods]           # number of years in each period
     M = 100_000_000 # Big M for indicator constraints
 
     # --- Single Variables ---
@@ -99,10 +109,10 @@ def prepare_pulp(args, S):
          nii_vars[y, 'over'] = pulp.LpVariable(f"NII_{y}_OverBracket", lowBound=0)
          nii_vars[y, 'cg_portion'] = pulp.LpVariable(f"NII_{y}_CGPortion", lowBound=0) # Amount subject to NII
 
-    jagged = pulp.LpVariable.dicts("Jagged", range(S.numyr-1), lowBound=0)
+    jagged = pulp.LpVariable.dicts("Jagged", range(len(periods)-1), lowBound=0)
 
-    inf_adj_tax = [(total_tax[y]+hc_payment[y]) * 1 / (S.i_rate ** y) for y in years_retire]
-    for y in range(S.numyr-2):
+    inf_adj_tax = [(total_tax[y]+hc_payment[y]) * 1 / (S.i_rate ** offset[y]) for y in years_retire]
+    for y in range(len(periods)-2):
         prob += jagged[y] >= (inf_adj_tax[y+2] - inf_adj_tax[y+1]) - (inf_adj_tax[y+1] - inf_adj_tax[y]), f"Jagged_Tax_Jump_{y}"
         # prob += jagged[y] >= (inf_adj_tax[y+1] - inf_adj_tax[y]) - (inf_adj_tax[y+2] - inf_adj_tax[y+1]), f"Jagged_Tax_Jump_{y}_2"
     # Should we make a special attempt to smooth the first year?
@@ -110,17 +120,27 @@ def prepare_pulp(args, S):
     # prob += smooth[S.numyr-2] >= (inf_adj_tax[0] - 0) - (inf_adj_tax[1] - inf_adj_tax[0]), f"Smooth_Tax_Jump_{S.numyr-2}_2"
 
     for y in years_retire:
-         i_mul = S.i_rate ** y
-         spend_cgd = cgd[y-1] if y > 0 else 0 # Cap gains from *last* year are spendable
+         yr = offset[y]
+         i_mul = S.i_rate ** yr
+         # Cap gains from *last* year are spendable (the last year of the previous period)
+         spend_cgd = cgd[y-1] * S.i_rate ** (length[y-1] - 1) if y > 0 else 0
+         if length[y] > 1:
+             # The later years of a multi-year step spend the step's own
+             # distributions (level in real terms, see SaveBal) a year late,
+             # so the step spends the smaller of the two
+             step_cgd = pulp.LpVariable(f"Step_CGD_Spendable_{y}", lowBound=0)
+             prob += step_cgd <= spend_cgd, f"Step_CGD_Previous_{y}"
+             prob += step_cgd * S.i_rate <= cgd[y], f"Step_CGD_Own_{y}"
+             spend_cgd = step_cgd
          # Spending = Withdrawals + Income - Expenses - Taxes
          # We want spending_floor <= yearly spendable amount / inflation multiplier
-         total_withdrawals = f_save[y] + spend_cgd + f_ira[y] + f_roth[y] + S.income[y] + S.social_security[y]
-         total_expenses = total_tax[y] + S.expenses[y] + hc_payment[y] + spending_floor * i_mul
+         total_withdrawals = f_save[y] + spend_cgd + f_ira[y] + f_roth[y] + S.income[yr] + S.social_security[yr]
+         total_expenses = total_tax[y] + S.expenses[yr] + hc_payment[y] + spending_floor * i_mul
          prob += total_withdrawals >= total_expenses, f"Min_Spend_{y}"
          prob += excess[y] == total_withdrawals - total_expenses
-         prob += true_spending[y] == total_withdrawals - total_tax[y] - excess[y] - hc_payment[y] - S.expenses[y]
-         prob += full_social_security[y] == S.social_security[y]
-         prob += cash_withdraw[y] == S.income[y]
+         prob += true_spending[y] == total_withdrawals - total_tax[y] - excess[y] - hc_payment[y] - S.expenses[yr]
+         prob += full_social_security[y] == S.social_security[yr]
+         prob += cash_withdraw[y] == S.income[yr]
 #         prob += excess[y] == 0
          # add_max_constraints(prob, excess[y], raw_excess, 0, M, f"Excess_{y}")
 
@@ -129,16 +149,18 @@ def prepare_pulp(args, S):
             prob += ira_to_roth[y] == 0
     elif args.no_conversions_after_socsec:
         for y in years_retire:
-            if S.social_security[y] > 0:
+            if S.social_security[offset[y]] > 0:
                 prob += ira_to_roth[y] == 0
 
 
     # Final Balance Non-Negative Constraints (End of last year)
-    final_year = S.numyr - 1
+    # (The last period is always a single year, see core.horizon)
+    final_year = len(periods) - 1
     eop_assets = pulp.LpVariable("EndOfPlan_Assets", lowBound=0)
     if final_year >=0 :
         # For brokerage we don't have to subtract new capital gains and can add back in the ones not spent from last year
-        eop_save = (bal_save[final_year] - f_save[final_year]) * S.r_rate + cgd[final_year-1] + excess[final_year]
+        last_cgd = cgd[final_year-1] * S.i_rate ** (length[final_year-1] - 1) if final_year > 0 else 0
+        eop_save = (bal_save[final_year] - f_save[final_year]) * S.r_rate + last_cgd + excess[final_year]
         eop_ira = (bal_ira[final_year] - f_ira[final_year] - ira_to_roth[final_year]) * S.r_rate
         eop_roth = (bal_roth[final_year] - f_roth[final_year] + ira_to_roth[final_year]) * S.r_rate        
 
@@ -150,30 +172,79 @@ def prepare_pulp(args, S):
 
     if args.min_taxes is not None:
         prob += spending_floor == float(args.min_taxes), "Set_Spending_Floor"
-        objectives = [- 1 * pulp.lpSum(inf_adj_tax[y] for y in years_retire) / len(years_retire)]
+        objectives = [- 1 * pulp.lpSum(inf_adj_tax[y] * length[y] for y in years_retire) / S.numyr]
     elif args.max_assets is not None:
         prob += spending_floor == float(args.max_assets), "Set_Spending_Floor"
         objectives = [+ 1.0 * eop_assets \
-                      - 0.0 * pulp.lpSum(jagged[y] for y in range(S.numyr-1)) / len(years_retire)]
+                      - 0.0 * pulp.lpSum(jagged[y] for y in range(len(periods)-1)) / len(years_retire)]
     else:  # defaults to max-spend
         objectives = [+ 10.0 * spending_floor \
-                      - 0.0 * pulp.lpSum(jagged[y] for y in range(S.numyr-1)) / len(years_retire)]
+                      - 0.0 * pulp.lpSum(jagged[y] for y in range(len(periods)-1)) / len(years_retire)]
+
+    def years_through(p, last_year):
+        # Sum of the inflation growth of period p's flows over its years up to last_year
+        return sum(S.i_rate ** k for k in range(length[p]) if offset[p] + k <= last_year)
+
+    # The rows of each period that depend on the plan's state income tax,
+    # with what they were built from, so prob.swap_state_tax() can rebuild
+    # them for another state after Data.set_state (see ddcalc.relocation)
+    state_rows = {}
+
+    def add_state_tax(y, yr, tax_i_mul, taxable_part_of_f_save):
+        # State Taxable Income Calculation = Fed Taxable Income + Taxable Cap Gains - State Deduction
+        # Original: state_taxable = fira + ira2roth + basis*fsave + cgd + state_taxed_extra
+        taxed_ira = 0
+        if (S.state_taxes_retirement_income):
+            taxed_ira = f_ira[y]
+        rows = {}
+        rows[f"StateTaxableIncome_{y}"] = state_ordinary_income[y] == taxed_ira + ira_to_roth[y] + f_save[y] * taxable_part_of_f_save \
+            + cgd[y] + S.state_taxed_income[yr] + S.state_social_security_taxed[yr]
+        rows[f"MaxStateStdDed_{y}"] = state_std_deduction_amount[y] <= S.state_stded * tax_i_mul
+        brackets = range(len(S.state_taxtable))
+        for j, (rate, low, high) in enumerate(S.state_taxtable):
+             if (y, j) not in state_tax_bracket_amount: # a state with more brackets than the first one
+                 state_tax_bracket_amount[y, j] = pulp.LpVariable(f"State_Tax_Bracket_Amount_({y},_{j})", lowBound=0)
+             bracket_size = (high - low) * tax_i_mul if high != float('inf') else M
+             rows[f"MaxStateTaxBracket_{y}_{j}"] = state_tax_bracket_amount[y, j] <= bracket_size
+
+        j = len(S.state_taxtable)
+        while (y, j) in state_tax_bracket_amount: # brackets of an earlier state this one doesn't have
+            rows[f"MaxStateTaxBracket_{y}_{j}"] = state_tax_bracket_amount[y, j] <= 0
+            j += 1
+
+        rows[f"SumStateTaxBrackets_{y}"] = state_std_deduction_used[y] + pulp.lpSum(state_tax_bracket_amount[y, j] for j in brackets) == state_ordinary_income[y]
+
+        rows[f"StateTaxCalc_{y}"] = state_tax[y] == pulp.lpSum(state_tax_bracket_amount[y, j] * S.state_taxtable[j][0] for j in brackets)
+        for name, row in rows.items():
+            prob.addConstraint(row, name)
+        state_rows[y] = (list(rows), (yr, tax_i_mul, taxable_part_of_f_save))
+
+    def swap_state_tax():
+        for y, (names, built_from) in list(state_rows.items()):
+            for name in names:
+                del prob.constraints[name]
+            add_state_tax(y, *built_from)
+        prob.scaling = None # its row factors are for the old rows (see DDCalc._scaling)
+    prob.swap_state_tax = swap_state_tax
 
     # --- Constraints ---
 
     # --- Retirement Year Constraints ---
     for y in years_retire:
-        i_mul = S.i_rate ** y
-        tax_i_mul = ((S.i_rate - 0.01) ** y) if (args.pessimistic_taxes) else i_mul
-        hc_i_mul = ((S.i_rate + 0.01) ** y) if (args.pessimistic_healthcare) else i_mul
-        age = y + S.retireage
+        yr = offset[y]
+        i_mul = S.i_rate ** yr
+        tax_i_mul = ((S.i_rate - 0.01) ** yr) if (args.pessimistic_taxes) else i_mul
+        hc_i_mul = ((S.i_rate + 0.01) ** yr) if (args.pessimistic_healthcare) else i_mul
+        age = yr + S.retireage
+        indicators = prob.indicators[y] = []
 
         # Calculate basis_percent (as used in state tax, NII, CG calcs)
         if S.aftertax['bal'] > 0:
             # This is the least wrong way I could think of to estimate the basis percent
+            # (it falls every year, so a multi-year step takes its last year's)
             basis_percent = (S.aftertax['basis'] /
                          (S.aftertax['bal'] *
-                          (S.r_rate-S.aftertax['distributions'])**y))
+                          (S.r_rate-S.aftertax['distributions'])**(yr + length[y] - 1)))
             if basis_percent > 1:
                 basis_percent = 1
         else:
@@ -192,9 +263,11 @@ def prepare_pulp(args, S):
             prob += bal_ira[y] == last_bal_ira, f"InitIRABal_{y}"
             prob += bal_roth[y] == last_bal_roth, f"InitRothBal_{y}"
         else:
-            prob += bal_save[y] == (bal_save[y-1] - f_save[y-1]) * S.r_rate - cgd[y-1] + excess[y-1], f"SaveBal_{y}"
-            prob += bal_ira[y] == (bal_ira[y-1] - f_ira[y-1] - ira_to_roth[y-1]) * S.r_rate, f"IRABal_{y}"
-            prob += bal_roth[y] == (bal_roth[y-1] - f_roth[y-1] + ira_to_roth[y-1]) * S.r_rate, f"RothBal_{y}"
+            # Grow the previous period's balance over all of its years (for one year: (bal - f) * r - cgd + excess)
+            r_n, F, G = growth_factors(S.r_rate, S.i_rate, length[y-1])
+            prob += bal_save[y] == bal_save[y-1] * r_n - f_save[y-1] * F - (cgd[y-1] - excess[y-1]) * G, f"SaveBal_{y}"
+            prob += bal_ira[y] == bal_ira[y-1] * r_n - (f_ira[y-1] + ira_to_roth[y-1]) * F, f"IRABal_{y}"
+            prob += bal_roth[y] == bal_roth[y-1] * r_n - (f_roth[y-1] - ira_to_roth[y-1]) * F, f"RothBal_{y}"
 
 
         # Capital Gains Distribution Balance Calculation
@@ -206,14 +279,14 @@ def prepare_pulp(args, S):
         # --- Federal Tax Calculation ---
 
         # Total Non-investment Income Calculation (Federal) = IRA Withdrawals + Conversions + Taxable External Income
-        prob += ordinary_income[y] == f_ira[y] + ira_to_roth[y] + S.taxed_income[y] + S.social_security_taxed[y], f"Ordinary_Income_{y}"
+        prob += ordinary_income[y] == f_ira[y] + ira_to_roth[y] + S.taxed_income[yr] + S.social_security_taxed[yr], f"Ordinary_Income_{y}"
 
         # --- Non-investment Income Tax Calculations ---
         # Limit amounts in std deduction and brackets
         prob += std_deduction_amount[y] <= S.stded * tax_i_mul, f"MaxStdDed_{y}"
 
         # How much of the standard deduction is taken up by the non_investment_income?
-        add_min_constraints(prob, standard_deduction_vars[y, 'income_portion'], std_deduction_amount[y], ordinary_income[y], M, f"StdDedIncomePortion_{y}")
+        indicators.append(add_min_constraints(prob, standard_deduction_vars[y, 'income_portion'], std_deduction_amount[y], ordinary_income[y], M, f"StdDedIncomePortion_{y}"))
         # Whatever is left can be used by the capital gains
         prob += standard_deduction_vars[y, 'cg_portion'] <= std_deduction_amount[y] - standard_deduction_vars[y, 'income_portion'], f"StdDedCGPortionLimit_{y}"
 
@@ -249,7 +322,7 @@ def prepare_pulp(args, S):
 
              # complete the computation of how much of this CG bracket was taken up by regular income
              # cg_income_portion = min(cg_over, cg_size)
-             add_min_constraints(prob, cg_vars[y, j, 'income_portion'], cg_vars[y, j, 'over'], cg_vars[y, j, 'size'], M, f"CG_{y}_{j}_IncPort")
+             indicators.append(add_min_constraints(prob, cg_vars[y, j, 'income_portion'], cg_vars[y, j, 'over'], cg_vars[y, j, 'size'], M, f"CG_{y}_{j}_IncPort"))
 
              # The remainder of this bracket is available for capital gains
              # Portion of bracket available for CGs = size - income_portion
@@ -265,7 +338,7 @@ def prepare_pulp(args, S):
         nii_threshold_adj = S.nii # NII threshold typically not inflation adjusted
 
         # Simplified MAGI for this calculation
-        magi_approx = f_ira[y] + ira_to_roth[y] + S.taxed_income[y] + S.social_security_taxed[y] + total_cap_gains[y]
+        magi_approx = f_ira[y] + ira_to_roth[y] + S.taxed_income[yr] + S.social_security_taxed[yr] + total_cap_gains[y]
         prob += fed_agi[y] == magi_approx, f"FedAGI_{y}"
 
         # NII Raw Over = MAGI - Threshold
@@ -277,7 +350,7 @@ def prepare_pulp(args, S):
         prob += nii_vars[y, 'over'] >= nii_vars[y, 'raw_over']
 
         # NII CG Portion = min(Total Cap Gains, NII Over)
-        add_min_constraints(prob, nii_vars[y, 'cg_portion'], nii_vars[y, 'over'], total_cap_gains[y], M, f"NII_{y}_CGPort")
+        indicators.append(add_min_constraints(prob, nii_vars[y, 'cg_portion'], nii_vars[y, 'over'], total_cap_gains[y], M, f"NII_{y}_CGPort"))
 
 
         # Calculate Federal Tax (sum across brackets + penalty + CG tax + NII tax)
@@ -293,36 +366,29 @@ def prepare_pulp(args, S):
         prob += fed_tax_nii[y] == nii_vars[y, 'cg_portion'] * 0.038 # NII tax rate
         fed_tax_calc += fed_tax_nii[y] # Add NII tax based on the allocated portion
 
-        if S.halfage + y < 59:
+        if S.halfage + yr < 59:
             prob += fed_tax_early_withdrawal[y] == f_ira[y] * 0.1, f"FedTaxEarlyWithdraw_{y}"
             prob += fed_tax[y] == fed_tax_calc + fed_tax_early_withdrawal[y], f"FedTaxCalc_{y}"
         else:
             prob += fed_tax[y] == fed_tax_calc, f"FedTaxCalc_{y}"
 
 
-        # State Taxable Income Calculation = Fed Taxable Income + Taxable Cap Gains - State Deduction
-        # Original: state_taxable = fira + ira2roth + basis*fsave + cgd + state_taxed_extra
-        taxed_ira = 0
-        if (S.state_taxes_retirement_income):
-            taxed_ira = f_ira[y]
-        prob += state_ordinary_income[y] == taxed_ira + ira_to_roth[y] + f_save[y] * taxable_part_of_f_save \
-            + cgd[y] + S.state_taxed_income[y] + S.state_social_security_taxed[y], f"StateTaxableIncome_{y}"
         prob += state_agi[y] == state_ordinary_income[y], f"StateAGI_{y}"
 
         # aca premium subsidy
         # Implemented as discrete steps from 200% to 400%.  Currently using the 2025 rules.
         # This is reasonably fast to calculate and better than ignoring subsidies altogether.
-        if (S.retireage + y <= 65) and (S.aca['slcsp'] > 0):
-            add_if_then_constraint(prob, fed_agi[y] - 3.5 * S.fpl_amount * i_mul, (0.085 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_400_{y}")
-            add_if_then_constraint(prob, fed_agi[y] - 3.0 * S.fpl_amount * i_mul, (0.0725 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_350_{y}")
-            add_if_then_constraint(prob, fed_agi[y] - 2.75 * S.fpl_amount * i_mul, (0.06 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_300_{y}")
-            add_if_then_constraint(prob, fed_agi[y] - 2.5 * S.fpl_amount * i_mul, (0.05 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_275_{y}")
-            add_if_then_constraint(prob, fed_agi[y] - 2.25 * S.fpl_amount * i_mul, (0.04 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_250_{y}")
-            add_if_then_constraint(prob, fed_agi[y] - 2.0 * S.fpl_amount * i_mul, (0.03 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_225_{y}")
+        if (age <= 65) and (S.aca['slcsp'] > 0):
+            indicators.append(add_if_then_constraint(prob, fed_agi[y] - 3.5 * S.fpl_amount * i_mul, (0.085 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_400_{y}"))
+            indicators.append(add_if_then_constraint(prob, fed_agi[y] - 3.0 * S.fpl_amount * i_mul, (0.0725 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_350_{y}"))
+            indicators.append(add_if_then_constraint(prob, fed_agi[y] - 2.75 * S.fpl_amount * i_mul, (0.06 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_300_{y}"))
+            indicators.append(add_if_then_constraint(prob, fed_agi[y] - 2.5 * S.fpl_amount * i_mul, (0.05 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_275_{y}"))
+            indicators.append(add_if_then_constraint(prob, fed_agi[y] - 2.25 * S.fpl_amount * i_mul, (0.04 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_250_{y}"))
+            indicators.append(add_if_then_constraint(prob, fed_agi[y] - 2.0 * S.fpl_amount * i_mul, (0.03 * fed_agi[y])/12.0 - min_payment[y], M, f"FPL_225_{y}"))
             prob += min_payment[y] >= (0.02 * fed_agi[y])/12.0, f"FPL_200_{y}"
             prob += raw_help[y] <= (S.aca['premium'] * i_mul)
             prob += raw_help[y] <= (S.aca['slcsp'] * i_mul) - min_payment[y]
-            add_max_constraints(prob, help[y], raw_help[y], 0, M, f"Help_{y}")
+            indicators.append(add_max_constraints(prob, help[y], raw_help[y], 0, M, f"Help_{y}"))
 #            if y > 0 and S.halfage + y != 59:
 #                prob += fed_agi[y] <= fed_agi[y-1]
 
@@ -330,12 +396,12 @@ def prepare_pulp(args, S):
 #            prob += raw_help[y] <= (S.aca['premium'] * hc_i_mul)
 #            prob += raw_help[y] <= (S.aca['slcsp'] * hc_i_mul) - min_payment[y]  
 #            add_max_constraints(prob, help[y], raw_help[y], 0, M, f"Help_{y}")
-            if S.retireage + y == 65:
+            if age == 65:
                 prob += hc_payment[y] == ((S.aca['premium'] * hc_i_mul) - help[y]) * (S.birthmonth -1)
             else:
                 prob += hc_payment[y] == ((S.aca['premium'] * hc_i_mul) - help[y]) * 12
-        elif (S.retireage + y <= 65):
-            if S.retireage + y == 65:
+        elif (age <= 65):
+            if age == 65:
                 prob += hc_payment[y] == ((S.aca['premium'] * hc_i_mul)) * (S.birthmonth -1)
             else:
                 prob += hc_payment[y] == ((S.aca['premium'] * hc_i_mul)) * 12
@@ -345,14 +411,7 @@ def prepare_pulp(args, S):
 #        add_min_constraints(prob, state_std_deduction_used[y], state_std_deduction_amount[y], state_ordinary_income[y], M, f"StateStdDedUsed_{y}")
         prob += state_std_deduction_used[y] <= state_std_deduction_amount[y]
         prob += state_std_deduction_used[y] <= state_ordinary_income[y]
-        prob += state_std_deduction_amount[y] <= S.state_stded * tax_i_mul, f"MaxStateStdDed_{y}"
-        for j, (rate, low, high) in enumerate(S.state_taxtable):
-             bracket_size = (high - low) * tax_i_mul if high != float('inf') else M
-             prob += state_tax_bracket_amount[y, j] <= bracket_size, f"MaxStateTaxBracket_{y}_{j}"
-
-        prob += state_std_deduction_used[y] + pulp.lpSum(state_tax_bracket_amount[y, j] for j in range(len(S.state_taxtable))) == state_ordinary_income[y], f"SumStateTaxBrackets_{y}"
-
-        prob += state_tax[y] == pulp.lpSum(state_tax_bracket_amount[y, j] * S.state_taxtable[j][0] for j in range(len(S.state_taxtable))), f"StateTaxCalc_{y}"
+        add_state_tax(y, yr, tax_i_mul, taxable_part_of_f_save)
         prob += state_tax_ordinary_income[y] == state_tax[y], f"StateTaxOrdIncome_{y}"
 
         # Total Tax Calculation
@@ -360,14 +419,14 @@ def prepare_pulp(args, S):
 
         # Income Ceiling Constraint (Original A+b constraint)
         # fira + ira2roth + taxed_extra + basis*fsave + cgd <= ceiling
-        if (S.income_ceiling[y] < 50_000_000):
-            prob += fed_agi[y] <= S.income_ceiling[y], f"IncomeCeiling_{y}"
+        if (S.income_ceiling[yr] < 50_000_000):
+            prob += fed_agi[y] <= S.income_ceiling[yr], f"IncomeCeiling_{y}"
 
         # RMD Constraint (SECURE Act 2.0)
         # Once you start RMDs you can't stop.  So the unlucky people born in 1959 will
         # start their RMDs at age 73 in 2032.  In 2033 when the rules change to 75, they 
         # will already be in the system and the new rules won't apply to them.
-        birthyear = current_year + y - age
+        birthyear = current_year + yr - age
         if (birthyear < 1960 and age >= 73) or (age >= 75):
             rmd_factor = RMD[age - 72] # Get factor for current age
             # RMD amount = Previous Year End IRA Balance / rmd_factor
@@ -377,6 +436,14 @@ def prepare_pulp(args, S):
             prob += f_ira[y] >= rmd_required, f"RMD_{y}"
             prob += required_RMD[y] == rmd_required, f"RMD_Amount_{y}"
             # prob += ira_to_roth[y] == 0, f"RMD_Convert_{y}" # No conversions if RMD is required
+        # The later years of a multi-year step must meet their RMD too: year
+        # k's withdrawal is f_ira grown by inflation, from the balance after k years
+        for k in range(1, length[y]):
+            if (birthyear < 1960 and age + k >= 73) or (age + k >= 75):
+                r_k, F_k, _ = growth_factors(S.r_rate, S.i_rate, k)
+                prob += (f_ira[y] * S.i_rate ** k
+                         >= (bal_ira[y] * r_k - (f_ira[y] + ira_to_roth[y]) * F_k) * (1.0 / RMD[age + k - 72])), \
+                        f"RMD_{y}_{k}"
 
 
         # Roth Conversion Aging (5-year rule for all Roth additions) until age 59.5 with an additional 
@@ -384,19 +451,24 @@ def prepare_pulp(args, S):
         # I believe this is more strict than the IRS rules.  It is certainly easier to compute.
         age_account_open = min([ca for ca, _ in S.roth['contributions']], default=S.retireage)
 
-        if not ((S.halfage + y >= 59) and (S.retireage + y - age_account_open >= 5)):
-#             print("Restricting Roth Conversions ", S.retireage + y)
-             aged_conversions = pulp.lpSum(ira_to_roth[conv_y] for conv_y in range(max(0, y - 4))) \
-                                - pulp.lpSum(f_roth[conv_y] for conv_y in range(y)) # Sum conversions from >= 5 years ago less withdrawals
+        # Every year of a multi-year step is checked, counting the step's earlier withdrawals
+        for k in range(length[y]):
+            year = yr + k
+            if not ((S.halfage + year >= 59) and (S.retireage + year - age_account_open >= 5)):
+#               print("Restricting Roth Conversions ", S.retireage + year)
+                # Sum conversions from >= 5 years ago less withdrawals (counting every year of earlier periods)
+                earlier = range(y + 1 if k else y)
+                aged_conversions = pulp.lpSum(ira_to_roth[p] * years_through(p, year - 5) for p in earlier) \
+                                   - pulp.lpSum(f_roth[p] * years_through(p, year - 1) for p in earlier)
 
-             # Calculate contributions basis available in year y
-             initial_contrib_basis = 0
-             for contrib_age, contrib_amount in S.roth['contributions']:
-                  if S.retireage + y - contrib_age >= 5:
-                      initial_contrib_basis += contrib_amount
+                # Calculate contributions basis available in that year
+                initial_contrib_basis = 0
+                for contrib_age, contrib_amount in S.roth['contributions']:
+                     if S.retireage + year - contrib_age >= 5:
+                         initial_contrib_basis += contrib_amount
 
-             total_basis = initial_contrib_basis + aged_conversions
-             prob += f_roth[y] <= total_basis, f"RothBasisLimit_{y}"
+                total_basis = initial_contrib_basis + aged_conversions
+                prob += f_roth[y] * S.i_rate ** k <= total_basis, f"RothBasisLimit_{y}" + (f"_{k}" if k else "")
 
 
     # --- Solve ---
@@ -409,7 +481,8 @@ def prepare_pulp(args, S):
          solver_options['msg'] = 0
 
     # Choose a solver (CBC is default, bundled with PuLP)
-    solver = pulp.PULP_CBC_CMD(presolve=False, threads=8,timeLimit=float(args.timelimit) if args.timelimit else 90, msg=args.verbose)
+    # Thread count is normally set per solve by DDCalc's ThreadScheduler
+    solver = make_solver(getattr(args, 'solver_settings', {}), args.timelimit, getattr(args, 'threads', None), args.verbose)
 
 
     return prob, solver, objectives
\ No newline at end of file
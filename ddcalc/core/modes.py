@@ -0,0 +1,10 @@
+# Horizon modes accepted by DDCalc.solve(horizon=...) (see core.horizon),
+# solve modes (mode=...) and modes of its pool of alternative plans
+# (alternatives_mode=...), and the measures and methods of a plan robust
+# across scenarios (see ddcalc.robust). Kept apart from the modules using
+# them so the CLI can offer them without importing PuLP.
+HORIZONS = ['annual', 'multi']
+SOLVE_MODES = ['exact', 'fast', 'race']
+POOL_MODES = ['best', 'diverse']
+ROBUST_MEASURES = ['expected', 'worst']
+ROBUST_METHODS = ['decomposed', 'monolithic']
@@ -0,0 +1,88 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Settings a profile may set: solver settings only (see
+# utils.pulp.make_solver). The horizon and solve mode change the plan and
+# are never taken from a profile, even an older file that has them.
+PROFILE_SETTINGS = ['presolve', 'gapRel', 'seed']
+
+PROFILES_ENV = 'DDCALC_SOLVER_PROFILES'
+
+
+def default_profiles_path():
+    """$DDCALC_SOLVER_PROFILES, or reference/solver_profiles.json (written by ddcalc-tune)."""
+    return os.environ.get(PROFILES_ENV) or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'reference', 'solver_profiles.json')
+
+
+def aca_years(S):
+    """Number of plan years with ACA premiums to optimize."""
+    if S.aca.get('slcsp', 0) <= 0:
+        return 0
+    return sum(1 for y in range(S.numyr) if S.retireage + y <= 65)
+
+
+def shape_class(S):
+    """
+    Names the plan-shape class a profile applies to, from the horizon
+    length, the number of ACA years and the number of state tax brackets,
+    e.g. 'years:31-45/aca:1-5/state:2-4'.
+    """
+    def bucket(value, edges):
+        for low, high in edges:
+            if value <= high:
+                return f"{low}-{high}" if low != high else str(low)
+        return f"{edges[-1][1] + 1}+"
+    return "/".join([
+        "years:" + bucket(S.numyr, [(1, 30), (31, 45)]),
+        "aca:" + bucket(aca_years(S), [(0, 0), (1, 5)]),
+        "state:" + bucket(len(S.state_taxtable), [(0, 1), (2, 4)]),
+    ])
+
+
+_profiles_cache = {}
+_profiles_lock = threading.Lock()
+
+def load_profiles(path=None):
+    """
+    Returns the profiles file contents ({} if there is none), rereading it
+    only when it has changed.
+    """
+    path = path or default_profiles_path()
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    with _profiles_lock:
+        cached = _profiles_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path) as f:
+            profiles = json.load(f)
+    except ValueError as e:
+        logger.warning("Ignoring solver profiles %s: %s", path, e)
+        profiles = {}
+    with _profiles_lock:
+        _profiles_cache[path] = (mtime, profiles)
+    return profiles
+
+
+def profile_for(S, profiles=None):
+    """
+    Returns the tuned settings for the shape class of S (an empty dict if
+    no profile covers it).
+    """
+    if profiles is None:
+        profiles = load_profiles()
+    entry = profiles.get('classes', {}).get(shape_class(S))
+    if not entry:
+        return {}
+    settings = {k: v for k, v in entry.get('settings', {}).items() if k in PROFILE_SETTINGS}
+    logger.info("Using solver profile %s: %s", shape_class(S), settings)
+    return settings
@@ -0,0 +1,148 @@
+import os
+import time
+import queue
+import signal
+import logging
+import multiprocessing
+
+import pulp
+
+from ddcalc.utils.pulp import CBC_SOLVERS
+
+logger = logging.getLogger(__name__)
+
+# Solver configurations raced against each other, in order of preference.
+# The first entry is the setup of the plain exact solve. gapRel is the
+# relative optimality gap at which the solver may stop (the counterpart of
+# the relTol steps of the sequential solve).
+DEFAULT_PORTFOLIO = [
+    {'name': 'cbc'},
+    {'name': 'cbc-presolve', 'presolve': True},
+    {'name': 'cbc-seed1', 'seed': 1, 'gapRel': 0.0001},
+    {'name': 'cbc-seed2', 'presolve': True, 'seed': 2, 'gapRel': 0.001},
+    {'name': 'cbc-gap1pct', 'seed': 3, 'gapRel': 0.01},
+]
+
+# Extra seconds racers get past the solver time limit to build the model and
+# write the solution before they are cancelled.
+DEADLINE_GRACE = 15
+
+
+def default_portfolio(racers):
+    """
+    Returns up to `racers` entries: DEFAULT_PORTFOLIO with the other solver
+    backends PuLP finds installed (e.g. HiGHS) taking the places after the
+    first two CBC entries.
+    """
+    backends = [{'name': name.lower(), 'solver': name}
+                for name in pulp.listSolvers(onlyAvailable=True) if name not in CBC_SOLVERS]
+    entries = DEFAULT_PORTFOLIO[:2] + backends + DEFAULT_PORTFOLIO[2:]
+    return entries[:max(1, racers)]
+
+
+def _context():
+    """
+    Start method for the racers. Forking the caller (e.g. a threaded server)
+    could copy locks other threads hold into a racer, so racers come from
+    the fork server, which preloads ddcalc, or are spawned where there is
+    none.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['ddcalc.ddcalc'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _racer(target, index, entry, results, ready):
+    if hasattr(os, 'setsid'):
+        os.setsid() # own process group, so cancelling also stops the solver subprocess
+    ready.set()
+    try:
+        results.put((index, target(entry)))
+    except Exception as e:
+        logger.exception("Racer %s failed", entry.get('name'))
+        results.put((index, {'status': 'Error', 'error': str(e)}))
+
+
+def _cancel(process, ready):
+    """
+    Stops a racer and its solver subprocess. The racer's process group only
+    exists once it has set `ready`; before that it has no solver running
+    and is killed on its own, and its group is killed as well if it was
+    created in the meantime.
+    """
+    group = hasattr(os, 'killpg')
+    alone = False
+    if process.is_alive():
+        try:
+            if group and ready.is_set():
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+                alone = True
+        except ProcessLookupError:
+            pass
+    process.join()
+    if alone and group and ready.is_set():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def run_race(target, entries, deadline, accept=None):
+    """
+    Runs target(entry) for every entry in its own process and returns as
+    soon as one result is accepted, cancelling the others (and their solver
+    subprocesses).
+
+    Args:
+        target (callable): Solves with one entry and returns a picklable dict
+            holding at least 'status' and, for a solution, 'objective'. It
+            is sent to the racers, so it must be picklable too (a module
+            function or a functools.partial of one).
+        entries (list): Portfolio entries.
+        deadline (float): Seconds to wait for the racers.
+        accept (callable, optional): Whether a result ends the race. Defaults
+            to status 'Optimal'.
+
+    Returns:
+        tuple: (index of the chosen entry or None, its result, {index: result}
+               of every racer that finished). Without an accepted result the
+               one with the best objective is chosen.
+    """
+    accept = accept or (lambda result: result.get('status') == 'Optimal')
+    context = _context()
+    results = context.Queue()
+    ready = [context.Event() for _ in entries]
+    processes = [context.Process(target=_racer, args=(target, i, entry, results, ready[i]), daemon=True)
+                 for i, entry in enumerate(entries)]
+    for p in processes:
+        p.start()
+
+    finished = {}
+    winner = None
+    end = time.monotonic() + deadline
+    try:
+        while len(finished) < len(processes):
+            try:
+                index, result = results.get(timeout=max(0.0, end - time.monotonic()))
+            except queue.Empty:
+                logger.warning("Race deadline reached with %d of %d racers finished", len(finished), len(processes))
+                break
+            finished[index] = result
+            logger.info("Racer %s finished: %s", entries[index].get('name'), result.get('status'))
+            if accept(result):
+                winner = index
+                break
+    finally:
+        for p, r in zip(processes, ready):
+            _cancel(p, r)
+        results.close()
+
+    if winner is None:
+        solved = [i for i, r in finished.items() if r.get('objective') is not None]
+        if solved:
+            winner = max(solved, key=lambda i: finished[i]['objective'])
+    return winner, finished.get(winner), finished
@@ -1,8 +1,10 @@
 import pulp
+from ddcalc.core.horizon import growth_factors
 
 def retrieve_results(args, S, prob):
     status = pulp.LpStatus[prob.status]
-    all_values = { v.name: v.varValue for v in prob.variables() }
+    # Only the non-zero values; most of the model's variables are zero
+    all_values = { v.name: v.varValue for v in prob.variables() if v.varValue }
     all_names = ["Cash_Withdraw", "Brokerage_Balance", "Brokerage_Withdraw", "IRA_Balance", "IRA_Withdraw", 
                  "Required_RMD", "Roth_Balance", 
                  "Roth_Withdraw", "IRA_to_Roth", "CGD_Spendable", "Capital_Gains_Distribution", "Total_Capital_Gains", 
@@ -10,28 +12,46 @@ def retrieve_results(args, S, prob):
                  "ACA_HC_Payment", "ACA_Help", "Social_Security", "True_Spending", "Excess"]
 #    # Extract results into a dictionary or similar structure for printing
     results = {
-        'spending_floor': all_values['SpendingFloor'],
-        'endofplan_assets': all_values['EndOfPlan_Assets'] / (S.i_rate ** S.numyr),
+        'spending_floor': all_values.get('SpendingFloor', 0),
+        'endofplan_assets': all_values.get('EndOfPlan_Assets', 0) / (S.i_rate ** S.numyr),
         'retire': {},
-        'federal': { 'status': S.status, 'taxtable': S.taxtable, 'cg_taxtable': S.cg_taxtable, 'nii': S.nii, 'standard_deduction': S.stded },
-        'state': { 'status': S.state_status, 'taxtable': S.state_taxtable, 'standard_deduction': S.state_stded, 'taxes_ss': S.state_taxes_ss, 'taxes_retirement_income': S.state_taxes_retirement_income},
+        # Copies, so callers can't modify the tables held by S
+        'federal': { 'status': S.status, 'taxtable': [list(t) for t in S.taxtable], 'cg_taxtable': [list(t) for t in S.cg_taxtable], 'nii': S.nii, 'standard_deduction': S.stded },
+        'state': { 'status': S.state_status, 'taxtable': [list(t) for t in S.state_taxtable], 'standard_deduction': S.state_stded, 'taxes_ss': S.state_taxes_ss, 'taxes_retirement_income': S.state_taxes_retirement_income},
         'status': status
     }
-    years_retire = range(S.numyr)
-
-    for y in years_retire:
-        i_mul = S.i_rate ** y
-        adjust = min(all_values[f'IRA_to_Roth_{y}'], all_values[f'Roth_Withdraw_{y}']) if S.halfage+y >= 59 else 0
-        adjust = adjust / i_mul
-        results['retire'][y] = {
-            a: round(all_values.get(f'{a}_{y}', 0) / i_mul) for a in all_names
-        }
-        results['retire'][y]['IRA_to_Roth'] = round(results['retire'][y]['IRA_to_Roth'] - adjust)
-        results['retire'][y]['Roth_Withdraw'] = round(results['retire'][y]['Roth_Withdraw'] - adjust)
-        results['retire'][y]['IRA_Withdraw'] = round(results['retire'][y]['IRA_Withdraw'] + adjust)
-        results['retire'][y]['CGD_Spendable'] = round(results['retire'][y-1]['Capital_Gains_Distribution'] / i_mul) if y > 0 else 0
-        results['retire'][y]['tax_brackets'] = [all_values[f'Tax_Bracket_Amount_({y},_{j})'] / i_mul for j in range(len(S.taxtable))]
-        results['retire'][y]['state_tax_brackets'] = [all_values[f'State_Tax_Bracket_Amount_({y},_{j})'] / i_mul for j in range(len(S.state_taxtable))]
+    periods = getattr(S, 'periods', None) or [(y, 1) for y in range(S.numyr)]
+    if len(periods) != S.numyr:
+        results['horizon'] = {'periods': [list(period) for period in periods]}
+
+    # Model variables are per period (see core.horizon); every year of a
+    # multi-year period repeats its flows grown by inflation, so the rows are
+    # expanded back to one per year here.
+    for p, (first, n) in enumerate(periods):
+        values = {a: all_values.get(f'{a}_{p}', 0) for a in all_names}
+        for k in range(n):
+            y = first + k
+            i_mul = S.i_rate ** y
+            flow_mul = S.i_rate ** k
+            row = {a: values[a] * flow_mul for a in all_names}
+            if k > 0:
+                _, F, G = growth_factors(S.r_rate, S.i_rate, k)
+                r_k = S.r_rate ** k
+                row['Brokerage_Balance'] = values['Brokerage_Balance'] * r_k - values['Brokerage_Withdraw'] * F \
+                    - (values['Capital_Gains_Distribution'] - values['Excess']) * G
+                row['IRA_Balance'] = values['IRA_Balance'] * r_k - (values['IRA_Withdraw'] + values['IRA_to_Roth']) * F
+                row['Roth_Balance'] = values['Roth_Balance'] * r_k - (values['Roth_Withdraw'] - values['IRA_to_Roth']) * F
+            adjust = min(row['IRA_to_Roth'], row['Roth_Withdraw']) if S.halfage+y >= 59 else 0
+            adjust = adjust / i_mul
+            results['retire'][y] = {
+                a: round(row[a] / i_mul) for a in all_names
+            }
+            results['retire'][y]['IRA_to_Roth'] = round(results['retire'][y]['IRA_to_Roth'] - adjust)
+            results['retire'][y]['Roth_Withdraw'] = round(results['retire'][y]['Roth_Withdraw'] - adjust)
+            results['retire'][y]['IRA_Withdraw'] = round(results['retire'][y]['IRA_Withdraw'] + adjust)
+            results['retire'][y]['CGD_Spendable'] = round(results['retire'][y-1]['Capital_Gains_Distribution'] / i_mul) if y > 0 else 0
+            results['retire'][y]['tax_brackets'] = [all_values.get(f'Tax_Bracket_Amount_({p},_{j})', 0) * flow_mul / i_mul for j in range(len(S.taxtable))]
+            results['retire'][y]['state_tax_brackets'] = [all_values.get(f'State_Tax_Bracket_Amount_({p},_{j})', 0) * flow_mul / i_mul for j in range(len(S.state_taxtable))]
 
 #    print(all_values)
     return results, S, prob # Pass S and prob back for potential inspection
@@ -47,6 +67,8 @@ def print_ascii(results, S):
     print(f"Yearly spending floor (today's dollars) <= {spending:.0f}")
     eop = results['endofplan_assets'] if results['endofplan_assets'] is not None else 0
     print(f"End-of-plan Assets (today's dollars) <= {eop:.0f}")   
+    if 'gap' in results.get('quality', {}):
+        print(f"Fast solve: within {results['quality']['gap']:.2%} of the best possible plan")
     print()
 
     columns = ["Brokerage_Balance", "Brokerage_Withdraw", "IRA_Balance", "IRA_Withdraw", "Roth_Balance", 
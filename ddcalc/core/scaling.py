@@ -0,0 +1,102 @@
+import math
+import re
+
+import pulp
+
+# Continuous variables are solved in thousands of dollars of the plan's
+# first year (real terms): a variable of the period starting in year y is
+# divided by UNIT * i_rate ** y. Binaries keep their 0/1 scale.
+UNIT = 1000
+
+# Period of a model variable, from prepare_pulp's names: "Name_<p>" or
+# "Name_(<p>,_<j>)" for the per-bracket variables
+PERIOD_NAME = re.compile(r'_(?:(\d+)|\((\d+),_\d+\))$')
+
+
+class Scaling:
+    """
+    Row and column scale factors for a built model, applied to the PuLP
+    objects in place for a solve and undone afterwards, so the rest of
+    ddcalc only ever sees the model in dollars.
+
+    Column j (variable x_j) is solved as x_j / col[j]: thousands of real
+    dollars for continuous variables, unchanged for binaries. Row i is
+    multiplied by row[i], the reciprocal of the geometric mean of its
+    largest and smallest coefficient after the column scaling, which
+    brings every row's coefficients around 1 (the Big-M rows from 1e8
+    against 1 to about 1e5 between the two ends).
+    """
+    def __init__(self, prob, data, unit=UNIT):
+        self.prob = prob
+        offsets = [first for first, _ in data.periods]
+        self.col = {}
+        for v in prob.variables():
+            if v.cat == pulp.LpInteger:
+                continue
+            match = PERIOD_NAME.search(v.name)
+            period = int(match.group(1) or match.group(2)) if match else None
+            growth = data.i_rate ** offsets[period] if period is not None and period < len(offsets) else 1.0
+            self.col[v] = unit * growth
+        self.row = {}
+        self.applied = False
+
+    def _row_factor(self, constraint):
+        sizes = [abs(a * self.col.get(v, 1.0)) for v, a in constraint.items() if a]
+        return 1.0 / math.sqrt(max(sizes) * min(sizes)) if sizes else 1.0
+
+    def apply(self, objectives):
+        """
+        Scales the model, the objectives and the current variable values (a
+        warm start). Constraints added since the last solve (e.g. the cuts
+        of the alternatives search) get their row factor here.
+        """
+        objectives_ids = {id(objective) for objective in objectives}
+        for name, constraint in self.prob.constraints.items():
+            if name not in self.row:
+                # A row on an objective (e.g. objective >= bound) shares its
+                # expression with it, so it can only take the column scaling
+                shared = id(getattr(constraint, 'expr', constraint)) in objectives_ids
+                self.row[name] = 1.0 if shared else self._row_factor(constraint)
+        self._transform(objectives, lambda a, s: a * s, lambda b, s: b / s)
+        self.applied = True
+
+    def undo(self, objectives):
+        """
+        Restores the model, the objectives and the bounds, and converts the
+        solution back to dollars. Constraints added while the model was
+        scaled (sequentialSolve's objective constraints) were written in
+        scaled columns and are converted too.
+        """
+        if self.applied:
+            self._transform(objectives, lambda a, s: a / s, lambda b, s: b * s)
+            self.applied = False
+
+    def _transform(self, objectives, coef, value):
+        # Each expression is transformed once, however many objectives and
+        # constraints hold it
+        col = self.col
+        seen = set()
+        for objective in objectives:
+            if id(objective) in seen:
+                continue
+            seen.add(id(objective))
+            for v, a in objective.items():
+                objective[v] = coef(a, col.get(v, 1.0))
+        for name, constraint in self.prob.constraints.items():
+            r = self.row.get(name, 1.0)
+            expr = constraint.expr if hasattr(constraint, 'expr') else constraint
+            if expr is not constraint:
+                constraint.constant = coef(constraint.constant, r)
+            if id(expr) in seen:
+                continue
+            seen.add(id(expr))
+            for v, a in expr.items():
+                expr[v] = coef(coef(a, col.get(v, 1.0)), r)
+            expr.constant = coef(expr.constant, r)
+        for v, s in col.items():
+            if v.lowBound is not None:
+                v.lowBound = value(v.lowBound, s)
+            if v.upBound is not None:
+                v.upBound = value(v.upBound, s)
+            if v.varValue is not None:
+                v.varValue = value(v.varValue, s)
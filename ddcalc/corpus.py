@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import pulp
+
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+from ddcalc.capture import sanitize
+from ddcalc.core.scaling import Scaling
+from ddcalc.utils.pulp import make_solver
+
+logger = logging.getLogger(__name__)
+
+# Files of one corpus instance (a directory named by the config hash)
+MODEL_FILES = {'mps': 'model.mps.gz', 'lp': 'model.lp.gz'}
+CONFIG_FILE = 'config.json'
+SETTINGS_FILE = 'settings.json'
+STATS_FILE = 'stats.json'
+
+
+def read_config(config_data):
+    """The config as a dict, reading it first if it is a TOML file path."""
+    if isinstance(config_data, str):
+        with open(config_data, 'rb') as f:
+            return tomllib.load(f)
+    return config_data
+
+
+def instance_id(config_data):
+    """Stable id of a plan: a hash of its sanitized config (a dict or TOML file path)."""
+    config_data = read_config(config_data)
+    normalized = json.dumps(sanitize(config_data), sort_keys=True)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_json(path, value):
+    with open(path, 'w') as f:
+        json.dump(value, f, indent=2, sort_keys=True, default=str)
+
+
+def _write_gzip(write, path):
+    """Calls write(filename) on a temporary file and stores it gzipped at path."""
+    with tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+        tmp = os.path.join(workdir, os.path.basename(path)[:-3])
+        write(tmp)
+        with open(tmp, 'rb') as src, gzip.open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+
+def export_instance(calc, config_data, directory, formats=('mps', 'lp')):
+    """
+    Writes the model of a solved DDCalc to directory/<instance id>/ as
+    compressed MPS and/or LP files, with the normalized config, the solver
+    settings and the solve statistics, so it can be re-solved outside of
+    ddcalc (see resolve_instance).
+
+    Args:
+        calc (DDCalc): A DDCalc after solve().
+        config_data (dict or str): The plan's config, or its TOML file.
+        directory (str): The corpus directory.
+        formats (tuple): Model formats to write ('mps', 'lp').
+
+    Returns:
+        str: The instance directory.
+    """
+    config_data = read_config(config_data)
+    path = os.path.join(directory, instance_id(config_data))
+    os.makedirs(path, exist_ok=True)
+    prob, _ = calc.build_model()
+    if 'mps' in formats:
+        _write_gzip(lambda f: prob.writeMPS(f, with_objsense=True), os.path.join(path, MODEL_FILES['mps']))
+    if 'lp' in formats:
+        _write_gzip(prob.writeLP, os.path.join(path, MODEL_FILES['lp']))
+
+    args = calc.model_args
+    solver = calc.solver.optionsDict if calc.solver is not None else {}
+    _write_json(os.path.join(path, CONFIG_FILE), sanitize(config_data))
+    _write_json(os.path.join(path, SETTINGS_FILE), {
+        'objective': calc.objective_config,
+        'sense': prob.sense,
+        'mode': args.mode,
+        'periods': calc.data.periods,
+        'i_rate': calc.data.i_rate,
+        'scaling': getattr(args, 'scaling', True),
+        'timelimit': args.timelimit,
+        'solver_settings': args.solver_settings,
+        'threads': solver.get('threads'),
+        'options': {k: getattr(args, k) for k in ('pessimistic_taxes', 'pessimistic_healthcare', 'allow_conversions',
+                                                  'no_conversions', 'no_conversions_after_socsec')},
+        'pulp_version': pulp.__version__,
+    })
+    objective = None
+    if calc.status == "Optimal" and calc.objectives:
+        objective = pulp.value(calc.objectives[0])
+    _write_json(os.path.join(path, STATS_FILE), dict(calc.metrics.as_dict(), status=calc.status, objective=objective))
+    logger.info("Exported model to %s", path)
+    return path
+
+
+def find_instances(paths):
+    """Instance directories under the given corpus directories (or instance directories)."""
+    found = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, MODEL_FILES['mps'])):
+            found.append(path)
+        elif os.path.isdir(path):
+            found.extend(sorted(os.path.join(path, d) for d in os.listdir(path)
+                                if os.path.exists(os.path.join(path, d, MODEL_FILES['mps']))))
+    return found
+
+
+def read_json(path, name):
+    with open(os.path.join(path, name)) as f:
+        return json.load(f)
+
+
+def resolve_instance(path, settings, timelimit=None, threads=None, scaling=None):
+    """
+    Solves the MPS model of a corpus instance with the given solver settings
+    (see utils.pulp.make_solver), in scaled units (see core.scaling) if the
+    recorded solve was, or as `scaling` says. Instances exported without a
+    'scaling' setting predate scaling and are solved in dollars.
+
+    Returns:
+        tuple: (seconds, status, objective value or None)
+    """
+    recorded = read_json(path, SETTINGS_FILE)
+    if scaling is None:
+        scaling = recorded.get('scaling', False)
+    with tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+        mps = os.path.join(workdir, 'model.mps')
+        with gzip.open(os.path.join(path, MODEL_FILES['mps']), 'rb') as src, open(mps, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        _, prob = pulp.LpProblem.fromMPS(mps, sense=recorded.get('sense', pulp.LpMaximize))
+        solver = make_solver(settings, timelimit or recorded.get('timelimit'), threads)
+        solver.tmpDir = workdir
+        start = time.perf_counter()
+        if scaling:
+            scaled = Scaling(prob, argparse.Namespace(periods=recorded['periods'], i_rate=recorded['i_rate']))
+            scaled.apply([prob.objective])
+        try:
+            prob.solve(solver)
+        finally:
+            if scaling:
+                scaled.undo([prob.objective])
+        seconds = time.perf_counter() - start
+    status = pulp.LpStatus[prob.status]
+    objective = pulp.value(prob.objective) if status == "Optimal" else None
+    return seconds, status, objective
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-solve exported ddcalc models and compare with the recorded solves")
+    parser.add_argument('corpus', nargs='+', help="Corpus directories (written with --export-dir) or instance directories")
+    parser.add_argument('--solver', help="PuLP solver name (default: CBC)")
+    parser.add_argument('--presolve', action=argparse.BooleanOptionalAction, help="CBC presolve")
+    parser.add_argument('--gap-rel', type=float, help="Relative optimality gap to stop at")
+    parser.add_argument('--seed', type=int, help="CBC random seed")
+    parser.add_argument('--threads', type=int, help="Solver threads")
+    parser.add_argument('--timelimit', type=float, help="Seconds per solve (default: the recorded limit)")
+    parser.add_argument('--repeats', type=int, default=1, help="Timed solves per instance (the median is reported)")
+    parser.add_argument('--scaling', action=argparse.BooleanOptionalAction,
+                        help="Solve in scaled units (default: as the instance was solved)")
+    parser.add_argument('--recorded-settings', action='store_true',
+                        help="Start from each instance's recorded solver settings instead of the defaults")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    instances = find_instances(args.corpus)
+    if not instances:
+        print("No exported models found.")
+        sys.exit(1)
+    overrides = {k: v for k, v in [('solver', args.solver), ('presolve', args.presolve),
+                                    ('gapRel', args.gap_rel), ('seed', args.seed)] if v is not None}
+
+    print(f"{'instance':16} {'rows':>6} {'binaries':>8} {'recorded':>9} {'resolved':>9} {'ratio':>6} "
+          f"{'recorded obj':>14} {'resolved obj':>14}")
+    for path in instances:
+        stats = read_json(path, STATS_FILE)
+        settings = dict(read_json(path, SETTINGS_FILE)['solver_settings'] if args.recorded_settings else {}, **overrides)
+        runs = [resolve_instance(path, settings, args.timelimit, args.threads, args.scaling)
+                for _ in range(args.repeats)]
+        seconds = statistics.median(r[0] for r in runs)
+        objective = runs[-1][2]
+        recorded = stats.get('timers', {}).get('solve', 0.0)
+        counters = stats.get('counters', {})
+        ratio = seconds / recorded if recorded else 0.0
+        print(f"{os.path.basename(path):16} {counters.get('rows', 0):6d} {counters.get('binaries', 0):8d} "
+              f"{recorded:8.2f}s {seconds:8.2f}s {ratio:6.2f} "
+              f"{_fmt(stats.get('objective')):>14} {_fmt(objective):>14}")
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.2f}"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+
+logger = logging.getLogger(__name__)
+
+SOCKET_ENV = 'DDCALC_DAEMON_SOCKET'
+
+# ddcalc option that runs the command in its own process even with a daemon running
+NO_DAEMON_FLAG = '--no-daemon'
+
+
+def default_socket_path():
+    """$DDCALC_DAEMON_SOCKET, or ddcalc-<uid>.sock in $XDG_RUNTIME_DIR or the temporary directory."""
+    return os.environ.get(SOCKET_ENV) or os.path.join(
+        os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), f"ddcalc-{os.getuid()}.sock")
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _receive(lines):
+    line = lines.readline()
+    return json.loads(line) if line else None
+
+
+def forward(argv, path=None):
+    """
+    Runs a ddcalc command line in the daemon listening on path, with this
+    process's stdin, stdout, stderr and working directory.
+
+    Returns:
+        int or None: The command's exit status, or None if no daemon is
+            running (the caller then runs the command itself).
+    """
+    if not hasattr(socket, 'send_fds'):
+        return None
+    path = path or default_socket_path()
+    try:
+        if os.stat(path).st_uid != os.getuid():
+            return None # never hand our terminal to another user's socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    except OSError:
+        return None
+    with sock, sock.makefile('r') as replies:
+        try:
+            request = json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode('utf-8') + b'\n'
+            socket.send_fds(sock, [request], [0, 1, 2])
+            started = _receive(replies)
+        except OSError:
+            return None
+        if started is None:
+            return None # the command never started
+        try:
+            done = _receive(replies)
+        except KeyboardInterrupt:
+            try:
+                os.killpg(started['pid'], signal.SIGTERM) # the command and its solver
+            except ProcessLookupError:
+                pass
+            return 130
+    if done is None:
+        print("ddcalc-daemon: the command ended without an exit status", file=sys.stderr)
+        return 1
+    return done['exit']
+
+
+def run_command(argv):
+    """Runs a ddcalc command line in this process and returns its exit status."""
+    from ddcalc.cli import run
+    sys.argv = ['ddcalc'] + list(argv) # for usage and error messages
+    try:
+        run(argv)
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return code
+
+
+def warm():
+    """
+    Imports the solver stack, parses the tax reference files and solver
+    profiles and runs CBC once, so every command forked from the daemon
+    starts with them in place.
+    """
+    import pulp
+    import ddcalc.ddcalc, ddcalc.corpus, ddcalc.cli # noqa: F401
+    from ddcalc.core.data_loader import load_reference, FEDERAL_TAX_FILE, STATE_TAX_FILE
+    from ddcalc.core.profiles import load_profiles
+    for path in (FEDERAL_TAX_FILE, STATE_TAX_FILE):
+        load_reference(path)
+    load_profiles()
+    prob = pulp.LpProblem("warmup", pulp.LpMaximize)
+    x = pulp.LpVariable("x", 0, 1)
+    prob += x
+    with tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+        solver = pulp.PULP_CBC_CMD(msg=False)
+        solver.tmpDir = workdir
+        prob.solve(solver)
+
+
+def _running(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def serve(path):
+    """
+    Serves commands on the Unix socket at path until SIGTERM or Ctrl-C. Each
+    command runs in a process forked from the warm daemon, in its own
+    process group, with the client's stdin, stdout and stderr (passed over
+    the socket) and working directory.
+    """
+    import socketserver
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            data, fds, _, _ = socket.recv_fds(self.request, 1 << 16, 3)
+            while not data.endswith(b'\n'):
+                chunk = self.request.recv(1 << 16)
+                if not chunk:
+                    return
+                data += chunk
+            request = json.loads(data)
+            os.setsid() # so the client can stop the command and its solver
+            _send(self.request, {'pid': os.getpid()})
+            for fd, target in zip(fds, (0, 1, 2)):
+                os.dup2(fd, target)
+                os.close(fd)
+            os.chdir(request['cwd'])
+            _send(self.request, {'exit': run_command(request['argv'])})
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    old_umask = os.umask(0o177) # socket only usable by this user
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(old_umask)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    logger.info("Listening on %s", path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep ddcalc loaded so ddcalc commands start in milliseconds")
+    parser.add_argument('--socket', help="Unix socket to listen on (default: $DDCALC_DAEMON_SOCKET, "
+                                         "or ddcalc-<uid>.sock in $XDG_RUNTIME_DIR or the temporary directory)")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(levelname)s %(name)s: %(message)s")
+
+    if not hasattr(socket, 'send_fds') or not hasattr(os, 'fork'):
+        print("ddcalc-daemon needs Unix sockets and fork().", file=sys.stderr)
+        sys.exit(1)
+    path = args.socket or default_socket_path()
+    if _running(path):
+        print(f"A ddcalc-daemon is already listening on {path}.", file=sys.stderr)
+        sys.exit(1)
+    if os.path.exists(path):
+        os.unlink(path) # left behind by a daemon that was killed
+    warm()
+    serve(path)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,67 @@
+import os
+import copy
+import json
+import time
+import logging
+import tempfile
+import functools
+import contextlib
 import pulp
 import argparse # We'll use Namespace to mimic args
 
 # Attempt relative imports for use within the package
 from .core.model_builder import prepare_pulp
+from .core.horizon import apply_horizon
+from .core.modes import SOLVE_MODES, POOL_MODES
+from .core.race import default_portfolio, run_race, DEADLINE_GRACE
+from .core.profiles import profile_for, PROFILE_SETTINGS
+from .utils.pulp import make_solver
 from .core.results_processor import retrieve_results, print_ascii, print_csv
+from .utils.metrics import parse_cbc_log
+from .utils.logcontext import request_context, request_id_var
+from .utils.scheduler import get_scheduler
+from .core.scaling import Scaling
+
+logger = logging.getLogger(__name__)
+
+POOL_ATTEMPTS = 3
+
+# Fast mode: a relaxed binary within this distance of 0 or 1 is decisive and
+# gets fixed (with Big M = 1e8 a condition of a few dollars already shows as
+# ~1e-8, so this must be tight). The undecided binaries are solved in windows
+# of consecutive periods holding up to FAST_WINDOW_BINARIES of them.
+FAST_DECISIVE_TOL = 1e-9
+FAST_WINDOW_BINARIES = 25
+
+# Start hints: most seconds the solve with the hinted decisions pinned may
+# take, and the relative band around each hint they are pinned to (results
+# are rounded to the dollar, and exact values collide with constraints such
+# as the RMD that tie one decision to the balances the others leave)
+START_SECONDS = 10
+START_BAND = 0.01
+
+# CBC option that ends a checkpointed solve's first pass at its first plan
+FIRST_PLAN_OPTION = "maxSolutions 1"
+
+# Yearly decisions that tell two withdrawal plans apart
+PLAN_DECISIONS = ['Cash_Withdraw', 'Brokerage_Withdraw', 'IRA_Withdraw', 'Roth_Withdraw', 'IRA_to_Roth']
+
+
+def _plan_rows(results):
+    """The yearly withdrawal and conversion amounts of a plan, to the dollar."""
+    return [tuple(round(row.get(k, 0)) for k in PLAN_DECISIONS)
+            for _, row in sorted(results['retire'].items())]
 
 class DDCalc:
     """
     Encapsulates the financial planning model setup, solving, and results processing.
+
+    Instances hold no shared state: each solve writes the solver's files to
+    its own temporary directory, so many DDCalc objects can solve at once in
+    one process (one instance per thread).
     """
-    def __init__(self, data, objective_config=None):
+    def __init__(self, data, objective_config=None, solve_hook=None, request_id=None, scheduler=None,
+                 profiles=None, checkpoint=None):
         """
         Initializes the DDCalc object.
 
@@ -20,37 +72,53 @@ class DDCalc:
                          {'type': 'max_assets', 'value': 100000}
                          {'type': 'min_taxes', 'value': 100000}
                 Defaults to {'type': 'max_spend'}.
+            solve_hook (callable, optional): Called with a dict of solver
+                statistics (status, relTol, seconds, nodes, iterations, gap,
+                objective, bound) after every solver pass.
+            request_id (str, optional): Tag added to every log record emitted
+                while solving. Defaults to the caller's logging context.
+            scheduler (ThreadScheduler, optional): Decides how many solver
+                threads each pass uses. Defaults to the process-wide scheduler.
+            profiles (dict or False, optional): Tuned solver profiles (see
+                core.profiles and ddcalc-tune). Defaults to the profiles
+                file, if any; False disables them.
+            checkpoint (Checkpoint, optional): Where exact solves with a time
+                limit longer than its interval save their best plan so far,
+                and resume from (see core.checkpoint).
         """
         self.data = data
+        self.metrics = data.metrics
+        self.solve_hook = solve_hook
+        self.request_id = request_id
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        self.profiles = profiles
+        self.checkpoint = checkpoint
         self.prob = None
         self.solver = None
         self.objectives = None
         self.results = None
         self.S_out = None
         self.status = None
+        self.quality = None
+        self.alternatives = None
+        self.model_args = None
 
         # Set default objective if not provided
         if objective_config is None:
             self.objective_config = {'type': 'max_spend'}
         else:
             self.objective_config = objective_config
-        print(objective_config)
+        logger.debug("Objective: %s", self.objective_config)
 
-    def solve(self, timelimit=None, verbose=False, pessimistic_taxes=False, pessimistic_healthcare=False, 
-              allow_conversions=True, no_conversions=False, no_conversions_after_socsec=False,
-              relTol_steps=[1.0, 0.9999, 0.999, 0.99]):
-        """
-        Prepares and solves the linear programming problem.
+    def _log_context(self):
+        return request_context(self.request_id) if self.request_id else contextlib.nullcontext()
 
-        Args:
-            timelimit (int, optional): Time limit for the solver in seconds.
-            verbose (bool): Enable verbose solver output.
-            pessimistic_taxes (bool): Use pessimistic tax assumptions.
-            pessimistic_healthcare (bool): Use pessimistic healthcare cost assumptions.
-            relTol_steps (list): Relative tolerance steps for sequential solve.
-        """
+    def _model_args(self, timelimit=None, verbose=False, pessimistic_taxes=False, pessimistic_healthcare=False,
+                    allow_conversions=True, no_conversions=False, no_conversions_after_socsec=False,
+                    solver_settings=None):
+        """Builds the argparse-like options object expected by prepare_pulp."""
         # Create a mock 'args' object for prepare_pulp
-        mock_args = argparse.Namespace(
+        return argparse.Namespace(
             verbose=verbose,
             timelimit=timelimit,
             pessimistic_taxes=pessimistic_taxes,
@@ -58,28 +126,617 @@ class DDCalc:
             allow_conversions=allow_conversions,
             no_conversions=no_conversions,
             no_conversions_after_socsec=no_conversions_after_socsec,
+            solver_settings=solver_settings or {},
             max_spend=(self.objective_config.get('type') == 'max_spend'),
             max_assets=self.objective_config.get('value') if self.objective_config.get('type') == 'max_assets' else None,
             min_taxes=self.objective_config.get('value') if self.objective_config.get('type') == 'min_taxes' else None,
             # Add other args defaults if prepare_pulp needs them
         )
 
-        print("Starting PuLP solver...")
+    def solve(self, timelimit=None, verbose=False, pessimistic_taxes=False, pessimistic_healthcare=False, 
+              allow_conversions=True, no_conversions=False, no_conversions_after_socsec=False,
+              relTol_steps=[1.0, 0.9999, 0.999, 0.99], horizon=None, mode=None, portfolio=None,
+              solver_settings=None, alternatives=0, alternatives_tolerance=0.01, alternatives_mode='best',
+              alternatives_distance=2, start=None, scaling=True):
+        """
+        Prepares and solves the linear programming problem.
+
+        Args:
+            timelimit (int, optional): Time limit for the solver in seconds.
+            verbose (bool): Enable verbose solver output.
+            pessimistic_taxes (bool): Use pessimistic tax assumptions.
+            pessimistic_healthcare (bool): Use pessimistic healthcare cost assumptions.
+            relTol_steps (list): Relative tolerance steps for sequential solve.
+            horizon (str, optional): 'annual' (one period per year) or 'multi'
+                (annual near term and around rule changes, multi-year steps
+                elsewhere; see core.horizon). Default: the data's current
+                periods.
+            mode (str, optional): 'exact' (default), 'fast': relax-and-fix, see
+                _solve_fast (results carry 'quality' with the gap to the LP
+                relaxation bound), or 'race': several solver setups at once,
+                see _solve_race.
+            portfolio (list, optional): Solver setups for 'race' (see
+                core.race.DEFAULT_PORTFOLIO).
+            solver_settings (dict, optional): CBC settings (presolve, gapRel,
+                seed; see utils.pulp.make_solver), overriding the profile's.
+            alternatives (int): Number of alternative plans to find after
+                the optimal one (see _solve_pool); returned by get_results()
+                under 'alternatives'.
+            alternatives_tolerance (float): How much worse (relative) than
+                the optimum an alternative's objective may be.
+            alternatives_mode (str): 'best' (the best plans that differ) or
+                'diverse' (the plans that differ the most).
+            alternatives_distance (int): Minimum number of yes/no tax and ACA
+                choices in which every plan differs from the others.
+            start (dict, optional): Expected decisions, {variable prefix
+                (e.g. 'IRA_Withdraw'): list of yearly amounts}, such as last
+                year's plan (see ddcalc.replan). The exact solve starts from
+                the plan they lead to (see _solve_start).
+            scaling (bool): Solve the model in scaled units (see
+                core.scaling). The plan is one of the model's optimal
+                plans in dollars either way; when several plans tie, which
+                one is returned depends on the solver's path.
+        """
+        profile = self._profile()
+        mode = mode or 'exact'
+        solver_settings = dict({k: profile[k] for k in PROFILE_SETTINGS if k in profile},
+                               **(solver_settings or {}))
+        if mode not in SOLVE_MODES:
+            raise ValueError(f"Unknown solve mode '{mode}' (use {', '.join(SOLVE_MODES)})")
+        if horizon:
+            apply_horizon(self.data, horizon)
+        mock_args = self._model_args(timelimit, verbose, pessimistic_taxes, pessimistic_healthcare,
+                                     allow_conversions, no_conversions, no_conversions_after_socsec,
+                                     solver_settings)
+        mock_args.mode = mode
+        mock_args.scaling = scaling
+        self.model_args = mock_args
+        self.quality = None
+        self.alternatives = None
+        if alternatives_mode not in POOL_MODES:
+            raise ValueError(f"Unknown alternatives mode '{alternatives_mode}' (use {', '.join(POOL_MODES)})")
+
+        with self._log_context(), tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+            logger.info("Starting PuLP solver...")
+            self._solve_mode(mode, mock_args, verbose, workdir, relTol_steps, portfolio, start)
+            logger.info("Final solver status: %s", self.status)
+            if alternatives and self.status == "Optimal":
+                self._solve_pool(alternatives, alternatives_tolerance, alternatives_mode,
+                                 alternatives_distance, verbose, workdir)
+
+    def prepare(self, timelimit=None, verbose=False, pessimistic_taxes=False, pessimistic_healthcare=False,
+                allow_conversions=True, no_conversions=False, no_conversions_after_socsec=False,
+                horizon=None, solver_settings=None, scaling=True):
+        """
+        Builds the model without solving it, for callers that change the
+        model or its objectives before solve_prepared() (see ddcalc.robust).
+        Arguments are as for solve(); the tuned profile is not used.
+        """
+        if horizon:
+            apply_horizon(self.data, horizon)
+        self.model_args = self._model_args(timelimit, verbose, pessimistic_taxes, pessimistic_healthcare,
+                                           allow_conversions, no_conversions, no_conversions_after_socsec,
+                                           solver_settings)
+        self.model_args.mode = 'exact'
+        self.model_args.scaling = scaling
+        self.quality = None
+        self.alternatives = None
+        with self.metrics.stage('model_build'):
+            self.prob, self.solver, self.objectives = prepare_pulp(self.model_args, self.data)
+        self.metrics.record_model(self.prob)
+
+    def solve_prepared(self):
+        """Solves the model from prepare() as it stands, for self.objectives."""
+        with self._log_context(), tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir, \
+             self.metrics.stage('solve'), \
+             self.scheduler.slot(self.metrics.counters.get('binaries')) as threads:
+            self.solver.optionsDict['threads'] = threads
+            self._drop_sequence_constraints()
+            self._solve_pass(1.0, self.model_args.verbose, workdir)
+
+    def _solve_mode(self, mode, mock_args, verbose, workdir, relTol_steps, portfolio=None, start=None):
+        """Builds and solves the model with the given solve mode."""
+        if mode == 'fast':
+            if self._solve_fast(mock_args, verbose, workdir):
+                return
+            logger.warning("Fast solve found no plan (%s); falling back to the exact solve", self.status)
+        elif mode == 'race':
+            self._solve_race(mock_args, portfolio)
+            return
+        resume = self._resume_state(mock_args)
+        if resume and resume['relTol'] in relTol_steps:
+            relTol_steps = relTol_steps[relTol_steps.index(resume['relTol']):]
         for relTol in relTol_steps:
-            self.prob, self.solver, self.objectives = prepare_pulp(mock_args, self.data)
-            print(f"Searching solution with relTol={relTol}")
+            with self.metrics.stage('model_build'):
+                self.prob, self.solver, self.objectives = prepare_pulp(mock_args, self.data)
+            self.metrics.record_model(self.prob)
+            logger.info("Searching solution with relTol=%s", relTol)
 #            self.objectives = [self.objectives[0]] # If you only want the primary objective
-            self.prob.sequentialSolve(self.objectives, relativeTols=[relTol]*len(self.objectives), solver=self.solver)
-            self.status = pulp.LpStatus[self.prob.status]
+            if resume and resume['complete']:
+                self._load_values(resume['values'])
+                self.prob.status, self.status = pulp.LpStatusOptimal, "Optimal"
+                logger.info("Resumed the finished solve of checkpoint %s", self.checkpoint.plan_id)
+                break
+            with self.metrics.stage('solve'), \
+                 self.scheduler.slot(self.metrics.counters.get('binaries')) as threads:
+                self.solver.optionsDict['threads'] = threads
+                if start and not resume:
+                    self._solve_start(start, verbose, workdir)
+                try:
+                    if self.checkpoint and (resume or self.solver.timeLimit > self.checkpoint.interval):
+                        self._solve_checkpointed(relTol, verbose, workdir, mock_args, resume)
+                    else:
+                        self._solve_pass(relTol, verbose, workdir)
+                finally:
+                    self.solver.optionsDict['warmStart'] = False
+            resume = None
             if self.status == "Optimal":
-                print(f"Found solution with relTol={relTol}")
+                logger.info("Found solution with relTol=%s", relTol)
                 break
             else:
-                print(f"Solver status: {self.status} with relTol={relTol}")
+                logger.warning("Solver status: %s with relTol=%s", self.status, relTol)
                 if relTol != relTol_steps[-1]:
-                    print("Trying with a less strict tolerance...")
+                    logger.info("Trying with a less strict tolerance...")
+
+    def _solve_start(self, start, verbose, workdir):
+        """
+        Turns start hints into a MIP start for the next pass. A MIP start
+        needs every variable, the Big-M indicator binaries included, so the
+        hinted decisions of the first year of each period are fixed and the
+        much smaller model that is left is solved for at most START_SECONDS.
+        If it has a plan, the bounds are restored and the pass starts from
+        that plan; if not (the hints no longer fit the data), it starts cold.
+        """
+        names = {}
+        for prefix, values in start.items():
+            for p, (first, _) in enumerate(self.data.periods):
+                if first < len(values) and values[first] is not None:
+                    names[f"{prefix}_{p}"] = values[first]
+        fixed = [(v, v.lowBound, v.upBound) for v in self.prob.variables() if v.name in names]
+        if not fixed:
+            return
+        timelimit = self.solver.timeLimit
+        try:
+            for v, _, _ in fixed:
+                v.lowBound, v.upBound = names[v.name] * (1 - START_BAND), names[v.name] * (1 + START_BAND)
+            self.solver.timeLimit = min(START_SECONDS, timelimit or START_SECONDS)
+            with self.metrics.stage('start'):
+                self._solve_pass(1.0, verbose, workdir)
+        finally:
+            for v, low, up in fixed:
+                v.lowBound, v.upBound = low, up
+            self.solver.timeLimit = timelimit
+            self._drop_sequence_constraints()
+        self.metrics.counters['start_fixed'] = len(fixed)
+        if self.status != "Optimal":
+            logger.info("Start hints lead to no plan (%s); solving without them", self.status)
+            return
+        logger.info("Starting from the hinted plan (objective %s)", pulp.value(self.objectives[0]))
+        self.solver.optionsDict['warmStart'] = True
+
+    def _solve_pool(self, count, tolerance, pool_mode, distance, verbose, workdir):
+        """
+        Searches the built model for up to `count` alternatives to the
+        optimal plan: the objective is held within `tolerance` of the
+        optimum, and each new plan must differ from every earlier one in at
+        least `distance` of the Big-M indicator choices (tax bracket, ACA
+        and similar yes/no decisions). In 'best' mode each alternative
+        maximizes the original objective, in 'diverse' mode its total
+        distance from the earlier plans. Indicators are free to flip where
+        both sides of a min/max tie, so an alternative whose yearly plan
+        matches an earlier one is cut off and not counted; the search stops
+        after POOL_ATTEMPTS solves per requested plan. The model is
+        re-solved in place, without rebuilding it, and every plan goes
+        through retrieve_results. Afterwards the model holds the optimal
+        plan again.
+        """
+        binaries = [v for period in sorted(self.prob.indicators) for v in self.prob.indicators[period]]
+        primary = {v.name: v.varValue for v in self.prob.variables()}
+        primary_status, primary_objectives = self.prob.status, self.objectives
+        objective = self.objectives[0]
+        best = pulp.value(objective)
+        patterns = [{v.name: round(primary[v.name]) for v in binaries}]
+        plans = [_plan_rows(retrieve_results(argparse.Namespace(), self.data, self.prob)[0])]
+        added = ["Pool_Objective"]
+
+        self._drop_sequence_constraints()
+        for v in binaries:
+            v.lowBound, v.upBound = 0, 1 # fast mode leaves most of them fixed
+        self.prob += objective >= best - tolerance * abs(best), "Pool_Objective"
+        self.alternatives = []
+        try:
+            with self.metrics.stage('alternatives'), self.scheduler.slot(len(binaries)) as threads:
+                self.solver.optionsDict['threads'] = threads
+                for k in range(count * POOL_ATTEMPTS):
+                    if len(self.alternatives) >= count:
+                        break
+                    distances = [pulp.lpSum(v if pattern[v.name] == 0 else 1 - v for v in binaries)
+                                 for pattern in patterns]
+                    self.prob += distances[-1] >= distance, f"Pool_Cut_{k}"
+                    added.append(f"Pool_Cut_{k}")
+                    if pool_mode == 'diverse':
+                        self.objectives = [pulp.lpSum(distances)]
+                    self._drop_sequence_constraints()
+                    self._solve_pass(1.0, verbose, workdir)
+                    if self.status != "Optimal":
+                        logger.info("No further alternatives (%s)", self.status)
+                        break
+                    pattern = {v.name: round(v.varValue) for v in binaries}
+                    patterns.append(pattern)
+                    results, _, _ = retrieve_results(argparse.Namespace(), self.data, self.prob)
+                    plan = _plan_rows(results)
+                    if plan in plans:
+                        logger.debug("Alternative %d repeats an earlier plan", k)
+                        continue
+                    plans.append(plan)
+                    results['differences'] = sum(1 for name in pattern if pattern[name] != patterns[0][name])
+                    self.alternatives.append(results)
+        finally:
+            self.objectives = primary_objectives
+            for name in added:
+                self.prob.constraints.pop(name, None)
+            self._drop_sequence_constraints()
+            for v in self.prob.variables():
+                v.varValue = primary.get(v.name)
+            self.prob.status, self.status = primary_status, pulp.LpStatus[primary_status]
+        logger.info("Found %d alternative plans", len(self.alternatives))
+
+    def build_model(self):
+        """
+        Builds a fresh copy of the model of the last solve(), with its
+        primary objective set (e.g. for writing it out; see ddcalc.corpus).
+
+        Returns:
+            tuple: (prob, objectives)
+        """
+        if self.model_args is None:
+            raise RuntimeError("solve() has not been run yet")
+        prob, _, objectives = prepare_pulp(self.model_args, self.data)
+        prob.setObjective(objectives[0])
+        return prob, objectives
+
+    def _profile(self):
+        """Settings from the tuned profile for this plan's shape class ({} if none)."""
+        if self.profiles is False:
+            return {}
+        with self._log_context():
+            return profile_for(self.data, self.profiles)
+
+    def _solve_pass(self, relTol, verbose, workdir):
+        """
+        Runs one sequentialSolve pass and records its statistics. The solver's
+        model, solution and log files go to workdir. Unless the solver is
+        printing to the terminal (verbose), its log is parsed for nodes,
+        iterations and gap.
+        """
+        self.solver.tmpDir = workdir
+        log_path = None
+        if not verbose:
+            log_path = os.path.join(workdir, "cbc.log")
+            self.solver.optionsDict['logPath'] = log_path
+        scaling = self._scaling()
+        start = time.perf_counter()
+        if scaling:
+            scaling.apply(self.objectives)
+        try:
+            self.prob.sequentialSolve(self.objectives, relativeTols=[relTol]*len(self.objectives), solver=self.solver)
+        finally:
+            if scaling:
+                scaling.undo(self.objectives)
+        self.status = pulp.LpStatus[self.prob.status]
+        stats = {'status': self.status, 'relTol': relTol,
+                 'threads': self.solver.optionsDict.get('threads'),
+                 'seconds': round(time.perf_counter() - start, 6)}
+        if log_path and os.path.exists(log_path):
+            with open(log_path) as f:
+                stats.update(parse_cbc_log(f.read()))
+        self.metrics.record_solve(stats)
+        logger.debug("Solver pass: %s", stats)
+        if self.solve_hook:
+            self.solve_hook(stats)
+
+    def _scaling(self):
+        """The model's Scaling (see core.scaling), made on first use; None if scaling is off."""
+        if not getattr(self.model_args, 'scaling', True):
+            return None
+        if getattr(self.prob, 'scaling', None) is None:
+            self.prob.scaling = Scaling(self.prob, self.data)
+        return self.prob.scaling
+
+    def _solve_fast(self, mock_args, verbose, workdir):
+        """
+        Relax-and-fix: solves the LP relaxation, fixes every Big-M indicator
+        binary whose relaxed value is decisive (within FAST_DECISIVE_TOL of 0
+        or 1) and solves the much smaller MILP over the remaining binaries.
+        When many are left they are decided a window of consecutive periods
+        at a time (see FAST_WINDOW_BINARIES), with the binaries of later
+        periods still relaxed, and fixed before moving on.
+
+        The relaxation's objective bounds the exact optimum, so the gap
+        reported in self.quality bounds how far the plan is from optimal.
+
+        Returns:
+            bool: False if the fixed binaries left no feasible plan (the
+                  caller then runs the exact solve).
+        """
+        with self.metrics.stage('model_build'):
+            self.prob, self.solver, self.objectives = prepare_pulp(mock_args, self.data)
+        self.metrics.record_model(self.prob)
+        indicators = self.prob.indicators
+
+        with self.metrics.stage('solve'), \
+             self.scheduler.slot(self.metrics.counters.get('binaries')) as threads:
+            self.solver.optionsDict['threads'] = threads
+
+            self.solver.mip = False
+            self._solve_pass(1.0, verbose, workdir)
+            self.solver.mip = True
+            if self.status != "Optimal":
+                return True # no plan can exist if even the relaxation has none
+            bound = pulp.value(self.objectives[0])
+
+            # Fix the decisive binaries; group the rest into windows of periods
+            free = {}
+            fixed = 0
+            for period, binaries in indicators.items():
+                for v in binaries:
+                    value = v.varValue
+                    if value <= FAST_DECISIVE_TOL or value >= 1 - FAST_DECISIVE_TOL:
+                        v.lowBound = v.upBound = round(value)
+                        fixed += 1
+                    else:
+                        free.setdefault(period, []).append(v)
+            free_count = sum(len(b) for b in free.values())
+            windows = [[]]
+            size = 0
+            for p in sorted(free):
+                if size and size + len(free[p]) > FAST_WINDOW_BINARIES:
+                    windows.append([])
+                    size = 0
+                windows[-1].append(p)
+                size += len(free[p])
+            logger.info("Relaxation bound %s: fixed %d binaries, %d left in %d window(s)",
+                        bound, fixed, free_count, len(windows))
+
+            # Later windows stay relaxed until their turn
+            later = [v for w in windows[1:] for p in w for v in free[p]]
+            for v in later:
+                v.cat = pulp.LpContinuous
+            try:
+                for i, window in enumerate(windows):
+                    for p in window:
+                        for v in free[p]:
+                            v.cat = pulp.LpInteger
+                    self._drop_sequence_constraints()
+                    self._solve_pass(1.0, verbose, workdir)
+                    if self.status != "Optimal":
+                        return False
+                    if i < len(windows) - 1:
+                        for p in window:
+                            for v in free[p]:
+                                v.lowBound = v.upBound = round(v.varValue)
+            finally:
+                for v in later:
+                    v.cat = pulp.LpInteger
+
+        objective = pulp.value(self.objectives[0])
+        self.quality = {
+            'mode': 'fast',
+            'objective': objective,
+            'bound': bound,
+            'gap': (bound - objective) / abs(bound) if bound else 0.0,
+            'fixed_binaries': fixed,
+            'free_binaries': free_count,
+            'windows': len(windows),
+        }
+        logger.info("Fast solve: %s", self.quality)
+        return True
+
+    def _solve_race(self, mock_args, portfolio=None):
+        """
+        Races several solver setups (tolerances, presolve, seeds and other
+        installed solvers; see core.race) in separate processes, splitting
+        the threads the scheduler grants this solve. The first optimal answer wins and the other
+        racers are cancelled; if none is optimal by the deadline the best
+        answer found is used. The winning values are loaded into a freshly
+        built model, so results are extracted as for any other solve.
+        """
+        deadline = (float(mock_args.timelimit) if mock_args.timelimit else 90) + DEADLINE_GRACE
+        with self.metrics.stage('solve'), self.scheduler.slot() as cpus:
+            entries = portfolio or default_portfolio(max(2, cpus))
+            threads = max(1, cpus // len(entries))
+            task = {'data': self.data, 'args': mock_args, 'objective': self.objective_config,
+                    'threads': threads, 'request_id': self.request_id or request_id_var.get()}
+            winner, result, finished = run_race(functools.partial(race_pass, task), entries, deadline)
+        for i, r in sorted(finished.items()):
+            self.metrics.record_solve(dict(r.get('stats', {}), racer=entries[i].get('name')))
+
+        with self.metrics.stage('model_build'):
+            self.prob, self.solver, self.objectives = prepare_pulp(mock_args, self.data)
+        self.metrics.record_model(self.prob)
+        if result is None or result.get('objective') is None:
+            self.status = result['status'] if result else "Not Solved"
+            self.prob.status = pulp.LpStatusUndefined
+            return
+        for v in self.prob.variables():
+            v.varValue = result['values'].get(v.name)
+        self.prob.status = result['prob_status']
+        self.status = result['status']
+        self.quality = {
+            'mode': 'race',
+            'winner': entries[winner].get('name'),
+            'racers': len(entries),
+            'finished': len(finished),
+        }
+        logger.info("Race: %s", self.quality)
+
+    def _checkpoint_key(self, mock_args):
+        """Identifies the model a checkpoint's values belong to (everything but the time limit and scaling)."""
+        options = {k: v for k, v in vars(mock_args).items() if k not in ('timelimit', 'verbose', 'scaling')}
+        return json.dumps({'options': options, 'objective': self.objective_config, 'periods': self.data.periods},
+                          sort_keys=True, default=str)
+
+    def _resume_state(self, mock_args):
+        """The checkpoint saved by an earlier run of this solve, if there is one."""
+        if self.checkpoint is None:
+            return None
+        state = self.checkpoint.load()
+        if state is None:
+            return None
+        if state.get('key') != self._checkpoint_key(mock_args):
+            logger.info("Checkpoint %s is for other solve options; starting over", self.checkpoint.plan_id)
+            return None
+        logger.info("Resuming from checkpoint %s (objective %s after %.0fs)", self.checkpoint.plan_id,
+                    state.get('objective'), state.get('seconds', 0))
+        return state
+
+    def _load_values(self, values):
+        for v in self.prob.variables():
+            v.varValue = values.get(v.name, 0)
+
+    def _solve_checkpointed(self, relTol, verbose, workdir, mock_args, resume=None):
+        """
+        Runs a solver pass in intervals of checkpoint.interval seconds, up
+        to the time limit, and saves the incumbent after each one. Until
+        there is a plan to start from, the solver runs in one pass that CBC
+        stops at its first plan (FIRST_PLAN_OPTION), since restarting it
+        cold would only repeat the same search. Every interval after that
+        warm-starts from the last incumbent, as does a pass resumed from a
+        checkpoint, which also counts the seconds spent before toward the
+        time limit (leaving it at least one interval). An interval that
+        ends without a plan (CBC can report a short warm-started run as
+        infeasible) leaves the last incumbent in place.
+        """
+        timelimit = self.solver.timeLimit
+        options = list(self.solver.options)
+        spent = 0.0
+        values = None
+        if resume:
+            spent = max(0.0, min(resume['seconds'], timelimit - self.checkpoint.interval))
+            values = resume['values']
+            self._load_values(values)
+            self.solver.optionsDict['warmStart'] = True
+        try:
+            while True:
+                if self.solver.optionsDict.get('warmStart'):
+                    self.solver.timeLimit = min(self.checkpoint.interval, timelimit - spent)
+                    self.solver.options = options
+                else:
+                    self.solver.timeLimit = timelimit - spent
+                    if isinstance(self.solver, pulp.COIN_CMD):
+                        self.solver.options = options + [FIRST_PLAN_OPTION]
+                self._drop_sequence_constraints()
+                start = time.perf_counter()
+                self._solve_pass(relTol, verbose, workdir)
+                spent += time.perf_counter() - start
+                incumbent = self.prob.sol_status == pulp.LpSolutionIntegerFeasible
+                if self.status == "Optimal":
+                    values = {v.name: v.varValue for v in self.prob.variables()}
+                    self._save_checkpoint(mock_args, relTol, spent, complete=not incumbent)
+                elif values is not None:
+                    logger.warning("Solver pass ended %s; keeping the last incumbent", self.status)
+                    self._load_values(values)
+                    self.prob.status, self.status = pulp.LpStatusOptimal, "Optimal"
+                    self.prob.sol_status = pulp.LpSolutionIntegerFeasible
+                    break
+                if spent >= timelimit - 1 or not incumbent:
+                    break
+                self.solver.optionsDict['warmStart'] = True
+        finally:
+            self.solver.timeLimit = timelimit
+            self.solver.options = options
+            self.solver.optionsDict['warmStart'] = False
+
+    def _save_checkpoint(self, mock_args, relTol, seconds, complete):
+        """Saves the current solution to the checkpoint; failures are only logged."""
+        try:
+            stats = self.metrics.solves[-1] if self.metrics.solves else {}
+            self.checkpoint.save({
+                'key': self._checkpoint_key(mock_args),
+                'relTol': relTol,
+                'objective': pulp.value(self.objectives[0]),
+                'bound': stats.get('bound'),
+                'seconds': round(seconds, 3),
+                'complete': complete,
+                'values': {v.name: v.varValue for v in self.prob.variables() if v.varValue},
+                'results': retrieve_results(argparse.Namespace(), self.data, self.prob)[0],
+            })
+        except Exception:
+            logger.exception("Saving checkpoint %s failed", self.checkpoint.plan_id)
+
+    def _drop_sequence_constraints(self):
+        """Removes the objective constraints sequentialSolve leaves behind, so the model can be solved again."""
+        for name in [n for n in self.prob.constraints if n.startswith("Sequence_Objective_")]:
+            del self.prob.constraints[name]
+
+    def estimate(self, timelimit=None, pessimistic_taxes=False, pessimistic_healthcare=False,
+                 allow_conversions=True, no_conversions=False, no_conversions_after_socsec=False,
+                 binaries=None, horizon=None):
+        """
+        Quickly estimates the plan by solving only the LP relaxation of the
+        model (the yes/no choices of the tax and ACA logic become fractions).
+        For a maximize objective the relaxed spending floor / end assets is
+        an upper bound on the exact answer.
+
+        Args:
+            binaries (dict, optional): Indicator values from an earlier exact
+                solve of a similar plan (see binary_values). Matching binaries
+                are fixed, which usually gives a much closer estimate. If that
+                is infeasible the plain relaxation is used.
+            Other arguments are as for solve().
+
+        Returns:
+            dict: Results as from get_results(), with 'estimate': True and
+                  'estimate_method' ('lp_relaxation' or 'cached_binaries'),
+                  or None if the relaxation could not be solved.
+        """
+        if horizon:
+            # The data may be shared with other solves; only the periods change
+            self.data = copy.copy(self.data)
+            apply_horizon(self.data, horizon)
+        mock_args = self._model_args(timelimit, False, pessimistic_taxes, pessimistic_healthcare,
+                                     allow_conversions, no_conversions, no_conversions_after_socsec)
+        self.model_args = mock_args
+        with self._log_context(), tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+            with self.metrics.stage('model_build'):
+                self.prob, _, self.objectives = prepare_pulp(mock_args, self.data)
+            self.metrics.record_model(self.prob)
+            self.solver = pulp.PULP_CBC_CMD(mip=False, msg=False, threads=1,
+                                            timeLimit=float(timelimit) if timelimit else 10)
+
+            fixed = []
+            if binaries:
+                for v in self.prob.variables():
+                    if v.name in binaries and v.cat == pulp.LpInteger:
+                        v.lowBound = v.upBound = binaries[v.name]
+                        fixed.append(v)
+            method = 'cached_binaries' if fixed else 'lp_relaxation'
+
+            with self.metrics.stage('estimate'):
+                self._solve_pass(1.0, False, workdir)
+                if self.status != "Optimal" and fixed:
+                    logger.info("Cached binaries infeasible (%s); using the plain LP relaxation", self.status)
+                    for v in fixed:
+                        v.lowBound, v.upBound = 0, 1
+                    method = 'lp_relaxation'
+                    self._drop_sequence_constraints()
+                    self._solve_pass(1.0, False, workdir)
+
+        results = self.get_results()
+        if results is not None:
+            results['estimate'] = True
+            results['estimate_method'] = method
+        return results
 
-        print(f"Final solver status: {self.status}")
+    def binary_values(self):
+        """
+        Returns {name: 0 or 1} for the binaries of the last solution; pass it
+        to estimate() for plans of the same shape.
+        """
+        if self.prob is None:
+            return {}
+        return {v.name: int(round(v.varValue)) for v in self.prob.variables()
+                if v.cat == pulp.LpInteger and v.varValue is not None}
 
     def get_results(self):
         """
@@ -89,13 +746,15 @@ class DDCalc:
             list: A list of dictionaries representing the yearly plan results,
                   or None if solving failed or hasn't been run.
         """
+        if self.prob is None and self.results is not None:
+            return self.results # already extracted and released
         if self.prob is None or self.status is None:
-            print("Solver has not been run yet.")
+            logger.warning("Solver has not been run yet.")
             return None
 
         # Not Solved can occur with time limit but might have a feasible solution
         if self.prob.status not in [pulp.LpStatusOptimal, pulp.LpStatusNotSolved]:
-             print(f"Solver did not find an optimal/feasible solution (Status: {self.status}).")
+             logger.warning("Solver did not find an optimal/feasible solution (Status: %s).", self.status)
              return None
 
         # Create a minimal mock 'args' for retrieve_results if needed
@@ -104,19 +763,40 @@ class DDCalc:
             # Add any args needed by retrieve_results, e.g., csv=False
         )
 
-        self.results, self.S_out, self.prob = retrieve_results(mock_args_results, self.data, self.prob)
+        with self.metrics.stage('result_extraction'):
+            self.results, self.S_out, self.prob = retrieve_results(mock_args_results, self.data, self.prob)
 
         if self.results is None:
-            print("Failed to retrieve results from the solver.")
+            logger.error("Failed to retrieve results from the solver.")
             return None
+        if self.quality:
+            self.results['quality'] = dict(self.quality)
+        if self.alternatives is not None:
+            self.results['alternatives'] = self.alternatives
 
         # Assuming results is the list of dictionaries ready for JSON
         return self.results
 
+    def release(self):
+        """
+        Drops the model, the solver and their solution once the results have
+        been extracted, so a server holds only the results per finished
+        request. get_results() keeps returning the extracted results;
+        binary_values(), build-dependent exports and checkpoints are no
+        longer available.
+        """
+        self.prob = None
+        self.solver = None
+        self.objectives = None
+        self.S_out = None
+
     def print_results_ascii(self):
         """Prints the results in ASCII table format."""
         if self.results and self.S_out:
             print_ascii(self.results, self.S_out)
+            for i, plan in enumerate(self.results.get('alternatives') or [], 1):
+                print(f"\nAlternative {i} ({plan['differences']} tax/ACA choices differ):")
+                print_ascii(plan, self.S_out)
         else:
             print("No results available to print.")
 
@@ -124,5 +804,28 @@ class DDCalc:
         """Prints the results in CSV format."""
         if self.results and self.S_out:
             print_csv(self.results, self.S_out)
+            for i, plan in enumerate(self.results.get('alternatives') or [], 1):
+                print(f"\nAlternative {i}")
+                print_csv(plan, self.S_out)
         else:
-            print("No results available to print.")
\ No newline at end of file
+            print("No results available to print.")
+
+
+def race_pass(task, entry):
+    """
+    Racer process body (see DDCalc._solve_race): builds and solves the
+    model of task ('data', 'args', 'objective', 'threads', 'request_id')
+    with one portfolio entry.
+    """
+    calc = DDCalc(task['data'], objective_config=task['objective'], request_id=task['request_id'], profiles=False)
+    calc.model_args = task['args']
+    with calc._log_context(), tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+        calc.prob, _, calc.objectives = prepare_pulp(calc.model_args, calc.data)
+        calc.solver = make_solver(entry, calc.model_args.timelimit, task['threads'])
+        calc._solve_pass(1.0, False, workdir)
+    values = {v.name: v.varValue for v in calc.prob.variables()}
+    objective = None
+    if None not in values.values() and calc.prob.status in [pulp.LpStatusOptimal, pulp.LpStatusNotSolved]:
+        objective = pulp.value(calc.objectives[0])
+    return {'status': calc.status, 'prob_status': calc.prob.status, 'objective': objective,
+            'values': values, 'stats': calc.metrics.solves[-1]}
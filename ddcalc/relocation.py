@@ -0,0 +1,172 @@
+import copy
+import logging
+import time
+
+import pulp
+
+from ddcalc.batch import solve_options, make_executor, default_workers, MODEL_OPTIONS
+from ddcalc.core.data_loader import Data, load_reference, STATE_TAX_FILE
+from ddcalc.ddcalc import DDCalc
+from ddcalc.utils.logcontext import request_context
+
+logger = logging.getLogger(__name__)
+
+# Seconds a state's solve must take before the next state starts from its
+# plan: quicker solves find a first plan on their own sooner than CBC
+# checks a given one, slower ones (often stopped by the time limit) end
+# with a better plan when they start from a good one
+WARM_START_AFTER = 5
+
+
+def available_states(data):
+    """Abbreviations of the states the reference file has taxes for at the plan's filing status, sorted."""
+    suffix = f"_{getattr(data, 'status', 'MFJ')}"
+    return sorted(heading[:-len(suffix)] for heading in load_reference(STATE_TAX_FILE) if heading.endswith(suffix))
+
+
+def _top_rate(state, data):
+    brackets = load_reference(STATE_TAX_FILE)[f"{state}_{getattr(data, 'status', 'MFJ')}"].get('brackets', [[0, 0]])
+    return max(rate for _, rate in brackets)
+
+
+def _chunks(states, count):
+    return [states[i * len(states) // count:(i + 1) * len(states) // count] for i in range(count)]
+
+
+def solve_states(task):
+    """
+    Worker entry point: solves the plan in task['data'] (a loaded Data) for
+    each of task['states'] in turn on one model, swapping only its state
+    tax rows between states (see model_builder's swap_state_tax). When
+    the previous state took a while to solve (WARM_START_AFTER), the next
+    one starts from its plan. A state whose FPL differs (AK, HI) gets the
+    model rebuilt, keeping the previous plan as the start.
+
+    Returns:
+        list: Per state, a dict with 'state', 'status', 'seconds',
+              'warm_start' and, when a plan was found, 'objective',
+              'spending_floor', 'endofplan_assets' and
+              'lifetime_state_tax' (the sum of the yearly state tax, in
+              today's dollars).
+    """
+    data = task['data']
+    items = []
+    with request_context(task.get('request_id')):
+        calc = DDCalc(data, objective_config=task['objective'], profiles=False)
+        built_fpl = None
+        for state in task['states']:
+            start = time.perf_counter()
+            data.set_state(state)
+            if calc.prob is None or data.fpl_amount != built_fpl:
+                values = {v.name: v.varValue for v in calc.prob.variables()} if calc.prob is not None else None
+                calc.prepare(timelimit=task.get('timelimit'), **task['options'])
+                built_fpl = data.fpl_amount
+                if values:
+                    calc._load_values(values)
+            else:
+                calc.prob.swap_state_tax()
+            warm = bool(items) and items[-1]['status'] == "Optimal" and items[-1]['seconds'] >= WARM_START_AFTER
+            calc.solver.optionsDict['warmStart'] = warm
+            calc.solve_prepared()
+            item = {'state': state, 'status': calc.status, 'warm_start': warm}
+            results = calc.get_results() if calc.status == "Optimal" else None
+            if results:
+                item.update(objective=pulp.value(calc.objectives[0]),
+                            spending_floor=results['spending_floor'],
+                            endofplan_assets=results['endofplan_assets'],
+                            lifetime_state_tax=sum(row['State_Tax'] for row in results['retire'].values()))
+            item['seconds'] = round(time.perf_counter() - start, 3)
+            logger.info("State %s: %s in %.1fs", state, calc.status, item['seconds'])
+            items.append(item)
+        calc.release()
+    return items
+
+
+def compare_states(config, states=None, timelimit=None, executor=None, request_id=None):
+    """
+    Compares retiring in different states: the same plan solved with each
+    state's income tax, ranked by objective (the spending floor by
+    default), then by lifetime state tax. The config and the tax reference
+    files are parsed once; the states are split between parallel workers,
+    each of which builds the model once and only swaps the state tax part
+    of it from one state to the next (see solve_states). States with
+    similar top rates go to the same worker, so a hard plan's next state
+    can start near the previous one's plan.
+
+    Args:
+        config (dict): The plan's config, with solver options under 'arguments'.
+        states (list, optional): State abbreviations; every state in the
+            reference file for the plan's filing status if not given.
+        timelimit (float, optional): Seconds per state.
+        executor (Executor, optional): Process pool for the workers. A pool
+            from batch.make_executor() is created (and shut down) if not
+            given.
+        request_id (str, optional): Tag for the log records of the solves.
+
+    Returns:
+        dict: 'states' (the solve_states items, ranked, with 'rank' and
+              'current' added; states without a plan last), 'current'
+              (the config's own state, or None), 'workers' and 'seconds'.
+
+    Raises:
+        ValueError: For a state the reference file has no taxes for.
+    """
+    start = time.perf_counter()
+    data = Data()
+    data.load_config(copy.deepcopy(config)) # load_config normalizes in place
+    known = available_states(data)
+    states = [s.upper() for s in states] if states else known
+    unknown = [s for s in states if s not in known]
+    if unknown:
+        raise ValueError(f"No state tax data for {', '.join(unknown)} (filing status {getattr(data, 'status', 'MFJ')})")
+    states = sorted(dict.fromkeys(states), key=lambda s: (_top_rate(s, data), s))
+    current = config.get('taxes', {}).get('state')
+    current = current.upper() if current else None
+
+    objective_cfg, options = solve_options(config)
+    options = {k: options[k] for k in MODEL_OPTIONS}
+    workers = min(len(states), default_workers())
+    tasks = [{'data': data, 'states': chunk, 'objective': objective_cfg, 'options': options,
+              'timelimit': timelimit, 'request_id': request_id} for chunk in _chunks(states, workers)]
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor(workers)
+    try:
+        items = [item for chunk in executor.map(solve_states, tasks) for item in chunk]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    solved = sorted((item for item in items if item['status'] == "Optimal"),
+                    key=lambda item: (-round(item['objective'], 2), item['lifetime_state_tax']))
+    ranked = solved + [item for item in items if item['status'] != "Optimal"]
+    for rank, item in enumerate(ranked, 1):
+        item['rank'] = rank if item['status'] == "Optimal" else None
+        item['current'] = item['state'] == current
+    return {'states': ranked, 'current': current, 'workers': workers,
+            'seconds': round(time.perf_counter() - start, 3)}
+
+
+def print_relocation(summary):
+    """Prints the ranked states with their spending floor, lifetime state tax and change from the current state."""
+    current = next((s for s in summary['states'] if s['current'] and s['rank']), None)
+    print(f"Relocation comparison: {len(summary['states'])} states in {summary['seconds']:.1f}s "
+          f"({summary['workers']} workers)")
+    print()
+    header = f"{'rank':>4} {'state':5} {'floor':>8} {'state tax':>10}"
+    if current:
+        header += f" {'vs ' + current['state']:>8}"
+    print(header)
+    for s in summary['states']:
+        if s['rank'] is None:
+            print(f"{'-':>4} {s['state']:5} {s['status']}")
+            continue
+        line = f"{s['rank']:4d} {s['state'] + ('*' if s['current'] else ''):5} " \
+               f"{s['spending_floor']:8.0f} {s['lifetime_state_tax']:10.0f}"
+        if current:
+            line += f" {s['spending_floor'] - current['spending_floor']:+8.0f}"
+        print(line)
+    if current:
+        print(f"\n* current state; floor and lifetime state tax in today's dollars")
+    else:
+        print("\nFloor and lifetime state tax in today's dollars")
@@ -0,0 +1,184 @@
+import logging
+import threading
+
+from ddcalc.batch import deep_merge, solve_options
+from ddcalc.core.data_loader import Data
+from ddcalc.ddcalc import DDCalc
+from ddcalc.utils.logcontext import request_context
+
+logger = logging.getLogger(__name__)
+
+# Account sections of the config and their balance columns in the results
+ACCOUNTS = {'aftertax': 'Brokerage_Balance', 'IRA': 'IRA_Balance', 'roth': 'Roth_Balance'}
+
+# Decisions carried over from last year's plan, with the accounts they draw on
+START_DECISIONS = {
+    'Brokerage_Withdraw': ['aftertax'],
+    'IRA_Withdraw': ['IRA'],
+    'IRA_to_Roth': ['IRA'],
+    'Roth_Withdraw': ['roth', 'IRA'], # conversions feed the Roth
+}
+
+
+def _yearly_rows(previous):
+    """The 'retire' rows of a plan by year (the keys are strings after JSON)."""
+    return {int(y): row for y, row in previous['retire'].items()}
+
+
+def _inflation(config):
+    return 1 + config.get('inflation', 0) / 100
+
+
+def replan_config(config, update, previous=None):
+    """
+    The config for next year's plan: last year's config with the update
+    merged in (see batch.deep_merge). Unless the update says otherwise,
+    startage moves one year on, every account balance is the one last
+    year's plan projected for the new start, and the Roth contributions
+    list records the conversions and withdrawals of the years passed (see
+    _roth_contributions).
+
+    Args:
+        config (dict): Last year's config.
+        update (dict): Partial config with what changed: actual balances,
+            startage, income and expenses.
+        previous (dict, optional): Last year's results (get_results()).
+
+    Returns:
+        dict: The new config.
+    """
+    new = deep_merge(config, update)
+    if 'startage' not in update:
+        new['startage'] = config['startage'] + 1
+    shift = new['startage'] - config['startage']
+    row = _yearly_rows(previous).get(shift) if previous else None
+    if row:
+        growth = _inflation(config) ** shift
+        for section, column in ACCOUNTS.items():
+            if 'bal' not in update.get(section, {}):
+                new.setdefault(section, {})['bal'] = round(row[column] * growth)
+    if previous and 'contributions' not in update.get('roth', {}):
+        new.setdefault('roth', {})['contributions'] = _roth_contributions(config, _yearly_rows(previous), shift)
+    return new
+
+
+def _roth_contributions(config, rows, shift):
+    """
+    Last year's Roth contributions with the conversions of the first
+    `shift` years of its plan added, less the withdrawals of those years
+    (taken from the oldest contributions first, as the plan's basis limit
+    allows). Emptied contributions are kept for the age the account opened.
+    """
+    rate = _inflation(config)
+    contributions = sorted([age, amount] for age, amount in config.get('roth', {}).get('contributions', []))
+    for y in range(shift):
+        row = rows.get(y)
+        if row is None:
+            break
+        if row['IRA_to_Roth']:
+            contributions.append([config['startage'] + y, round(row['IRA_to_Roth'] * rate ** y)])
+        withdrawn = row['Roth_Withdraw'] * rate ** y
+        for contribution in contributions:
+            taken = min(withdrawn, contribution[1])
+            contribution[1] = round(contribution[1] - taken)
+            withdrawn -= taken
+    return contributions
+
+
+def start_hints(previous, config, data, shift):
+    """
+    Last year's decisions as start hints for the new plan (see
+    DDCalc.solve): the yearly amounts from `shift` years on, in the dollars
+    of their year. Where an account holds less than last year's plan
+    projected, the decisions drawing on it are scaled down in proportion,
+    so following them stays feasible.
+
+    Args:
+        previous (dict): Last year's results (get_results()).
+        config (dict): Last year's config.
+        data (Data): The new plan's data, loaded.
+        shift (int): Years between the two start ages.
+
+    Returns:
+        dict: {variable prefix: list of yearly amounts}.
+    """
+    rows = _yearly_rows(previous)
+    rate = _inflation(config)
+    projected = rows.get(shift)
+    scale = {}
+    for section, column in ACCOUNTS.items():
+        expected = projected[column] * rate ** shift if projected else 0
+        actual = getattr(data, section)['bal']
+        scale[section] = min(1.0, actual / expected) if expected > 0 else 1.0
+    hints = {prefix: [] for prefix in START_DECISIONS}
+    for y in range(data.numyr):
+        row = rows.get(y + shift)
+        for prefix, sections in START_DECISIONS.items():
+            if row is None:
+                hints[prefix].append(None) # beyond last year's plan
+            else:
+                hints[prefix].append(row[prefix] * rate ** (y + shift) * min(scale[s] for s in sections))
+    return hints
+
+
+def replan(config, previous, update=None, data=None, request_id=None):
+    """
+    Re-plans a year on: solves the plan of replan_config(config, update,
+    previous), starting from last year's plan shifted by the years passed
+    (see start_hints), which is usually close to the new optimum.
+
+    Args:
+        config (dict): Last year's config.
+        previous (dict): Last year's results (get_results()).
+        update (dict, optional): What changed (see replan_config).
+        data (Data, optional): Instance to load into, so the caller can read
+            its metrics afterwards.
+        request_id (str, optional): Tag for the log records of this solve.
+
+    Returns:
+        DDCalc: The solved calculator.
+    """
+    new_config = replan_config(config, update or {}, previous)
+    if data is None:
+        data = Data()
+    data.load_config(new_config)
+    objective_cfg, options = solve_options(new_config)
+    hints = start_hints(previous, config, data, new_config['startage'] - config['startage'])
+    ddcalc = DDCalc(data, objective_config=objective_cfg, request_id=request_id)
+    ddcalc.solve(start=hints, **options)
+    return ddcalc
+
+
+def replan_item(payload, request_id=None):
+    """
+    Worker entry point: re-plans one {"config", "previous", "update"}
+    payload and never raises. Returns a dict like batch.solve_item's, with
+    the new config under 'config'.
+    """
+    data = Data()
+    try:
+        with request_context(request_id):
+            ddcalc = replan(payload['config'], payload['previous'], payload.get('update'), data)
+            results = ddcalc.get_results()
+            ddcalc.release()
+        if results is None:
+            return {'result': None, 'error': "Solver did not find an optimal/feasible solution", 'metrics': data.metrics.as_dict()}
+        return {'result': results, 'config': replan_config(payload['config'], payload.get('update') or {}, payload['previous']),
+                'metrics': data.metrics.as_dict()}
+    except Exception as e:
+        logger.exception("Re-plan failed")
+        return {'error': f"Re-plan failed: {str(e)}", 'metrics': data.metrics.as_dict()}
+
+
+def run_replans(payloads, executor, request_id=None, concurrency=None):
+    """
+    Re-plans a list of payloads in parallel on executor, at most concurrency
+    (default: all) at once; one replan_item result per payload, in order.
+    """
+    slots = threading.BoundedSemaphore(concurrency or len(payloads) or 1)
+    futures = []
+    for payload in payloads:
+        slots.acquire()
+        futures.append(executor.submit(replan_item, payload, request_id))
+        futures[-1].add_done_callback(lambda future: slots.release())
+    return [future.result() for future in futures]
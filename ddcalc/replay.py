@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from ddcalc.capture import read_capture
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[k]
+
+
+def send(url, config, timeout):
+    """POSTs one config and returns (http_status, seconds)."""
+    body = json.dumps(config).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def replay(records, base_url, concurrency=1, rate=None, timeout=600):
+    """
+    Sends captured requests to a server. Returns the per-request results as
+    a list of (http_status, seconds, captured_seconds) and the elapsed time.
+
+    Args:
+        records: Capture records (see ddcalc.capture.read_capture).
+        base_url: Server root, e.g. http://127.0.0.1:5001
+        concurrency (int): Maximum requests in flight.
+        rate (float, optional): Requests started per second. Without it the
+            requests are sent back to back at the given concurrency.
+        timeout (float): Per-request timeout in seconds.
+    """
+    results = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def run(i, record):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        url = base_url.rstrip('/') + record.get('endpoint', '/calculate')
+        status, seconds = send(url, record['config'], timeout)
+        with lock:
+            results.append((status, seconds, record.get('seconds')))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, record in enumerate(records):
+            pool.submit(run, i, record)
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed, out=sys.stdout):
+    """Prints throughput and latency percentiles for a replay run."""
+    latencies = sorted(s for _, s, _ in results)
+    ok = sum(1 for status, _, _ in results if status == 200)
+    print(f"requests: {len(results)}  ok: {ok}  errors: {len(results) - ok}", file=out)
+    print(f"elapsed: {elapsed:.2f}s  throughput: {len(results) / elapsed if elapsed else 0:.2f} req/s", file=out)
+    print("latency (s): " + "  ".join(f"p{p}={percentile(latencies, p):.3f}" for p in (50, 90, 95, 99))
+          + f"  max={latencies[-1] if latencies else 0:.3f}", file=out)
+    captured = sorted(c for _, _, c in results if c is not None)
+    if captured:
+        print("captured latency (s): " + "  ".join(f"p{p}={percentile(captured, p):.3f}" for p in (50, 90, 99)), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured ddcalc-server requests and report latency")
+    parser.add_argument('capture', help="Capture file written by ddcalc-server --capture")
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help="Server to send requests to")
+    parser.add_argument('--concurrency', type=int, default=1, help="Maximum requests in flight")
+    parser.add_argument('--rate', type=float, help="Requests started per second (default: as fast as possible)")
+    parser.add_argument('--limit', type=int, help="Only replay the first N captured requests")
+    parser.add_argument('--repeat', type=int, default=1, help="Replay the capture this many times")
+    parser.add_argument('--timeout', type=float, default=600, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    records = list(read_capture(args.capture))
+    if args.limit:
+        records = records[:args.limit]
+    records = records * args.repeat
+    if not records:
+        print("No requests in capture file.")
+        sys.exit(1)
+
+    results, elapsed = replay(records, args.url, args.concurrency, args.rate, args.timeout)
+    report(results, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import copy
+import logging
+import tempfile
+import time
+
+import pulp
+
+from ddcalc.batch import deep_merge, solve_options, make_executor, default_workers, MODEL_OPTIONS
+from ddcalc.core.data_loader import Data
+from ddcalc.core.modes import ROBUST_MEASURES, ROBUST_METHODS
+from ddcalc.core.results_processor import print_ascii
+from ddcalc.ddcalc import DDCalc
+from ddcalc.utils.logcontext import request_context
+
+logger = logging.getLogger(__name__)
+
+# Decisions every scenario shares in the first-stage years
+FIRST_STAGE_DECISIONS = ['Brokerage_Withdraw', 'IRA_Withdraw', 'Roth_Withdraw', 'IRA_to_Roth']
+
+# Progressive hedging: the proximal term (rho / 2) * d ** 2 on a
+# scenario's first-stage decision d dollars away from the consensus, with
+# rho in objective units per dollar squared and grown each iteration; CBC
+# sees it as linear pieces between PROXIMAL_BREAKS dollars. Then the
+# largest difference in dollars that still counts as agreement, and the
+# iteration limit
+CONSENSUS_RHO = 2e-5
+CONSENSUS_RHO_GROWTH = 1.2
+PROXIMAL_BREAKS = [0, 10, 100, 1000, 10000, 100000]
+CONSENSUS_TOLERANCE = 1.0
+CONSENSUS_ITERATIONS = 40
+
+
+def scenario_config(config, scenario):
+    """
+    The config of one scenario: the plan's config with the scenario merged
+    in (usually 'returns' and 'inflation'; 'name' and 'weight' describe the
+    scenario itself).
+    """
+    return deep_merge(config, {k: v for k, v in scenario.items() if k not in ('name', 'weight')})
+
+
+def first_stage_variables(prob, data, years):
+    """{name: variable} of the first-stage decisions of the periods starting in the first `years` years."""
+    variables = prob.variablesDict()
+    return {f"{prefix}_{p}": variables[f"{prefix}_{p}"]
+            for p, (first, _) in enumerate(data.periods) if first < years
+            for prefix in FIRST_STAGE_DECISIONS if f"{prefix}_{p}" in variables}
+
+
+def _prepare(config, objective, options, timelimit):
+    data = Data()
+    data.load_config(copy.deepcopy(config)) # load_config normalizes in place
+    calc = DDCalc(data, objective_config=objective, profiles=False)
+    calc.prepare(timelimit=timelimit, **options)
+    return calc
+
+
+def solve_subproblem(task):
+    """
+    Worker entry point: builds one scenario's model and solves it with the
+    task's first-stage terms. With 'fixed' ({name: value}) the first-stage
+    decisions are pinned; with 'target' ({name: value}) they cost their
+    'prices' ({name: multiplier}) and the proximal term of 'rho' on their
+    distance from the target (see _solve_decomposed).
+
+    Returns:
+        dict: 'status', and when a plan was found 'objective' (the
+              scenario's own objective, without the penalties),
+              'first_stage' ({name: value}) and, with 'keep_results', the
+              plan as from get_results() under 'results'.
+    """
+    with request_context(task.get('request_id')):
+        calc = _prepare(task['config'], task['objective'], task['options'], task.get('timelimit'))
+        first = first_stage_variables(calc.prob, calc.data, task['years'])
+        objective = calc.objectives[0]
+        if task.get('fixed'):
+            for name, v in first.items():
+                v.lowBound = v.upBound = task['fixed'][name]
+        elif task.get('target'):
+            terms = [task['prices'].get(name, 0) * v
+                     + _proximal_term(calc.prob, name, v, task['target'][name], task['rho'])
+                     for name, v in first.items()]
+            calc.objectives = [objective - pulp.lpSum(terms)]
+        calc.solve_prepared()
+        item = {'status': calc.status}
+        if calc.status == "Optimal":
+            item['objective'] = pulp.value(objective)
+            item['first_stage'] = {name: v.varValue or 0 for name, v in first.items()}
+            if task.get('keep_results'):
+                item['results'] = calc.get_results()
+        calc.release()
+        return item
+
+
+def _proximal_term(prob, name, v, target, rho):
+    """
+    Adds the split of v - target into pieces between PROXIMAL_BREAKS on
+    either side, and returns their cost: the secants of (rho / 2) * d ** 2,
+    and its slope at the last break beyond it. The slopes increase, so the
+    pieces fill from the target out.
+    """
+    above, below, cost = [], [], []
+    for k, (low, high) in enumerate(zip(PROXIMAL_BREAKS, PROXIMAL_BREAKS[1:] + [None])):
+        width = high - low if high is not None else None
+        slope = rho * (low + high) / 2 if high is not None else rho * low
+        above.append(pulp.LpVariable(f"Consensus_Above_{name}_{k}", lowBound=0, upBound=width))
+        below.append(pulp.LpVariable(f"Consensus_Below_{name}_{k}", lowBound=0, upBound=width))
+        cost.append(slope * (above[-1] + below[-1]))
+    prob.addConstraint(v - target == pulp.lpSum(above) - pulp.lpSum(below), f"Consensus_Deviation_{name}")
+    return pulp.lpSum(cost)
+
+
+def _weights(scenarios):
+    weights = [float(s.get('weight', 1)) for s in scenarios]
+    if any(w < 0 for w in weights) or not sum(weights):
+        raise ValueError("Scenario weights must be non-negative and not all zero")
+    return [w / sum(weights) for w in weights]
+
+
+def _solve_decomposed(tasks, weights, iterations, executor):
+    """
+    Consensus decomposition by progressive hedging: every iteration solves
+    the scenario subproblems in parallel and the master averages their
+    first-stage decisions (by scenario weight) into the consensus. Each
+    scenario's multipliers (prices on its first-stage decisions) then move
+    by rho times its distance from the consensus, so a scenario that wants
+    more of a decision than the others pays for it, and the next iteration
+    adds the proximal term on that distance, until all scenarios agree
+    within CONSENSUS_TOLERANCE dollars or the iteration limit is reached.
+    The weighted multipliers sum to zero, so at agreement the scenarios'
+    plans are those of the combined problem of the 'expected' measure
+    (the only one solved this way). The integer tax and ACA choices make
+    this a heuristic; the plan returned is always implementable, as every
+    scenario is finally solved with the consensus pinned.
+
+    Returns:
+        tuple: (consensus {name: value} or None, iterations run, converged)
+    """
+    target, rho = None, CONSENSUS_RHO
+    prices = [{} for _ in tasks]
+    for iteration in range(1, iterations + 1):
+        items = list(executor.map(solve_subproblem, [dict(task, target=target, prices=price, rho=rho)
+                                                     for task, price in zip(tasks, prices)]))
+        failed = [s for s, item in enumerate(items) if item['status'] != "Optimal"]
+        if failed:
+            logger.warning("Scenario %d found no plan (%s)", failed[0], items[failed[0]]['status'])
+            return None, iteration, False
+        names = items[0]['first_stage']
+        target = {name: sum(w * item['first_stage'][name] for w, item in zip(weights, items)) for name in names}
+        spread = max((abs(item['first_stage'][name] - target[name]) for item in items for name in names), default=0)
+        logger.info("Iteration %d: first-stage decisions differ by up to %.0f", iteration, spread)
+        if spread <= CONSENSUS_TOLERANCE:
+            return target, iteration, True
+        for price, item in zip(prices, items):
+            for name in names:
+                price[name] = price.get(name, 0) + rho * (item['first_stage'][name] - target[name])
+        rho *= CONSENSUS_RHO_GROWTH
+    return target, iterations, False
+
+
+def _solve_monolithic(tasks, weights, measure):
+    """
+    Solves all scenarios in one model (every scenario's variables and
+    constraints, prefixed S<i>_, with its first-stage decisions equal to
+    scenario 0's). Exact but grows with the number of scenarios; meant for
+    small cases and for checking the decomposition.
+
+    Returns:
+        dict or None: The shared first-stage decisions {name: value}, or
+            None if the model has no plan.
+    """
+    prob = pulp.LpProblem("RobustPlan", pulp.LpMaximize)
+    objectives = []
+    shared = None
+    for s, task in enumerate(tasks):
+        calc = _prepare(task['config'], task['objective'], task['options'], task.get('timelimit'))
+        first = first_stage_variables(calc.prob, calc.data, task['years'])
+        for v in calc.prob.variables():
+            v.name = f"S{s}_{v.name}"
+        for name, constraint in calc.prob.constraints.items():
+            prob.addConstraint(constraint, f"S{s}_{name}")
+        if shared is None:
+            shared, solver = first, calc.solver
+        else:
+            for name, v in first.items():
+                prob += v == shared[name], f"Nonanticipative_{s}_{name}"
+        objectives.append(calc.objectives[0])
+    if measure == 'worst':
+        worst = pulp.LpVariable("Worst_Objective")
+        for s, objective in enumerate(objectives):
+            prob += worst <= objective, f"Worst_Objective_{s}"
+        prob.setObjective(worst)
+    else:
+        prob.setObjective(pulp.lpSum(w * objective for w, objective in zip(weights, objectives)))
+
+    with tempfile.TemporaryDirectory(prefix="ddcalc-") as workdir:
+        solver.tmpDir = workdir
+        prob.solve(solver)
+    if prob.status != pulp.LpStatusOptimal:
+        logger.warning("The scenarios have no common plan (%s)", pulp.LpStatus[prob.status])
+        return None
+    return {name: v.varValue or 0 for name, v in shared.items()}
+
+
+def solve_robust(config, scenarios, measure='expected', first_stage_years=1, method=None,
+                 timelimit=None, iterations=CONSENSUS_ITERATIONS, executor=None, request_id=None):
+    """
+    Finds one plan for several return/inflation scenarios: the withdrawals
+    and conversions of the first `first_stage_years` years are shared, as
+    they have to be decided before knowing which scenario comes true, and
+    the later years adapt to each scenario. The shared decisions maximize
+    the weighted mean ('expected') or the lowest ('worst') of the
+    scenarios' objectives (the spending floor by default).
+
+    Args:
+        config (dict): The plan's config, with solver options under 'arguments'.
+        scenarios (list): Partial configs merged into config (see
+            scenario_config), each with an optional 'weight' (default 1)
+            and 'name'.
+        measure (str): 'expected' or 'worst'.
+        first_stage_years (int): Years whose decisions are shared.
+        method (str, optional): 'decomposed' (scenario subproblems solved
+            in parallel and coordinated by a master, see _solve_decomposed)
+            or 'monolithic' (one model of all scenarios, see
+            _solve_monolithic). The default is 'decomposed' for the
+            'expected' measure and 'monolithic' for 'worst', which the
+            decomposition does not solve.
+        timelimit (float, optional): Seconds per solve.
+        iterations (int): Most iterations of the decomposition.
+        executor (Executor, optional): Process pool for the subproblems. A
+            pool from batch.make_executor() is created (and shut down) if
+            not given.
+        request_id (str, optional): Tag for the log records of the solves.
+
+    Returns:
+        dict: 'status'; 'objective' (the measure's value), 'expected_objective',
+              'worst_objective' and 'first_stage' (the shared decisions
+              by year, in that year's dollars) when a plan was found;
+              'scenarios' (per scenario: 'name', 'weight', 'status',
+              'objective', 'spending_floor' and its plan under 'plan');
+              'method', 'measure', 'first_stage_years', 'iterations',
+              'converged' and 'seconds'.
+
+    Raises:
+        ValueError: For an unknown measure or method, the 'worst' measure
+            with the 'decomposed' method, no scenarios, bad weights, or
+            scenarios whose plans differ in shape.
+    """
+    if measure not in ROBUST_MEASURES:
+        raise ValueError(f"Unknown robust measure '{measure}' (use {', '.join(ROBUST_MEASURES)})")
+    if method is None:
+        method = 'monolithic' if measure == 'worst' else 'decomposed'
+    if method not in ROBUST_METHODS:
+        raise ValueError(f"Unknown robust method '{method}' (use {', '.join(ROBUST_METHODS)})")
+    if measure == 'worst' and method == 'decomposed':
+        # Averaged consensus cannot find the max-min plan; it settles on
+        # shared decisions up to ~1% worse
+        raise ValueError("The 'worst' measure needs the monolithic method")
+    if not scenarios:
+        raise ValueError("A robust plan needs at least one scenario")
+    weights = _weights(scenarios)
+    objective_cfg, options = solve_options(config)
+    options = {k: options[k] for k in MODEL_OPTIONS}
+    configs = [scenario_config(config, s) for s in scenarios]
+    for c in configs[1:]:
+        if c['startage'] != configs[0]['startage'] or c.get('endage') != configs[0].get('endage'):
+            raise ValueError("All scenarios must cover the same years")
+    tasks = [{'config': c, 'objective': objective_cfg, 'options': options, 'years': first_stage_years,
+              'timelimit': timelimit, 'request_id': request_id} for c in configs]
+
+    start = time.perf_counter()
+    summary = {'method': method, 'measure': measure, 'first_stage_years': first_stage_years}
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor(min(len(tasks), default_workers()))
+    try:
+        if method == 'monolithic':
+            consensus = _solve_monolithic(tasks, weights, measure)
+            summary.update(iterations=0, converged=consensus is not None)
+        else:
+            consensus, iteration, converged = _solve_decomposed(tasks, weights, iterations, executor)
+            summary.update(iterations=iteration, converged=converged)
+        # Every scenario's own plan with the shared decisions pinned
+        items = []
+        if consensus is not None:
+            items = list(executor.map(solve_subproblem, [dict(task, fixed=consensus, keep_results=True)
+                                                         for task in tasks]))
+    finally:
+        if own_executor:
+            executor.shutdown()
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return _summarize(summary, scenarios, weights, items)
+
+
+def _summarize(summary, scenarios, weights, items):
+    solved = len(items) == len(scenarios) and all(item['status'] == "Optimal" for item in items)
+    summary['status'] = "Optimal" if solved else next((item['status'] for item in items
+                                                       if item['status'] != "Optimal"), "Not Solved")
+    summary['scenarios'] = []
+    for i, (scenario, weight) in enumerate(zip(scenarios, weights)):
+        item = items[i] if i < len(items) else {'status': "Not Solved"}
+        plan = item.get('results')
+        summary['scenarios'].append({
+            'name': scenario.get('name', f"scenario {i}"),
+            'weight': weight,
+            'status': item['status'],
+            'objective': item.get('objective'),
+            'spending_floor': plan['spending_floor'] if plan else None,
+            'plan': plan,
+        })
+    if solved:
+        objectives = [item['objective'] for item in items]
+        summary['expected_objective'] = sum(w * f for w, f in zip(weights, objectives))
+        summary['worst_objective'] = min(objectives)
+        summary['objective'] = summary[f"{summary['measure']}_objective"]
+        summary['first_stage'] = {}
+        for name, value in sorted(items[0]['first_stage'].items()):
+            prefix, period = name.rsplit('_', 1) # the near-term periods are single years
+            summary['first_stage'].setdefault(int(period), {})[prefix] = round(value)
+    return summary
+
+
+def print_robust(summary, data):
+    """Prints the scenarios' objectives, the shared decisions and the plan of the worst scenario."""
+    print(f"Robust plan ({summary['measure']}, {summary['method']}): {summary['status']}")
+    if summary['method'] == 'decomposed':
+        print(f"Decomposition: {summary['iterations']} iterations, "
+              f"{'converged' if summary['converged'] else 'not converged'}")
+    print()
+    print(f"{'scenario':20} {'weight':>6} {'floor':>8} {'objective':>12}")
+    for s in summary['scenarios']:
+        floor = "-" if s['spending_floor'] is None else f"{s['spending_floor']:8.0f}"
+        objective = "-" if s['objective'] is None else f"{s['objective']:12.0f}"
+        print(f"{s['name']:20.20} {s['weight']:6.2f} {floor:>8} {objective:>12}")
+    if summary['status'] != "Optimal":
+        return
+    print(f"Expected objective {summary['expected_objective']:.0f}, worst {summary['worst_objective']:.0f}")
+    print()
+    print("Shared decisions:")
+    for y, decisions in summary['first_stage'].items():
+        print(f" {data.startage + y:3d}: " + ", ".join(f"{k} {v:.0f}" for k, v in decisions.items()))
+    worst = min(summary['scenarios'], key=lambda s: s['objective'])
+    print(f"\nPlan in the worst scenario ({worst['name']}):")
+    print_ascii(worst['plan'], data)
@@ -1,13 +1,221 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS # Import CORS
-import traceback
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 
+from ddcalc.core.checkpoint import CHECKPOINT_ENV, DEFAULT_INTERVAL, read_checkpoint
 from ddcalc.core.data_loader import Data
-from ddcalc.ddcalc import DDCalc
+from ddcalc.corpus import instance_id
+from ddcalc.batch import (expand_batch, run_batch, solve_item, estimate_plan, default_workers, make_executor,
+                          failed_item)
+from ddcalc.replan import run_replans
+from ddcalc.utils.metrics import MetricsAggregator, memory_gauges
+from ddcalc.utils.logcontext import configure_logging, request_id_var
+from ddcalc.utils.scheduler import configure_scheduler, get_scheduler, parse_policy
+from ddcalc.utils.profiler import Sampler
+from ddcalc.capture import CaptureWriter, sanitize
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes and origins by default
 
+# Process-wide rollup of per-request metrics, served by /metrics
+metrics = MetricsAggregator()
+
+# Set by --capture to record sanitized requests for later replay
+capture = None
+
+# Set by --export-dir to write the models of slow solves to a corpus ({'dir', 'min_seconds'})
+export = None
+
+# Set by --checkpoint-dir to checkpoint long solves and resume them ({'dir', 'interval'})
+checkpoints = None
+
+# Set by --profile-dir to profile sampled and slow /calculate requests
+# ({'sampler', 'dir', 'rate', 'threshold'})
+profiling = None
+
+class Overloaded(Exception):
+    pass
+
+class Admission:
+    """
+    Bounded admission for solves: at most `workers` run at once and at most
+    `queue_size` more wait for a slot. Anything beyond that is rejected so
+    the server sheds load (503) instead of queueing without limit. A request
+    that solves several plans at once takes a slot for each; slots are
+    granted in arrival order, so a large request is not starved by small ones.
+    """
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self._turns = deque()
+        self._changed = threading.Condition()
+
+    @contextmanager
+    def admit(self, count=1):
+        """Takes `count` slots (at most `workers`) for the block; yields the number taken."""
+        count = min(max(1, count), self.workers)
+        with self._changed:
+            if self.active + self.waiting + count > self.workers + self.queue_size:
+                raise Overloaded()
+            turn = object()
+            self._turns.append(turn)
+            self.waiting += count
+            while self._turns[0] is not turn or self.active + count > self.workers:
+                self._changed.wait()
+            self._turns.popleft()
+            self.waiting -= count
+            self.active += count
+            self._changed.notify_all()
+        try:
+            yield count
+        finally:
+            with self._changed:
+                self.active -= count
+                self._changed.notify_all()
+
+    def full(self):
+        with self._changed:
+            return self.active + self.waiting >= self.workers + self.queue_size
+
+    def snapshot(self):
+        with self._changed:
+            return {'workers': self.workers, 'queue_size': self.queue_size,
+                    'active': self.active, 'waiting': self.waiting}
+
+# Execution settings, replaced by main() from the command line
+worker_model = 'thread'    # 'thread': solve in the request thread; 'process': solve in the worker pool
+admission = Admission(default_workers(), 2 * default_workers())
+solver_threads = 'auto'    # ThreadScheduler policy for solver threads
+
+# Worker pool for /calculate_batch (and /calculate in the process model), created on first use
+executor = None
+executor_lock = threading.Lock()
+
+def get_executor():
+    """The worker pool, started on first use and again after a worker died and broke it."""
+    global executor
+    with executor_lock:
+        if executor is not None and executor._broken:
+            logger.error("Worker pool broke, starting a new one")
+            executor.shutdown(wait=False)
+            executor = None
+        if executor is None:
+            executor = make_executor(admission.workers, solver_threads)
+    return executor
+
+def replace_executor(broken):
+    """
+    Swaps the worker pool for a new one after a worker died and broke it
+    (BrokenProcessPool), unless another request already has. Returns the
+    pool to use.
+    """
+    global executor
+    with executor_lock:
+        if executor is broken:
+            logger.error("Worker pool broke, starting a new one")
+            broken.shutdown(wait=False)
+            executor = None
+    return get_executor()
+
+@contextmanager
+def pool_slots(count=1):
+    """
+    Admits `count` solves that run on the worker pool and counts them among
+    this process's running solves, so solves in request threads leave the
+    pool workers their CPUs. Yields the number of slots taken.
+    """
+    with admission.admit(count) as taken, get_scheduler().reserve(taken):
+        yield taken
+
+class BinaryCache:
+    """
+    Small LRU of solution binaries by client and plan shape, filled by exact
+    solves and used to sharpen /estimate answers. The binaries are a
+    plan's yes/no choices, so they are only reused for the client whose
+    plan they came from (see client_key).
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        return None
+
+    def put(self, key, binaries):
+        with self._lock:
+            self._items[key] = binaries
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+binary_cache = BinaryCache()
+
+def plan_shape(config_data):
+    """
+    Key for plans whose models have the same variables: the horizon, filing
+    status and state. Slider-type inputs (spending, balances, premiums) are
+    deliberately left out.
+    """
+    taxes = config_data.get('taxes', {})
+    return (config_data.get('startage'), config_data.get('endage'), config_data.get('birthmonth', 1),
+            taxes.get('filing_status', 'MFJ'), str(taxes.get('state', '')).upper(),
+            json.dumps(config_data.get('arguments', {}), sort_keys=True))
+
+def client_key():
+    """
+    Who a request is from, for the per-client caches: a hash of its
+    Authorization header, or its remote address when it has none.
+    """
+    auth = request.headers.get('Authorization')
+    if auth:
+        return 'auth:' + hashlib.sha256(auth.encode('utf-8')).hexdigest()[:16]
+    return 'addr:' + str(request.remote_addr)
+
+def overloaded_response():
+    response = jsonify({"error": "Server is at capacity, retry later"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.before_request
+def set_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12]
+    g.request_id_token = request_id_var.set(g.request_id)
+
+@app.after_request
+def add_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    if 'plan_id' in g:
+        response.headers['X-Plan-ID'] = g.plan_id
+    return response
+
+@app.teardown_request
+def reset_request_id(exc):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
 @app.route('/calculate', methods=['POST'])
 def calculate_plan():
     """
@@ -17,36 +225,300 @@ def calculate_plan():
         return jsonify({"error": "Request must be JSON"}), 400
 
     config_data = request.get_json()
+    if not isinstance(config_data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    if checkpoints is not None:
+        g.plan_id = instance_id(config_data) # for GET /checkpoint/<plan id> while this runs
+
+    start = time.perf_counter()
+    # Copy before load_config, which normalizes some values in place
+    captured = sanitize(config_data) if capture is not None else None
+    data = Data()
+    try:
+        with admission.admit(), request_profile(data):
+            response = _calculate(config_data, data)
+    except Overloaded:
+        return overloaded_response()
+    if capture is not None:
+        capture.write('/calculate', captured, time.perf_counter() - start,
+                      response[1] if isinstance(response, tuple) else 200, data.metrics.solves)
+    return response
+
+@contextmanager
+def request_profile(data):
+    """
+    Samples the stacks of the request's thread while profiling is on, and
+    keeps the profile when the request was picked at random (--profile-rate)
+    or took at least --profile-threshold seconds: <request id>.collapsed
+    (collapsed stacks) and <request id>.json (Python and solver seconds and
+    the stage timers) in the profile directory.
+    """
+    if profiling is None:
+        yield
+        return
+    start = time.perf_counter()
+    with profiling['sampler'].profile() as profile:
+        yield
+    seconds = time.perf_counter() - start
+    sampled = random.random() < profiling['rate']
+    if not sampled and seconds < profiling['threshold']:
+        return
+    try:
+        path = os.path.join(profiling['dir'], re.sub(r'[^A-Za-z0-9_-]', '_', g.request_id)) # the id may come from the client
+        profile.write(path + '.collapsed')
+        with open(path + '.json', 'w') as f:
+            json.dump(dict(profile.summary(), request_id=g.request_id, seconds=round(seconds, 3),
+                           reason='sampled' if sampled else 'slow', timers=data.metrics.timers), f, indent=2)
+    except OSError:
+        logger.exception("Writing the profile failed")
 
+def _calculate(config_data, data):
+    """Loads, solves and extracts one plan; returns a Flask response."""
+    if worker_model == 'process':
+        pool = get_executor()
+        try:
+            with get_scheduler().reserve():
+                item = pool.submit(solve_item, config_data, g.request_id, True, export, checkpoints).result()
+        except BrokenProcessPool as e:
+            replace_executor(pool)
+            item = failed_item(e)
+    else:
+        item = solve_item(config_data, g.request_id, True, export, checkpoints)
+    data.metrics.load(item['metrics'])
+    metrics.observe(item['metrics'], failed='result' not in item)
+    if item.get('binaries'):
+        binary_cache.put((client_key(), plan_shape(config_data)), item['binaries'])
+    if 'result' not in item:
+        return jsonify({"error": item['error']}), 500
+    return jsonify(item['result'])
+
+@app.route('/checkpoint', methods=['POST'])
+@app.route('/checkpoint/<plan_id>', methods=['GET'])
+def get_checkpoint(plan_id=None):
+    """
+    Reports on a long solve that is still running, was interrupted or has
+    finished. POST with the plan's config returns its last checkpointed
+    plan, marked with "checkpoint": {plan_id, objective, bound, seconds,
+    complete, updated}. GET by the plan id /calculate returns in X-Plan-ID
+    returns only {"checkpoint": {...}}: the id alone does not show the
+    caller owns the plan, so its contents are not served for it.
+    """
+    if checkpoints is None:
+        return jsonify({"error": "Checkpoints are not enabled (--checkpoint-dir)"}), 404
+    with_plan = plan_id is None
+    if with_plan:
+        if not request.is_json:
+            return jsonify({"error": "Request must be JSON"}), 400
+        config_data = request.get_json()
+        if not isinstance(config_data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        plan_id = instance_id(config_data)
+    elif not re.fullmatch(r'[0-9a-f]{16}', plan_id):
+        return jsonify({"error": "Invalid plan id"}), 400
+    state = read_checkpoint(checkpoints['dir'], plan_id)
+    if state is None:
+        return jsonify({"error": "No checkpoint for this plan"}), 404
+    info = {k: state.get(k) for k in ('plan_id', 'objective', 'bound', 'seconds', 'complete', 'updated')}
+    if not with_plan:
+        return jsonify({'checkpoint': info})
+    return jsonify(dict(state['results'], checkpoint=info))
+
+@app.route('/estimate', methods=['POST'])
+def estimate_plan_route():
+    """
+    Returns a fast approximate plan from the LP relaxation of the model,
+    marked with "estimate": true. Binaries from the same client's last
+    exact /calculate of a plan with the same shape are reused when
+    available. Estimates go through the same admission guard as /calculate.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    config_data = request.get_json()
+    if not isinstance(config_data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    data = Data()
     try:
-        data = Data()
-        data.load_config(config_data) # Use the modified load_config method
-
-        # Extract arguments from the payload
-        args_data = config_data.get('arguments', {})
-        objective_cfg = args_data.get('objective', {'type': 'max_spend'}) # Default if not provided
-        pessimistic_taxes_val = args_data.get('pessimistic_taxes', False)
-        pessimistic_healthcare_val = args_data.get('pessimistic_healthcare', False)
-        allow_conversions_val = args_data.get('allow_conversions', True)
-        no_conversions_val = args_data.get('no_conversions', False)
-        no_conversions_after_socsec_val = args_data.get('no_conversions_after_socsec', False)
-
-        ddcalc = DDCalc(data, objective_config=objective_cfg)
-        ddcalc.solve(pessimistic_taxes=pessimistic_taxes_val, 
-                    pessimistic_healthcare=pessimistic_healthcare_val,
-                    allow_conversions=allow_conversions_val,
-                    no_conversions=no_conversions_val,
-                    no_conversions_after_socsec=no_conversions_after_socsec_val)
-        results = ddcalc.get_results() # Assuming get_results() returns serializable data
-#        print(jsonify(results))
+        with admission.admit():
+            results = estimate_plan(config_data, data, g.request_id,
+                                    binaries=binary_cache.get((client_key(), plan_shape(config_data))))
         return jsonify(results)
+    except Overloaded:
+        return overloaded_response()
     except Exception as e:
-        traceback.print_exc() # Print detailed error to server console
-        return jsonify({"error": f"Calculation failed: {str(e)}"}), 500
+        logger.exception("Estimate failed")
+        return jsonify({"error": f"Estimate failed: {str(e)}"}), 500
+
+@app.route('/calculate_batch', methods=['POST'])
+def calculate_batch():
+    """
+    Calculates several plans in one request. The body is a list of configs,
+    {"configs": [...]} or {"base": {...}, "overrides": [...]}. Returns
+    {"results": [...]} in request order, each item holding "result",
+    "error", or both (a null result when no plan was found).
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    try:
+        configs = expand_batch(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    captured = [sanitize(c) for c in configs] if capture is not None else None
+
+    try:
+        with pool_slots(len(configs)) as taken:
+            items = run_batch(configs, executor=get_executor(), request_id=g.request_id, export=export,
+                              checkpoints=checkpoints, new_executor=replace_executor, concurrency=taken)
+    except Overloaded:
+        return overloaded_response()
+    seen = set()
+    for i, item in enumerate(items):
+        if id(item) in seen:
+            continue  # duplicate config, solved once
+        seen.add(id(item))
+        metrics.observe(item['metrics'], failed='result' not in item)
+        if capture is not None:
+            capture.write('/calculate', captured[i], sum(item['metrics']['timers'].values()),
+                          200 if 'result' in item else 500, item['metrics']['solves'])
+    return jsonify({"results": [{k: v for k, v in item.items() if k != 'metrics'} for item in items]})
+
+@app.route('/replan', methods=['POST'])
+def replan_route():
+    """
+    Re-plans one or more clients a year on, each starting from last year's
+    plan. The body is {"config", "previous", "update"} (last year's config
+    and /calculate result, and what changed), or a list of them, which is
+    re-planned in parallel. Returns the item's "result", "config" (the new
+    config, to send next year) or "error", or {"results": [...]} for a list.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    payload = request.get_json()
+    payloads = payload if isinstance(payload, list) else [payload]
+    if not all(isinstance(p, dict) and isinstance(p.get('config'), dict) and isinstance(p.get('previous'), dict)
+               for p in payloads):
+        return jsonify({"error": "Every item needs 'config' and 'previous' objects"}), 400
+
+    try:
+        with pool_slots(len(payloads)) as taken:
+            items = run_replans(payloads, get_executor(), g.request_id, concurrency=taken)
+    except Overloaded:
+        return overloaded_response()
+    for item in items:
+        metrics.observe(item['metrics'], failed='result' not in item)
+    items = [{k: v for k, v in item.items() if k != 'metrics'} for item in items]
+    if isinstance(payload, list):
+        return jsonify({"results": items})
+    if 'result' not in items[0]:
+        return jsonify({"error": items[0]['error']}), 500
+    return jsonify(items[0])
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns aggregated stage timings, model sizes and solver statistics,
+    and the server process's current and peak memory.
+    """
+    return jsonify(dict(metrics.snapshot(), admission=admission.snapshot(), memory=memory_gauges()))
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 while new solves can be admitted, 503 when the queue is full."""
+    state = admission.snapshot()
+    if admission.full():
+        return jsonify(dict(state, status="busy")), 503
+    return jsonify(dict(state, status="ready"))
+
+def serve(host, port, threads):
+    """
+    Serves the app with waitress if it is installed, otherwise with the
+    threaded Werkzeug server. Admission control bounds the solves either way.
+    """
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        from werkzeug.serving import run_simple
+        logger.info("waitress not installed; using the threaded Werkzeug server")
+        run_simple(host, port, app, threaded=True)
+    else:
+        waitress_serve(app, host=host, port=port, threads=threads)
 
 def main():
     """Entry point for running the Flask server."""
-    app.run(debug=True, host='0.0.0.0', port=5001) # Example run command, adjust as needed
+    parser = argparse.ArgumentParser(description="DrawdownCalc HTTP server")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=5001, help="Port to listen on")
+    parser.add_argument('--log-level', default=os.environ.get('DDCALC_LOG_LEVEL', 'WARNING'),
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Logging level (default from DDCALC_LOG_LEVEL, else WARNING)")
+    parser.add_argument('--capture', default=os.environ.get('DDCALC_CAPTURE'),
+                        help="Append sanitized requests, response times and solver stats to this file "
+                             "(.gz for compressed) for replay with ddcalc-replay")
+    parser.add_argument('--export-dir', default=os.environ.get('DDCALC_EXPORT_DIR'),
+                        help="Write the model, config, settings and statistics of each solve to this corpus directory")
+    parser.add_argument('--export-min-seconds', type=float, default=0,
+                        help="Only export solves that took at least this many seconds")
+    parser.add_argument('--checkpoint-dir', default=os.environ.get(CHECKPOINT_ENV),
+                        help="Save the best plan so far of long solves here, resume them after a restart "
+                             "and serve them at /checkpoint")
+    parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_INTERVAL,
+                        help="Seconds of solving between checkpoints; shorter solves are not checkpointed")
+    parser.add_argument('--profile-dir', default=os.environ.get('DDCALC_PROFILE_DIR'),
+                        help="Write stack profiles (collapsed stacks, Python and solver time) of sampled and slow "
+                             "/calculate requests to this directory")
+    parser.add_argument('--profile-rate', type=float, default=0.01,
+                        help="Fraction of requests to profile at random (default 0.01)")
+    parser.add_argument('--profile-threshold', type=float, default=30,
+                        help="Always keep the profile of requests taking at least this many seconds (default 30)")
+    parser.add_argument('--profile-interval', type=float, default=0.01,
+                        help="Seconds between stack samples (default 0.01)")
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help="Solves running at once, and size of the worker process pool (default: number of CPUs)")
+    parser.add_argument('--worker-model', choices=['thread', 'process'], default='thread',
+                        help="Run /calculate solves in the request thread or in the worker process pool "
+                             "(batch items always use the pool)")
+    parser.add_argument('--queue-size', type=int,
+                        help="Requests allowed to wait for a worker before returning 503 (default: 2 x workers)")
+    parser.add_argument('--threads', type=int,
+                        help="HTTP handler threads when served by waitress (default: workers + queue size)")
+    parser.add_argument('--solver-threads', type=parse_policy, default='auto',
+                        help="CBC threads per solve: auto (share the CPUs between running solves), "
+                             "single, all, or a fixed number")
+    parser.add_argument('--debug', action='store_true',
+                        help="Run the Flask development server with the debugger and reloader")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    global capture, export, checkpoints, profiling, admission, worker_model, solver_threads
+    if args.capture:
+        capture = CaptureWriter(args.capture)
+    if args.export_dir:
+        export = {'dir': args.export_dir, 'min_seconds': args.export_min_seconds}
+    if args.checkpoint_dir:
+        checkpoints = {'dir': args.checkpoint_dir, 'interval': args.checkpoint_interval}
+    if args.profile_dir:
+        os.makedirs(args.profile_dir, exist_ok=True)
+        profiling = {'sampler': Sampler(args.profile_interval).start(), 'dir': args.profile_dir,
+                     'rate': args.profile_rate, 'threshold': args.profile_threshold}
+        if args.worker_model == 'process':
+            logger.warning("With --worker-model process the profiles only show the request thread waiting for the solve")
+    queue_size = args.queue_size if args.queue_size is not None else 2 * args.workers
+    admission = Admission(args.workers, queue_size)
+    worker_model = args.worker_model
+    solver_threads = args.solver_threads
+    configure_scheduler(solver_threads)
+
+    if args.debug:
+        app.run(debug=True, host=args.host, port=args.port)
+    else:
+        serve(args.host, args.port, args.threads or args.workers + queue_size)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
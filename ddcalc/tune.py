@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import argparse
+import copy
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+import pulp
+
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+from ddcalc.batch import solve_options
+from ddcalc.capture import read_capture
+from ddcalc.core.data_loader import Data
+from ddcalc.core.profiles import default_profiles_path, shape_class
+from ddcalc.ddcalc import DDCalc
+
+logger = logging.getLogger(__name__)
+
+# Parameters searched, one at a time from the current best (coordinate
+# search), each with the values tried. BASELINE is the untuned setup. Only
+# solver settings are searched: the multi-resolution horizon and the fast
+# mode change the plan, which a profile must never do behind the caller's
+# back.
+SEARCH_SPACE = [
+    ('presolve', [False, True]),
+    ('gapRel', [None, 0.0001, 0.001]),
+    ('seed', [None, 1, 2]),
+]
+BASELINE = {'presolve': False, 'gapRel': None, 'seed': None}
+
+# Smallest relative saving in total time for a setting to replace the
+# current best, so settings aren't picked on timing noise
+MIN_SPEEDUP = 0.05
+
+# States used for generated plans, from no income tax to many brackets
+VARIANT_STATES = ['TX', 'FL', 'PA', 'IL', 'NC', 'DC', 'NY', 'CA']
+
+
+def load_corpus(paths):
+    """
+    Reads plans from TOML/JSON configs, ddcalc-server capture files
+    (.jsonl, .jsonl.gz) and directories of them.
+
+    Returns:
+        list: (name, config dict) pairs.
+    """
+    corpus = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path))
+        else:
+            files = [path]
+        for f in files:
+            name = os.path.basename(f)
+            if f.endswith('.toml'):
+                with open(f, 'rb') as fh:
+                    corpus.append((name, tomllib.load(fh)))
+            elif f.endswith('.json'):
+                with open(f) as fh:
+                    corpus.append((name, json.load(fh)))
+            elif f.endswith('.jsonl') or f.endswith('.jsonl.gz'):
+                for i, record in enumerate(read_capture(f)):
+                    corpus.append((f"{name}#{i}", record['config']))
+    return corpus
+
+
+def generate_variants(corpus, count, seed=0):
+    """
+    Derives count plans of varied shape from the corpus: different start and
+    end ages, states and, for about half of them, ACA premiums.
+    """
+    rng = random.Random(seed)
+    variants = []
+    for i in range(count):
+        name, base = rng.choice(corpus)
+        config = copy.deepcopy(base)
+        config['startage'] = min(75, max(30, base['startage'] + rng.choice([-15, -10, -5, 0, 5])))
+        config['endage'] = max(config['startage'] + 10, rng.choice([90, 95, 100]))
+        taxes = config.setdefault('taxes', {})
+        taxes['state'] = rng.choice(VARIANT_STATES)
+        taxes.pop('state_rate', None)
+        if rng.random() < 0.5:
+            premium = rng.randrange(600, 1800, 50)
+            config['aca'] = {'premium': premium, 'slcsp': round(premium * 0.85), 'covered': 1}
+        else:
+            config.pop('aca', None)
+        variants.append((f"{name}~{i}", config))
+    return variants
+
+
+def run_once(config, settings, timelimit=None):
+    """
+    Solves one plan with the given solver settings (tuned profiles
+    disabled), on the annual horizon in exact mode.
+
+    Returns:
+        tuple: (seconds, objective value or None if no optimal plan was found)
+    """
+    data = Data()
+    data.load_config(config)
+    objective_cfg, options = solve_options(config)
+    options.update(horizon='annual', mode='exact')
+    calc = DDCalc(data, objective_config=objective_cfg, profiles=False)
+    start = time.perf_counter()
+    calc.solve(timelimit=timelimit, solver_settings=dict(settings), **options)
+    seconds = time.perf_counter() - start
+    objective = pulp.value(calc.objectives[0]) if calc.status == "Optimal" else None
+    return seconds, objective
+
+
+def measure(plans, settings, repeats=3, timelimit=None):
+    """
+    Median seconds and the objective of every plan with the given settings.
+    A plan that fails to solve is logged and recorded as (None, None).
+    """
+    runs = []
+    for name, config in plans:
+        times = []
+        objective = None
+        try:
+            for _ in range(repeats):
+                seconds, objective = run_once(config, settings, timelimit)
+                times.append(seconds)
+        except Exception:
+            logger.exception("%s failed with %s", name, settings)
+            runs.append((None, None))
+            continue
+        runs.append((statistics.median(times), objective))
+        logger.debug("%s %s: %.2fs objective %s", name, settings, runs[-1][0], objective)
+    return runs
+
+
+def acceptable(runs, baseline, tolerance):
+    """
+    True if every plan's objective is within tolerance (relative) of the
+    baseline's, either way: a setting that overstates the objective is as
+    wrong as one that loses some of it.
+    """
+    for (_, objective), (_, reference) in zip(runs, baseline):
+        if reference is None:
+            continue
+        if objective is None or abs(objective - reference) > tolerance * abs(reference):
+            return False
+    return True
+
+
+def tune_class(plans, repeats=3, timelimit=None, tolerance=0.001):
+    """
+    Coordinate search over SEARCH_SPACE for one shape class: each parameter
+    in turn takes the value with the lowest total median time, among those
+    that keep every plan within tolerance of the baseline objective and
+    save at least MIN_SPEEDUP of the current best time. Plans that fail
+    with the baseline settings are left out.
+
+    Returns:
+        dict: The chosen settings (only those differing from BASELINE), the
+              number of plans, and the baseline and tuned total seconds.
+    """
+    baseline = measure(plans, BASELINE, repeats, timelimit)
+    kept = [i for i, (seconds, _) in enumerate(baseline) if seconds is not None]
+    plans, baseline = [plans[i] for i in kept], [baseline[i] for i in kept]
+    best = dict(BASELINE)
+    best_seconds = baseline_seconds = sum(s for s, _ in baseline)
+    for name, values in SEARCH_SPACE:
+        for value in values:
+            if value == best[name]:
+                continue
+            candidate = dict(best, **{name: value})
+            runs = measure(plans, candidate, repeats, timelimit)
+            ok = acceptable(runs, baseline, tolerance)
+            seconds = sum(s for s, _ in runs if s is not None)
+            logger.info("  %s=%s: %.2fs%s", name, value, seconds, "" if ok else " (different plans, rejected)")
+            if ok and seconds < best_seconds * (1 - MIN_SPEEDUP):
+                best, best_seconds = candidate, seconds
+    return {
+        'settings': {k: v for k, v in best.items() if v != BASELINE[k]},
+        'plans': len(plans),
+        'baseline_seconds': round(baseline_seconds, 3),
+        'tuned_seconds': round(best_seconds, 3),
+    }
+
+
+def classify(corpus):
+    """Groups the plans by shape class, skipping those that fail to load."""
+    classes = {}
+    for name, config in corpus:
+        data = Data()
+        try:
+            data.load_config(config)
+        except Exception as e:
+            logger.warning("Skipping %s: %s", name, e)
+            continue
+        classes.setdefault(shape_class(data), []).append((name, config))
+    return classes
+
+
+def report(profiles):
+    print(f"{'class':32} {'plans':>5} {'baseline':>9} {'tuned':>9} {'speedup':>7}  settings")
+    for name, entry in sorted(profiles['classes'].items()):
+        speedup = entry['baseline_seconds'] / entry['tuned_seconds'] if entry['tuned_seconds'] else 1.0
+        print(f"{name:32} {entry['plans']:5d} {entry['baseline_seconds']:8.2f}s {entry['tuned_seconds']:8.2f}s "
+              f"{speedup:6.2f}x  {json.dumps(entry['settings'])}")
+
+
+def main():
+    default_corpus = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+    parser = argparse.ArgumentParser(description="Tune solver settings per plan shape over a corpus of plans")
+    parser.add_argument('corpus', nargs='*', default=[default_corpus],
+                        help="Configs, capture files or directories of them (default: examples/)")
+    parser.add_argument('--generate', type=int, default=0, help="Also solve N generated variants of the corpus plans")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for --generate")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed runs per plan and setting (the median is used)")
+    parser.add_argument('--timelimit', type=float, default=60, help="Solver time limit per run in seconds")
+    parser.add_argument('--tolerance', type=float, default=0.001,
+                        help="Largest relative change in any plan's objective a tuned setting may cause")
+    parser.add_argument('--output', default=default_profiles_path(),
+                        help="Profiles file to write (default: the one DDCalc loads)")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(levelname)s %(name)s: %(message)s")
+    for name in ('ddcalc.ddcalc', 'ddcalc.core'): # per-solve progress is too chatty here
+        logging.getLogger(name).setLevel(max(logging.WARNING, logging.getLogger().level))
+
+    corpus = load_corpus(args.corpus)
+    if args.generate and corpus:
+        corpus += generate_variants(corpus, args.generate, args.seed)
+    classes = classify(corpus)
+    if not classes:
+        print("No plans to tune on.")
+        sys.exit(1)
+
+    profiles = {
+        'repeats': args.repeats,
+        'timelimit': args.timelimit,
+        'tolerance': args.tolerance,
+        'classes': {},
+    }
+    for name, plans in sorted(classes.items()):
+        logger.info("Tuning %s (%d plans)", name, len(plans))
+        profiles['classes'][name] = tune_class(plans, args.repeats, args.timelimit, args.tolerance)
+
+    with open(args.output, 'w') as f:
+        json.dump(profiles, f, indent=2)
+    report(profiles)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import logging
+import contextvars
+from contextlib import contextmanager
+
+# Identifier of the request being served by the current thread/task.  Every
+# log record carries it as record.request_id ('-' outside of a request).
+request_id_var = contextvars.ContextVar('ddcalc_request_id', default='-')
+
+
+@contextmanager
+def request_context(request_id):
+    """Tags all log records emitted inside the block with request_id."""
+    token = request_id_var.set(request_id or '-')
+    try:
+        yield
+    finally:
+        request_id_var.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request id to each log record."""
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+def configure_logging(level, fmt="%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"):
+    """Sets up root logging with the request id available to the format."""
+    logging.basicConfig(level=level, format=fmt)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
@@ -0,0 +1,183 @@
+import os
+import re
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+# Lines of interest in the CBC log.  The log is only captured when the solver
+# is not already writing to the terminal (i.e. not --verbose).
+CBC_LOG_PATTERNS = {
+    'result': re.compile(r'^Result - (.*)$'),
+    'objective': re.compile(r'^Objective value:\s+(\S+)'),
+    'bound': re.compile(r'^Lower bound:\s+(\S+)'),
+    'gap': re.compile(r'^Gap:\s+(\S+)'),
+    'nodes': re.compile(r'^Enumerated nodes:\s+(\d+)'),
+    'iterations': re.compile(r'^Total iterations:\s+(\d+)'),
+    'solver_seconds': re.compile(r'^Time \(Wallclock seconds\):\s+(\S+)'),
+}
+
+
+class Metrics:
+    """
+    Collects per-stage timings, model size counters and solver statistics
+    for a single run of the pipeline (config load through result extraction).
+    """
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.solves = []
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block and adds it to the named stage timer."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - start
+
+    def record_model(self, prob):
+        """Records the size of the built model (last build wins)."""
+        self.counters.update(model_size(prob))
+
+    def record_profile(self, summary):
+        """Adds the Python and solver subprocess seconds of a sampling profile (see utils.profiler) as timers."""
+        self.timers['profile_python'] = summary['python_seconds']
+        self.timers['profile_solver'] = summary['solver_seconds']
+
+    def record_solve(self, stats):
+        """Appends the statistics of one solver pass."""
+        self.solves.append(stats)
+
+    def load(self, snapshot):
+        """Replaces the contents with an as_dict() snapshot, e.g. from a worker process."""
+        self.timers = dict(snapshot.get('timers', {}))
+        self.counters = dict(snapshot.get('counters', {}))
+        self.solves = list(snapshot.get('solves', []))
+
+    def as_dict(self):
+        return {
+            'timers': {k: round(v, 6) for k, v in self.timers.items()},
+            'counters': dict(self.counters),
+            'solves': list(self.solves),
+        }
+
+
+def model_size(prob):
+    """
+    Returns the size of a PuLP problem: rows, columns, binaries and nonzeros.
+    """
+    variables = prob.variables()
+    binaries = sum(1 for v in variables
+                   if v.cat == 'Integer' and v.lowBound == 0 and v.upBound == 1)
+    return {
+        'rows': len(prob.constraints),
+        'columns': len(variables),
+        'binaries': binaries,
+        'nonzeros': sum(len(c) for c in prob.constraints.values()),
+    }
+
+
+def memory_mb():
+    """
+    Returns (current, peak) resident memory of this process in MB; either
+    is None where the platform doesn't report it. These are process-wide
+    gauges: with solves running in threads they cover every request.
+    """
+    rss = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = round(maxrss / (2**20 if sys.platform == 'darwin' else 2**10), 1) # bytes on macOS, KB elsewhere
+    except (ImportError, OSError):
+        pass
+    return rss, peak
+
+
+def memory_gauges():
+    """The process's memory_mb() as {'rss_mb', 'peak_rss_mb'}, for reports."""
+    rss, peak = memory_mb()
+    return {'rss_mb': rss, 'peak_rss_mb': peak}
+
+
+def parse_cbc_log(text):
+    """
+    Extracts solver statistics (result, objective, bound, gap, nodes,
+    iterations, wallclock seconds) from a CBC log.  Missing values are omitted.
+    """
+    stats = {}
+    for line in text.splitlines():
+        line = line.strip()
+        for key, pattern in CBC_LOG_PATTERNS.items():
+            m = pattern.match(line)
+            if m:
+                value = m.group(1)
+                if key == 'result':
+                    stats[key] = value
+                elif key in ('nodes', 'iterations'):
+                    stats[key] = int(value)
+                else:
+                    try:
+                        stats[key] = float(value)
+                    except ValueError:
+                        pass
+                break
+    return stats
+
+
+class MetricsAggregator:
+    """
+    Thread-safe, process-wide rollup of per-run Metrics, used by the server's
+    /metrics endpoint.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.timers = {}
+        self.counters = {}
+        self.statuses = {}
+        self.solver = {'passes': 0, 'nodes': 0, 'iterations': 0}
+        self.last = None
+
+    def observe(self, metrics, failed=False):
+        """Folds one run's metrics (a Metrics or its as_dict()) into the totals."""
+        if isinstance(metrics, Metrics):
+            metrics = metrics.as_dict()
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.failures += 1
+            for name, seconds in metrics.get('timers', {}).items():
+                t = self.timers.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+                t['count'] += 1
+                t['total'] += seconds
+                t['max'] = max(t['max'], seconds)
+            for name, value in metrics.get('counters', {}).items():
+                c = self.counters.setdefault(name, {'total': 0, 'max': 0})
+                c['total'] += value
+                c['max'] = max(c['max'], value)
+            for solve in metrics.get('solves', []):
+                self.solver['passes'] += 1
+                self.solver['nodes'] += solve.get('nodes', 0)
+                self.solver['iterations'] += solve.get('iterations', 0)
+                status = solve.get('status', 'Unknown')
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.last = metrics
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'timers': {k: dict(v) for k, v in self.timers.items()},
+                'counters': {k: dict(v) for k, v in self.counters.items()},
+                'solver': dict(self.solver, statuses=dict(self.statuses)),
+                'last': self.last,
+            }
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds between stack samples
+DEFAULT_INTERVAL = 0.005
+
+# Root frames of the collapsed stacks: time spent in Python, and time spent
+# waiting for the solver subprocess (a sample whose innermost frame is in
+# the subprocess module).
+PYTHON_ROOT = 'python'
+SOLVER_ROOT = 'solver'
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    """
+    Stack samples of one thread, as collapsed stacks ("root;outer;...;inner
+    count" lines, the input format of flamegraph.pl and speedscope).
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.seconds = {PYTHON_ROOT: 0.0, SOLVER_ROOT: 0.0}
+        self.samples = 0
+
+    def add(self, frame, seconds):
+        """Adds the stack of frame, standing for the given seconds."""
+        labels = []
+        leaf = frame
+        while frame is not None:
+            labels.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        root = SOLVER_ROOT if os.path.basename(leaf.f_code.co_filename) == 'subprocess.py' else PYTHON_ROOT
+        labels.append(root)
+        self.stacks[';'.join(reversed(labels))] += 1
+        self.seconds[root] += seconds
+        self.samples += 1
+
+    def summary(self):
+        return {
+            'samples': self.samples,
+            'python_seconds': round(self.seconds[PYTHON_ROOT], 3),
+            'solver_seconds': round(self.seconds[SOLVER_ROOT], 3),
+        }
+
+    def write(self, path):
+        """Writes the collapsed stacks to path."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Sampler:
+    """
+    Background thread that samples the stacks of the threads being profiled
+    every interval seconds. One sampler serves any number of threads; it
+    idles while none is being profiled.
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ddcalc-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def profile(self):
+        """Profiles the calling thread for the duration of the block; yields its Profile."""
+        ident = threading.get_ident()
+        profile = Profile(self.interval)
+        with self._lock:
+            self._profiles[ident] = profile
+        try:
+            yield profile
+        finally:
+            with self._lock:
+                del self._profiles[ident]
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            with self._lock:
+                if not self._profiles:
+                    continue
+                frames = sys._current_frames()
+                for ident, profile in self._profiles.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.add(frame, elapsed)
@@ -1,5 +1,7 @@
 import pulp
 
+CBC_SOLVERS = ('PULP_CBC_CMD', 'COIN_CMD')
+
 # Helper function to implement min(a, b) using Big M
 # result = min(a,b) -> result <= a, result <= b
 # a <= result + M*y, b <= result + M*(1-y) where y is binary
@@ -9,6 +11,7 @@ def add_min_constraints(prob, result_var, a_var, b_var, M, base_name):
     prob += result_var <= b_var, f"{base_name}_min_le_b"
     prob += a_var <= result_var + M * y, f"{base_name}_min_ge_a"
     prob += b_var <= result_var + M * (1 - y), f"{base_name}_min_ge_b"
+    return y
 
 
 def add_max_constraints(prob, result_var, a_var, b_var, M, base_name):
@@ -35,6 +38,9 @@ def add_max_constraints(prob, result_var, a_var, b_var, M, base_name):
         b_var: The second LpVariable or expression.
         M: A sufficiently large constant (Big M).
         base_name: A string prefix for naming the auxiliary binary variable.
+
+    Returns:
+        The binary indicator variable.
     """
     y = pulp.LpVariable(f"{base_name}_max_ind", cat=pulp.LpBinary)
     # Epsilon not typically needed here unless very strict separation is required
@@ -55,6 +61,7 @@ def add_max_constraints(prob, result_var, a_var, b_var, M, base_name):
     # 4: Enforce equality using y
     prob += result_var <= a_var + M * (1 - y), f"{base_name}_max_le_a_M"
     prob += result_var <= b_var + M * y, f"{base_name}_max_le_b_M"
+    return y
 
 
 def add_if_then_constraint(prob, condition_expr, consequence_expr, M, base_name):
@@ -78,6 +85,9 @@ def add_if_then_constraint(prob, condition_expr, consequence_expr, M, base_name)
         consequence_expr: A PuLP linear expression. The 'THEN' part enforces this <= 0.
         M: A sufficiently large constant (Big M).
         base_name: A string prefix for naming the auxiliary binary variable.
+
+    Returns:
+        The binary indicator variable.
     """
     y = pulp.LpVariable(f"{base_name}_if_then_ind", cat=pulp.LpBinary)
     # Small positive tolerance to model the strict inequality "> 0"
@@ -99,4 +109,29 @@ def add_if_then_constraint(prob, condition_expr, consequence_expr, M, base_name)
     # 2. Enforce consequence_expr <= 0 if y=1.
     #    If y=1, this forces consequence_expr <= 0.
     #    If y=0, this becomes consequence_expr <= M (relaxed).
-    prob += consequence_expr <= M * (1 - y), f"{base_name}_then_enforced"
\ No newline at end of file
+    prob += consequence_expr <= M * (1 - y), f"{base_name}_then_enforced"
+    return y
+
+
+def make_solver(entry, timelimit=None, threads=None, verbose=False):
+    """
+    Creates a PuLP solver from a settings dict (e.g. a solver portfolio
+    entry; {} gives the default CBC setup).
+
+    Args:
+        entry (dict): 'solver' (PuLP solver name, default CBC), 'gapRel',
+            'presolve' and 'seed' (CBC only).
+        timelimit (float, optional): Seconds before the best answer so far is returned.
+        threads (int, optional): Solver threads.
+    """
+    timelimit = float(timelimit) if timelimit else 90
+    name = entry.get('solver', 'PULP_CBC_CMD')
+    if name not in CBC_SOLVERS:
+        return pulp.getSolver(name, msg=verbose, timeLimit=timelimit, threads=threads,
+                              gapRel=entry.get('gapRel'))
+    options = []
+    if entry.get('seed') is not None:
+        options.append(f"randomCbcSeed {entry['seed']}")
+    return pulp.PULP_CBC_CMD(presolve=entry.get('presolve', False), threads=threads,
+                             timeLimit=timelimit, msg=verbose, gapRel=entry.get('gapRel'),
+                             options=options)
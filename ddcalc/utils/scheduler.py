@@ -0,0 +1,145 @@
+import math
+import os
+import threading
+from contextlib import contextmanager
+
+# Models with fewer binaries than this solve fastest on one thread; the
+# cost of starting and synchronizing CBC threads outweighs the parallel search.
+SMALL_MODEL_BINARIES = 100
+
+POLICIES = ['auto', 'single', 'all']
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """
+    Returns the CPU quota of the current cgroup as a number of CPUs (rounded
+    up), or None when there is no quota.
+    """
+    # cgroup v2: "max 100000" or "<quota> <period>"
+    v2 = _read('/sys/fs/cgroup/cpu.max')
+    if v2:
+        quota, _, period = v2.partition(' ')
+        if quota != 'max' and period:
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    # cgroup v1
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return max(1, math.ceil(int(quota) / int(period)))
+    return None
+
+
+def available_cpus():
+    """
+    Number of CPUs this process may use: the smaller of its CPU affinity
+    and the cgroup quota (containers often limit CPU by quota only).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError: # not available on macOS/Windows
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, limit)
+    return max(1, cpus)
+
+
+def parse_policy(value):
+    """Accepts 'auto', 'single', 'all' or a fixed thread count."""
+    if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+        count = int(value)
+        if count < 1:
+            raise ValueError("Solver thread count must be at least 1")
+        return count
+    if value not in POLICIES:
+        raise ValueError(f"Unknown solver thread policy '{value}' (use {', '.join(POLICIES)} or a number)")
+    return value
+
+
+class ThreadScheduler:
+    """
+    Hands out solver thread counts so that concurrent solves in one process
+    share the available CPUs instead of each asking CBC for all of them.
+
+    Policies:
+        auto:   a single large solve gets every CPU; concurrent solves split
+                them evenly; small models always get one thread.
+        single: one thread per solve (best for many small solves).
+        all:    every solve gets every CPU.
+        N:      every solve gets N threads.
+    """
+    def __init__(self, policy='auto', cpus=None):
+        self.policy = parse_policy(policy)
+        self.cpus = cpus or available_cpus()
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def threads_for(self, active, binaries=None):
+        if isinstance(self.policy, int):
+            return self.policy
+        if self.policy == 'single':
+            return 1
+        if self.policy == 'all':
+            return self.cpus
+        if binaries is not None and binaries < SMALL_MODEL_BINARIES:
+            return 1
+        return max(1, self.cpus // max(1, active))
+
+    @contextmanager
+    def slot(self, binaries=None):
+        """
+        Registers a running solve for the duration of the block and yields
+        the number of threads it should use.
+        """
+        with self._lock:
+            self.active += 1
+            threads = self.threads_for(self.active, binaries)
+        try:
+            yield threads
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    @contextmanager
+    def reserve(self, count=1):
+        """
+        Counts `count` solves running outside this process, e.g. in a worker
+        pool sharing its CPUs, among the running solves for the block.
+        """
+        with self._lock:
+            self.active += count
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= count
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the process-wide scheduler, creating an 'auto' one on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ThreadScheduler()
+        return _scheduler
+
+
+def configure_scheduler(policy='auto', cpus=None):
+    """Replaces the process-wide scheduler (call at startup)."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = ThreadScheduler(policy, cpus)
+        return _scheduler
@@ -0,0 +1,48 @@
+import glob
+import os
+
+import pytest
+
+from ddcalc.batch import solve_options, MODEL_OPTIONS
+from ddcalc.core.data_loader import Data
+from ddcalc.corpus import read_config
+from ddcalc.ddcalc import DDCalc
+
+EXAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'examples', '*.toml')))
+
+# Dollars a pinned variable may move either way (see solve_example)
+PIN_BAND = 0.01
+
+
+def pytest_generate_tests(metafunc):
+    if 'example' in metafunc.fixturenames:
+        metafunc.parametrize('example', EXAMPLES, ids=lambda p: os.path.basename(p)[:-5])
+
+
+def _solve_example(path, pin=None, **overrides):
+    """
+    Solves an example config with its own options, changed by overrides;
+    with pin ({variable name: value}) those variables are held at the
+    values (within PIN_BAND). Returns the DDCalc.
+    """
+    config = read_config(path)
+    data = Data()
+    data.load_config(config)
+    objective_cfg, options = solve_options(config)
+    options.update(overrides)
+    calc = DDCalc(data, objective_config=objective_cfg, profiles=False)
+    if pin:
+        calc.prepare(scaling=options['scaling'], **{k: options[k] for k in MODEL_OPTIONS})
+        for v in calc.prob.variables():
+            if v.name in pin:
+                v.lowBound, v.upBound = pin[v.name] - PIN_BAND, pin[v.name] + PIN_BAND
+        calc.solve_prepared()
+    else:
+        calc.solve(**options)
+    assert calc.status == "Optimal"
+    return calc
+
+
+@pytest.fixture
+def solve_example():
+    return _solve_example
@@ -0,0 +1,40 @@
+import os
+
+from ddcalc.batch import solve_options
+from ddcalc.core.checkpoint import Checkpoint
+from ddcalc.core.data_loader import Data
+from ddcalc.corpus import read_config
+from ddcalc.ddcalc import DDCalc
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'examples', '401k.toml')
+
+
+def solve(checkpoint, timelimit):
+    config = read_config(EXAMPLE)
+    data = Data()
+    data.load_config(config)
+    objective_cfg, options = solve_options(config)
+    options['timelimit'] = timelimit
+    calc = DDCalc(data, objective_config=objective_cfg, profiles=False, checkpoint=checkpoint)
+    calc.solve(**options)
+    return calc
+
+
+def test_first_plan_longer_than_interval(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), 'plan', interval=0.01)
+    calc = solve(checkpoint, 30)
+    # Finding the first plan took many intervals; the solve still has one
+    assert calc.metrics.solves[0]['seconds'] > checkpoint.interval
+    assert calc.status == "Optimal"
+    assert checkpoint.load()['objective'] is not None
+
+
+def test_resume_with_limit_within_interval(tmp_path):
+    solve(Checkpoint(str(tmp_path), 'plan', interval=0.01), 2)
+    saved = Checkpoint(str(tmp_path), 'plan').load()
+    checkpoint = Checkpoint(str(tmp_path), 'plan', interval=60)
+    calc = solve(checkpoint, 30)
+    assert calc.status == "Optimal"
+    resumed = checkpoint.load()
+    assert resumed['updated'] > saved['updated']
+    assert resumed['objective'] >= saved['objective'] - 0.01
@@ -0,0 +1,5 @@
+def test_multi_resolution_is_conservative(example, solve_example):
+    annual = solve_example(example, horizon='annual').get_results()['spending_floor']
+    multi = solve_example(example, horizon='multi').get_results()['spending_floor']
+    assert multi <= annual + 0.01
+    assert multi >= annual * 0.995
@@ -0,0 +1,17 @@
+import os
+import threading
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'examples', '401k.toml')
+
+
+def test_race_from_a_thread(solve_example):
+    # The server races from its worker threads; the racers must not be forked from them
+    out = {}
+    thread = threading.Thread(target=lambda: out.update(calc=solve_example(EXAMPLE, mode='race')))
+    thread.start()
+    thread.join()
+    calc = out['calc']
+    assert calc.quality['mode'] == 'race'
+    assert calc.quality['winner'] is not None
+    exact = solve_example(EXAMPLE)
+    assert abs(calc.get_results()['spending_floor'] - exact.get_results()['spending_floor']) <= 1.0
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from ddcalc.corpus import read_config
+from ddcalc.robust import solve_robust
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'examples', '401k.toml')
+
+SCENARIOS = [
+    {'name': 'low', 'returns': 4, 'inflation': 3},
+    {'name': 'mid', 'returns': 6, 'inflation': 2.5, 'weight': 2},
+    {'name': 'high', 'returns': 8, 'inflation': 2},
+]
+
+
+def test_decomposed_matches_monolithic():
+    config = read_config(EXAMPLE)
+    monolithic = solve_robust(config, SCENARIOS, 'expected', 1, 'monolithic')
+    decomposed = solve_robust(config, SCENARIOS, 'expected', 1, 'decomposed')
+    assert monolithic['status'] == decomposed['status'] == "Optimal"
+    assert decomposed['converged']
+    assert decomposed['expected_objective'] == pytest.approx(monolithic['expected_objective'], rel=1e-3)
+    for year, decisions in monolithic['first_stage'].items():
+        # Within 2% of the year's first-stage flows
+        tolerance = 0.02 * sum(decisions.values())
+        for name, value in decisions.items():
+            assert decomposed['first_stage'][year][name] == pytest.approx(value, abs=tolerance), (year, name)
+
+
+def test_worst_case_is_solved_exactly():
+    config = read_config(EXAMPLE)
+    with pytest.raises(ValueError):
+        solve_robust(config, SCENARIOS, 'worst', 1, 'decomposed')
+    worst = solve_robust(config, SCENARIOS, 'worst', 1)
+    assert worst['method'] == 'monolithic'
+    assert worst['status'] == "Optimal"
+    # No shared plan does better in its worst scenario, e.g. the best on average
+    expected = solve_robust(config, SCENARIOS, 'expected', 1, 'monolithic')
+    assert worst['worst_objective'] >= expected['worst_objective'] - 0.01
@@ -0,0 +1,25 @@
+import pytest
+
+from ddcalc.ddcalc import PLAN_DECISIONS
+
+# Dollars a yearly amount of the scaled plan may differ from the dollar model's
+PLAN_TOLERANCE = 1.0
+
+
+def test_scaled_solve_matches_unscaled(example, solve_example):
+    unscaled = solve_example(example, scaling=False).get_results()
+    scaled_calc = solve_example(example, scaling=True)
+    # Several plans often reach the same floor, and which one the solver
+    # returns depends on its path (thread count as well as scaling), so the
+    # scaled plan's yearly decisions are replayed in the dollar model
+    decisions = {v.name: v.varValue for v in scaled_calc.prob.variables()
+                 if v.name.rsplit('_', 1)[0] in PLAN_DECISIONS and v.varValue is not None}
+    replayed = solve_example(example, scaling=False, pin=decisions).get_results()
+    scaled = scaled_calc.get_results()
+    for key in ('spending_floor', 'endofplan_assets'):
+        assert scaled[key] == pytest.approx(unscaled[key], rel=1e-6, abs=0.01), key
+        assert replayed[key] == pytest.approx(unscaled[key], rel=1e-6, abs=0.01), key
+    for year, row in replayed['retire'].items():
+        for key, value in row.items():
+            if isinstance(value, (int, float)):
+                assert scaled['retire'][year][key] == pytest.approx(value, rel=1e-6, abs=PLAN_TOLERANCE), (year, key)